@@ -45,6 +45,114 @@ class Settings(BaseSettings):
     model_temperature: float = 0.7
     model_top_p: float = 0.95
     
+    # Generation Backend ("transformers" for GPU, "llamacpp" for CPU GGUF weights)
+    generation_backend: str = "transformers"
+    gguf_model_path: Optional[str] = None
+    llamacpp_threads: Optional[int] = None
+    llamacpp_context_size: int = 4096
+    # Reuse the attention KV state of the static prompt-template prefixes
+    prefix_cache_enabled: bool = True
+    
+    # Speculative Decoding (transformers backend; draft must share the tokenizer)
+    speculative_decoding_enabled: bool = False
+    speculative_draft_model: str = "meta-llama/Llama-3.2-1B"
+    speculative_endpoints: list = ["diagnosis", "lab_analysis"]
+    # Share of eligible requests decoded without the draft, as a speed baseline
+    speculative_baseline_fraction: float = 0.05
+    
+    # Inference Executor
+    inference_workers: int = 8
+    inference_max_queue: int = 16
+    inference_retry_after_seconds: int = 5
+    
+    # Admission control: priority classes share inference and generation by
+    # weight; lower classes may only fill part of the queue and are shed when
+    # their predicted queue wait exceeds the SLO
+    admission_weights: dict = {"interactive": 8, "normal": 3, "background": 1}
+    admission_queue_shares: dict = {"interactive": 1.0, "normal": 0.75, "background": 0.5}
+    admission_queue_slo_ms: dict = {"interactive": 2000, "normal": 15000, "background": 120000}
+    admission_max_per_user: int = 4
+    # Proxies (addresses or CIDR ranges) whose X-Forwarded-For is believed when
+    # keying anonymous callers; without them every anonymous request arriving
+    # through a proxy shares the proxy's per-user cap
+    admission_trusted_proxies: list = []
+    # First path fragment that matches decides a request's class (default "normal");
+    # clients may lower, never raise, it with an X-Priority header
+    admission_route_priorities: dict = {
+        "/batch": "background",
+        "/api/knowledge/": "background",
+        "/api/medical/": "interactive",
+    }
+    
+    # Request deadlines: generation stops once a request's deadline passes or
+    # its client disconnects. First matching path fragment sets the default;
+    # an X-Request-Timeout-Ms header overrides it up to the maximum
+    request_timeout_ms: float = 120000
+    request_timeout_route_ms: dict = {"/stream": 300000, "/batch": 600000}
+    request_timeout_max_ms: float = 600000
+    
+    # Fan-out endpoints (/diagnosis/explain, /symptoms/analyze) run the knowledge
+    # base and the model concurrently, each under its own timeout; in partial
+    # mode the AI part is left running and fetched later by result ID
+    fanout_structured_timeout_ms: float = 2000
+    fanout_ai_timeout_ms: float = 60000
+    pending_results_max_entries: int = 1024
+    pending_results_ttl_seconds: int = 600
+    # Also keep them under hf_cache_dir/pending_results so a poll can land on any worker
+    pending_results_shared: bool = True
+    
+    # Generation Scheduler
+    generation_max_batch_size: int = 8
+    generation_max_wait_ms: float = 25
+    
+    # Response Cache
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_seconds: int = 86400
+    response_cache_disk: bool = True
+    
+    # Semantic Cache (cosine similarity thresholds per route)
+    semantic_cache_enabled: bool = True
+    semantic_cache_max_entries: int = 2048
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_route_thresholds: dict = {"explain": 0.92, "symptoms": 0.95}
+    
+    # RAG Knowledge Index (versioned by corpus content hash)
+    knowledge_index_dir: str = "./medical_knowledge_db"
+    # Seconds between checks for builds and ingestions published by other workers
+    knowledge_index_check_seconds: float = 5.0
+    rag_chunk_size: int = 500
+    rag_chunk_overlap: int = 50
+    # "chroma" or "flat" (memory-mapped matrix shared across workers)
+    vector_backend: str = "chroma"
+    flat_index_dtype: str = "float16"
+    # "vector" or "hybrid" (BM25 + vector, reciprocal rank fusion)
+    retrieval_mode: str = "hybrid"
+    hybrid_candidates: int = 20
+    hybrid_rrf_k: int = 60
+    retrieval_cache_size: int = 512
+    # Curated article ingestion (.txt/.md/.jsonl under knowledge_sources_dir)
+    knowledge_sources_dir: str = "./knowledge_sources"
+    ingest_batch_size: int = 256
+    ingest_checkpoint_every: int = 10
+    # Uploaded documents, indexed per patient for patient-scoped explanations
+    patient_index_enabled: bool = True
+    patient_index_dir: str = "./patient_documents_db"
+    patient_rag_k: int = 2
+    # Roles that may name any patient; other callers only reach their own documents
+    patient_scope_roles: list = ["doctor", "admin"]
+    
+    # Medical glossary: optional JSON {term: plain language} merged into the built-in terms
+    medical_glossary_path: Optional[str] = None
+    
+    # Risk rules: optional JSON rule set replacing the built-in one, re-read when the file changes
+    risk_rules_path: Optional[str] = None
+    risk_rules_check_seconds: float = 5.0
+    
+    # Lab trends: per patient and test online statistics, updated as results are saved
+    trend_ewma_alpha: float = 0.3
+    trend_store_max_patients: int = 10000
+    
     # Redis (optional)
     redis_url: Optional[str] = None
     
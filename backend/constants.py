@@ -11,17 +11,23 @@ API_UNAUTHORIZED = "unauthorized"
 API_FORBIDDEN = "forbidden"
 
 # Medical Constants
+# Reference range per lab test, the single source for every analyzer (compiled
+# by services.reference_ranges); optional "warning" / "critical" keys override
+# the default percent deviation cut points for a test
 NORMAL_RANGES = {
-    "glucose": {"min": 70, "max": 100, "unit": "mg/dL"},
-    "hba1c": {"min": 4.0, "max": 5.6, "unit": "%"},
-    "cholesterol": {"min": 125, "max": 200, "unit": "mg/dL"},
-    "ldl": {"min": 0, "max": 100, "unit": "mg/dL"},
-    "hdl": {"min": 40, "max": 60, "unit": "mg/dL"},
-    "triglycerides": {"min": 0, "max": 150, "unit": "mg/dL"},
-    "creatinine": {"min": 0.6, "max": 1.2, "unit": "mg/dL"},
-    "bun": {"min": 7, "max": 20, "unit": "mg/dL"},
-    "sodium": {"min": 135, "max": 145, "unit": "mmol/L"},
-    "potassium": {"min": 3.5, "max": 5.0, "unit": "mmol/L"},
+    "glucose": {"min": 70, "max": 100, "unit": "mg/dL", "category": "Metabolic"},
+    "hba1c": {"min": 4.0, "max": 5.6, "unit": "%", "category": "Metabolic"},
+    "cholesterol": {"min": 125, "max": 200, "unit": "mg/dL", "category": "Cardiovascular"},
+    "ldl": {"min": 0, "max": 100, "unit": "mg/dL", "category": "Cardiovascular"},
+    "hdl": {"min": 40, "max": 60, "unit": "mg/dL", "category": "Cardiovascular"},
+    "triglycerides": {"min": 0, "max": 150, "unit": "mg/dL", "category": "Cardiovascular"},
+    "creatinine": {"min": 0.6, "max": 1.2, "unit": "mg/dL", "category": "Renal"},
+    "bun": {"min": 7, "max": 20, "unit": "mg/dL", "category": "Renal"},
+    "sodium": {"min": 135, "max": 145, "unit": "mmol/L", "category": "Electrolytes"},
+    "potassium": {"min": 3.5, "max": 5.0, "unit": "mmol/L", "category": "Electrolytes"},
+    "wbc": {"min": 4.5, "max": 11.0, "unit": "10^3/uL", "category": "Hematology"},
+    "hemoglobin": {"min": 13.5, "max": 17.5, "unit": "g/dL", "category": "Hematology"},
+    "platelets": {"min": 150, "max": 450, "unit": "10^3/uL", "category": "Hematology"},
 }
 
 # Risk Levels
@@ -35,6 +35,22 @@ class ModelError(MediclinicException):
     def __init__(self, message: str = "AI model error", code: str = "model_error"):
         super().__init__(message, code, 503)
 
+class ServiceOverloadedError(MediclinicException):
+    """Inference capacity exhausted, client should retry later"""
+    def __init__(self, message: str = "AI service is busy, please retry shortly", code: str = "service_overloaded", retry_after: int = 5):
+        super().__init__(message, code, 503)
+        self.retry_after = retry_after
+    
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+class DeadlineExceededError(MediclinicException):
+    """Generation stopped because the request's deadline passed or its client went away"""
+    def __init__(self, message: str = "Request deadline exceeded", code: str = "deadline_exceeded", reason: str = "deadline"):
+        super().__init__(message, code, 504)
+        self.reason = reason
+
 class DatabaseError(MediclinicException):
     """Database related errors"""
     def __init__(self, message: str = "Database error", code: str = "database_error"):
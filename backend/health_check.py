@@ -8,7 +8,10 @@ import logging
 from fastapi import APIRouter
 
 from config import settings
-from services.llama_service import LlamaMedicalService
+from services.llama_service import get_llama_service
+from services.model_registry import model_registry
+from services.inference_executor import inference_executor
+from services.pending_results import pending_results
 from database import db
 
 logger = logging.getLogger(__name__)
@@ -19,7 +22,7 @@ class HealthChecker:
     """Health check service"""
     
     def __init__(self):
-        self.llama_service = LlamaMedicalService()
+        self.llama_service = get_llama_service()
         self.checks = [
             self.check_database,
             self.check_llama_model,
@@ -209,6 +212,20 @@ async def liveness_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@router.get("/models")
+async def model_registry_status():
+    """Report shared model artifacts, their memory footprint and load time"""
+    return model_registry.describe()
+
+@router.get("/inference")
+async def inference_status():
+    """Report inference executor load and counters"""
+    return {
+        "executor": inference_executor.get_stats(),
+        "pending_results": pending_results.get_stats(),
+        **health_checker.llama_service.get_inference_metrics()
+    }
+
 @router.get("/version")
 async def version_info():
     """Get version information"""
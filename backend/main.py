@@ -11,15 +11,19 @@ import logging
 
 from config import settings
 from database import db
-from middleware import LoggingMiddleware, SecurityMiddleware, ErrorHandlingMiddleware
-from services.llama_service import LlamaMedicalService
+from middleware import LoggingMiddleware, SecurityMiddleware, ErrorHandlingMiddleware, PriorityMiddleware, DeadlineMiddleware
+from services.llama_service import get_llama_service
 from services.supabase_service import SupabaseService
+from services.inference_executor import inference_executor
+from exceptions import DeadlineExceededError, ServiceOverloadedError
 
 # Import routers
 from routers.medical import router as medical_router
 from routers.documents import router as documents_router
 from routers.analysis import router as analysis_router
 from routers.auth import router as auth_router
+from routers.knowledge import router as knowledge_router
+from health_check import router as health_router
 
 # Configure logging
 logging.basicConfig(
@@ -29,7 +33,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize services
-llama_service = LlamaMedicalService()
+llama_service = get_llama_service()
 supabase_service = SupabaseService()
 
 # Create FastAPI app
@@ -46,6 +50,8 @@ app = FastAPI(
 app.add_middleware(LoggingMiddleware)
 app.add_middleware(SecurityMiddleware)
 app.add_middleware(ErrorHandlingMiddleware)
+app.add_middleware(PriorityMiddleware)
+app.add_middleware(DeadlineMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -68,6 +74,8 @@ app.include_router(medical_router, prefix=settings.api_prefix)
 app.include_router(documents_router, prefix=settings.api_prefix)
 app.include_router(analysis_router, prefix=settings.api_prefix)
 app.include_router(auth_router, prefix=settings.api_prefix)
+app.include_router(knowledge_router, prefix=settings.api_prefix)
+app.include_router(health_router)
 
 # Startup event
 @app.on_event("startup")
@@ -95,6 +103,7 @@ async def shutdown_event():
     """Run on application shutdown"""
     logger.info("Shutting down application")
     db.disconnect()
+    inference_executor.shutdown()
 
 # Root endpoint
 @app.get("/")
@@ -180,7 +189,7 @@ async def demo_analysis():
     }
     
     try:
-        analysis = llama_service.analyze_lab_results(demo_data)
+        analysis = await llama_service.analyze_lab_results_async(demo_data)
         
         return JSONResponse(content={
             "success": True,
@@ -189,6 +198,10 @@ async def demo_analysis():
             "note": "This is demo analysis using sample data",
             "timestamp": datetime.now().isoformat()
         })
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
         logger.error(f"Demo analysis error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
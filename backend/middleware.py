@@ -1,10 +1,19 @@
 import time
 import json
+import asyncio
+import ipaddress
 from fastapi import Request
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from config import settings
+from auth import AuthService
+from services.admission import PRIORITIES, classify_path, rank, request_priority
+from services.deadlines import DISCONNECT, Deadline, request_deadline
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +86,136 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         
         return response
 
+_trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.admission_trusted_proxies]
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_proxies)
+
+def client_address(request: Request) -> str:
+    """Address of the client, looking through trusted proxies
+
+    X-Forwarded-For is only believed when the peer is a trusted proxy; its
+    right-most address that is not itself a trusted proxy is the client.
+    """
+    address = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(address):
+        return address
+    forwarded = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+class PriorityMiddleware(BaseHTTPMiddleware):
+    """Middleware that runs each request in its admission priority class"""
+    
+    async def dispatch(self, request: Request, call_next):
+        priority = classify_path(request.url.path, settings.admission_route_priorities)
+        
+        # Callers may ask for a lower class (e.g. prefetching), never a higher one
+        requested = request.headers.get("X-Priority", "").lower()
+        if requested in PRIORITIES and rank(requested) > rank(priority):
+            priority = requested
+        
+        # The verified token payload, for routes that act on the caller's identity
+        request.state.principal = self._principal(request)
+        with request_priority(priority, self._caller(request)):
+            response = await call_next(request)
+        response.headers["X-Priority"] = priority
+        return response
+    
+    @staticmethod
+    def _principal(request: Request) -> Optional[Dict[str, Any]]:
+        """Payload of a valid bearer token that names a user, else None"""
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            payload = AuthService.verify_token(authorization[7:])
+            if payload and payload.get("user_id") is not None:
+                return payload
+        return None
+    
+    @staticmethod
+    def _caller(request: Request) -> str:
+        """Authenticated user ID, else the client address"""
+        principal = request.state.principal
+        if principal is not None:
+            return f"user:{principal['user_id']}"
+        return f"ip:{client_address(request)}"
+
+class DeadlineMiddleware:
+    """ASGI middleware that gives each request a deadline and trips it early on client disconnect
+    
+    Written against raw ASGI rather than BaseHTTPMiddleware so it can watch the
+    receive channel: once the request body has been read, the only message
+    left to arrive is ``http.disconnect``.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        deadline = Deadline(self._timeout(scope["path"], Headers(scope=scope)))
+        body_read = asyncio.Event()
+        response_sent = False
+        
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                if not response_sent:
+                    deadline.cancel(DISCONNECT)
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+        
+        async def send_wrapper(message: Message):
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+        
+        async def watch_disconnect():
+            await body_read.wait()
+            while not response_sent:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    if not response_sent:
+                        deadline.cancel(DISCONNECT)
+                    return
+        
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            with request_deadline(deadline):
+                await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            watcher.cancel()
+    
+    @staticmethod
+    def _timeout(path: str, headers: Headers) -> Optional[float]:
+        """Seconds until the deadline: the X-Request-Timeout-Ms header, else the route default"""
+        timeout_ms = settings.request_timeout_ms
+        for pattern, route_ms in settings.request_timeout_route_ms.items():
+            if pattern in path:
+                timeout_ms = route_ms
+                break
+        try:
+            requested = float(headers.get("X-Request-Timeout-Ms", 0))
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            timeout_ms = requested
+        if not timeout_ms or timeout_ms <= 0:
+            return None
+        return min(timeout_ms, settings.request_timeout_max_ms) / 1000.0
+
 class ErrorHandlingMiddleware(BaseHTTPMiddleware):
     """Middleware for error handling"""
     
@@ -9,7 +9,17 @@ class ExplanationRequest(BaseModel):
     language: str = Field("english", description="Output language")
     simplify_level: str = Field("patient", description="Simplification level (patient, student, professional)")
     include_examples: bool = Field(True, description="Include examples in explanation")
-    max_length: Optional[int] = Field(500, description="Maximum explanation length")
+    max_length: Optional[int] = Field(500, description="Maximum explanation length in words")
+    patient_id: Optional[str] = Field(None, description="Also retrieve from this patient's uploaded documents (the caller's own unless a clinician)")
+
+class ExplanationBatchRequest(BaseModel):
+    """Request model for explaining several medical texts at once"""
+    items: List[str] = Field(..., min_items=1, max_items=64, description="Terms, phrases or lab values to explain")
+    context: Optional[str] = Field("", description="Context shared by every item")
+    simplify_level: str = Field("patient", description="Simplification level (patient, student, professional)")
+    include_examples: bool = Field(True, description="Include examples in explanation")
+    max_length: Optional[int] = Field(500, description="Maximum explanation length in words")
+    patient_id: Optional[str] = Field(None, description="Also retrieve from this patient's uploaded documents (the caller's own unless a clinician)")
 
 class DiagnosisRequest(BaseModel):
     """Request model for diagnosis explanation"""
@@ -20,6 +30,7 @@ class DiagnosisRequest(BaseModel):
     include_treatments: bool = Field(True, description="Include treatment options")
     include_prognosis: bool = Field(True, description="Include prognosis information")
     include_prevention: bool = Field(True, description="Include prevention strategies")
+    partial: bool = Field(False, description="Return the structured explanation at once and poll for the AI part")
 
 class LabAnalysisRequest(BaseModel):
     """Request model for lab result analysis"""
@@ -40,6 +51,10 @@ class MedicationExplanationRequest(BaseModel):
     include_side_effects: bool = Field(True, description="Include side effects")
     include_contraindications: bool = Field(True, description="Include contraindications")
 
+class MedicationBatchRequest(BaseModel):
+    """Request model for explaining several medications at once"""
+    medication_names: List[str] = Field(..., min_items=1, max_items=64, description="Medication names")
+
 class SymptomAnalysisRequest(BaseModel):
     """Request model for symptom analysis"""
     symptoms: List[str] = Field(..., min_items=1, description="List of symptoms")
@@ -49,6 +64,12 @@ class SymptomAnalysisRequest(BaseModel):
     include_possible_conditions: bool = Field(True, description="Include possible conditions")
     include_when_to_seek_help: bool = Field(True, description="Include when to seek medical help")
     include_home_remedies: bool = Field(True, description="Include home remedies")
+    partial: bool = Field(False, description="Return the symptom analysis at once and poll for the AI context")
+
+class KnowledgeIngestRequest(BaseModel):
+    """Request model for knowledge base ingestion"""
+    paths: List[str] = Field(..., min_items=1, description="Files or directories under the knowledge sources directory")
+    resume: bool = Field(True, description="Resume from the last checkpoint of the same sources")
 
 class HealthReportRequest(BaseModel):
     """Request model for health report generation"""
@@ -71,6 +92,12 @@ class ChartGenerationRequest(BaseModel):
     color_scheme: str = Field("medical", description="Color scheme")
     include_annotations: bool = Field(True, description="Include annotations")
 
+class CohortAnalysisRequest(BaseModel):
+    """Request model for scoring many lab panels at once, one list entry per patient"""
+    lab_data: Dict[str, List[Optional[float]]] = Field(..., description="Test name to values, null where not measured")
+    ages: Optional[List[Optional[float]]] = Field(None, description="Patient ages (default 50)")
+    patient_ids: Optional[List[str]] = Field(None, description="Patient identifiers, in the same order")
+
 class RiskAssessmentRequest(BaseModel):
     """Request model for risk assessment"""
     patient_data: Dict[str, Any] = Field(..., description="Patient data including labs, vitals, etc.")
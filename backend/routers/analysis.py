@@ -1,11 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, List, Optional
 from datetime import datetime
 import json
+import numpy as np
 
+from models.ai_models import CohortAnalysisRequest
 from services.visualization_service import VisualizationService
 from services.medical_analyzer import MedicalAnalyzer
 from services.supabase_service import SupabaseService
+from services.risk_rules import risk_rules
+from routers.auth import patient_scope
 
 router = APIRouter(prefix="/api/analysis", tags=["analysis"])
 
@@ -61,6 +66,50 @@ async def assess_risk(lab_data: Dict, patient_info: Optional[Dict] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/risk/rules")
+async def get_risk_rules():
+    """Active risk rule set and reload status"""
+    return {
+        "rule_set": risk_rules.current.spec,
+        **risk_rules.get_stats()
+    }
+
+@router.post("/risk/rules/reload")
+async def reload_risk_rules():
+    """Re-read the risk rule file now (other workers pick up changes on their own)"""
+    if not risk_rules.path:
+        raise HTTPException(status_code=400, detail="No risk rule file configured")
+    reloaded = risk_rules.reload()
+    return {
+        "reloaded": reloaded,
+        **risk_rules.get_stats()
+    }
+
+@router.post("/cohort")
+async def analyze_cohort(request: CohortAnalysisRequest):
+    """Score a cohort of lab panels in one vectorized pass, returned column by column"""
+    lengths = {len(values) for values in request.lab_data.values()}
+    for extra in (request.ages, request.patient_ids):
+        if extra is not None:
+            lengths.add(len(extra))
+    if len(lengths) > 1:
+        raise HTTPException(status_code=400, detail="All columns must have one entry per patient")
+    
+    try:
+        # null values become NaN, i.e. not measured
+        columns = {test: np.array(values, dtype=float) for test, values in request.lab_data.items()}
+        results = await run_in_threadpool(medical_analyzer.analyze_cohort, columns, request.ages)
+        
+        return {
+            "patients": len(results),
+            "patient_ids": request.patient_ids,
+            "columns": results.astype(object).where(results.notna(), None).to_dict(orient="list"),
+            "analyzed_at": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/patient/{patient_id}/summary")
 async def get_patient_summary(patient_id: str):
     """Get comprehensive patient health summary"""
@@ -82,16 +131,14 @@ async def get_patient_summary(patient_id: str):
         
         # Analyze latest lab if available
         latest_analysis = {}
-        if lab_history and len(lab_history) > 0:
-            latest_labs = lab_history[0].get("lab_data", {})
-            latest_analysis = medical_analyzer.categorize_lab_results(latest_labs)
-        
-        # Calculate overall health score
         health_score = {"score": 0, "status": "Insufficient Data"}
-        if latest_analysis:
-            health_score = medical_analyzer.calculate_health_score(
-                {k: v.get("value", 0) for k, v in latest_analysis.items() if "value" in v}
-            )
+        if lab_history and len(lab_history) > 0:
+            context = medical_analyzer.analyze(lab_history[0].get("lab_data", {}))
+            latest_analysis = context.categorized
+            
+            # Calculate overall health score
+            if latest_analysis:
+                health_score = context.health_score
         
         # Generate timeline
         timeline_data = []
@@ -155,10 +202,19 @@ async def get_patient_summary(patient_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/trends")
-async def analyze_trends(historical_labs: List[Dict]):
-    """Analyze trends from historical lab data"""
+async def analyze_trends(http_request: Request, historical_labs: Optional[List[Dict]] = None,
+                         patient_id: Optional[str] = None):
+    """Analyze trends from historical lab data, or from a patient's stored trend state"""
+    patient_id = patient_scope(http_request, patient_id)
+    if patient_id is None and historical_labs is None:
+        raise HTTPException(status_code=400, detail="Provide historical lab data or a patient_id")
+    
     try:
-        trends = medical_analyzer.generate_trend_analysis(historical_labs)
+        if patient_id is not None:
+            # Kept up to date as lab results are saved, no history scan
+            trends = medical_analyzer.summarize_trends(supabase_service.get_lab_trends(patient_id))
+        else:
+            trends = medical_analyzer.generate_trend_analysis(historical_labs)
         
         # Generate trend chart
         trend_chart_data = {}
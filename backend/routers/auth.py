@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
 from typing import Optional, Dict
 from datetime import datetime, timedelta
 import jwt
 from jwt.exceptions import InvalidTokenError
 
+from config import settings
+
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 # In production, use environment variables
@@ -62,6 +64,26 @@ async def verify_token(authorization: str = Header(None)):
     except Exception:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
+def patient_scope(http_request: Request, patient_id: Optional[str]) -> Optional[str]:
+    """Patient whose data a request may touch, checked against the caller's token
+
+    Patients only reach their own records and documents; clinician roles
+    (``settings.patient_scope_roles``) may name any patient. A patient_id
+    in the request is never trusted on its own.
+    """
+    if patient_id is None:
+        return None
+    principal = getattr(http_request.state, "principal", None)
+    if principal is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Patient-scoped requests require authentication",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    if principal.get("role") in settings.patient_scope_roles or str(principal["user_id"]) == patient_id:
+        return patient_id
+    raise HTTPException(status_code=403, detail="Not authorized for this patient's data")
+
 @router.post("/login")
 async def login(email: str, password: str):
     """User login"""
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, HTTPException, Request
 from typing import List, Optional
 import shutil
 import os
@@ -6,20 +6,27 @@ from datetime import datetime
 
 from services.document_processor import DocumentProcessor
 from services.supabase_service import SupabaseService
+from services.llama_service import get_llama_service
+from routers.auth import patient_scope
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
 
 document_processor = DocumentProcessor()
 supabase_service = SupabaseService()
+llama_service = get_llama_service()
 
 @router.post("/upload")
 async def upload_document(
+    http_request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     document_type: str = Form("lab_report"),
     patient_id: str = Form(...),
     description: Optional[str] = Form("")
 ):
     """Upload and process medical document"""
+    # Stored and embedded under this patient, so only they or a clinician may upload
+    patient_id = patient_scope(http_request, patient_id)
     try:
         # Validate file type
         allowed_extensions = {'.pdf', '.docx', '.txt', '.jpg', '.png', '.jpeg'}
@@ -44,7 +51,8 @@ async def upload_document(
             shutil.copyfileobj(file.file, buffer)
         
         # Process document
-        processed_data = document_processor.process_document(file_path, document_type)
+        text = document_processor.extract_text(file_path)
+        processed_data = document_processor.process_text(text, document_type)
         
         # Save to database
         document_record = {
@@ -63,6 +71,14 @@ async def upload_document(
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save document to database")
         
+        # Embed into the patient's partition after the response is sent
+        background_tasks.add_task(
+            llama_service.index_patient_document,
+            patient_id,
+            text,
+            {"document_type": document_type, "filename": file.filename, "uploaded_at": document_record["uploaded_at"]}
+        )
+        
         return {
             "success": True,
             "message": "Document uploaded and processed successfully",
@@ -132,21 +148,17 @@ async def delete_document(document_id: str, patient_id: str):
 
 @router.post("/process/text")
 async def process_text_document(
+    http_request: Request,
+    background_tasks: BackgroundTasks,
     text: str = Form(...),
     document_type: str = Form("doctor_note"),
     patient_id: str = Form(...)
 ):
     """Process text as a document"""
+    patient_id = patient_scope(http_request, patient_id)
     try:
         # Process the text
-        if document_type == "lab_report":
-            processed_data = document_processor.process_lab_report(text)
-        elif document_type == "doctor_note":
-            processed_data = document_processor.process_doctor_notes(text)
-        elif document_type == "prescription":
-            processed_data = document_processor.process_prescription(text)
-        else:
-            processed_data = document_processor.process_general_document(text)
+        processed_data = document_processor.process_text(text, document_type)
         
         # Save to database
         document_record = {
@@ -160,6 +172,13 @@ async def process_text_document(
         }
         
         success = supabase_service.save_document(document_record)
+        if success:
+            background_tasks.add_task(
+                llama_service.index_patient_document,
+                patient_id,
+                text,
+                {"document_type": document_type, "filename": document_record["filename"], "uploaded_at": document_record["uploaded_at"]}
+            )
         
         return {
             "success": success,
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException
+
+from models.ai_models import KnowledgeIngestRequest
+from services.llama_service import get_llama_service
+
+router = APIRouter(prefix="/api/knowledge", tags=["knowledge"])
+
+llama_service = get_llama_service()
+
+@router.post("/ingest", status_code=202)
+async def ingest_knowledge(request: KnowledgeIngestRequest):
+    """Stream curated articles into the knowledge index in the background"""
+    try:
+        return llama_service.ingest_knowledge(request.paths, resume=request.resume)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/ingest/status")
+async def get_ingestion_status():
+    """Progress and throughput (chunks/sec) of the current or last ingestion"""
+    return llama_service.get_ingestion_status()
+
+@router.get("/index")
+async def get_knowledge_index():
+    """Active knowledge index version and size"""
+    index = getattr(llama_service, "knowledge_index", None)
+    if index is None:
+        raise HTTPException(status_code=503, detail="Knowledge index is not available")
+    return index.describe()
@@ -1,98 +1,251 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
+import asyncio
+import contextvars
 import json
+import time
 
 from models.ai_models import (
     ExplanationRequest,
+    ExplanationBatchRequest,
     DiagnosisRequest,
     LabAnalysisRequest,
     MedicationExplanationRequest,
+    MedicationBatchRequest,
     SymptomAnalysisRequest
 )
-from services.llama_service import LlamaMedicalService
+from services.llama_service import get_llama_service
 from services.diagnosis_explainer import DiagnosisExplainer
 from services.medical_analyzer import MedicalAnalyzer
+from services.deadlines import Deadline, current_deadline, request_deadline
+from services.pending_results import pending_results
+from services.supabase_service import SupabaseService
+from routers.auth import patient_scope
+from exceptions import DeadlineExceededError, ServiceOverloadedError
+from config import settings
 
 router = APIRouter(prefix="/api/medical", tags=["medical"])
 
-llama_service = LlamaMedicalService()
+llama_service = get_llama_service()
 diagnosis_explainer = DiagnosisExplainer()
 medical_analyzer = MedicalAnalyzer()
+supabase_service = SupabaseService()
+
+def _in_context(context: contextvars.Context, chunks: Iterator[str]) -> Iterator[str]:
+    """Pull a stream inside the request's context (priority, deadline) whichever
+    threadpool thread the server iterates it on"""
+    iterator = iter(chunks)
+    try:
+        while True:
+            chunk = context.run(next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Closing the source stops generation if the client went away early
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            context.run(close)
+
+def _sse_response(chunks: Iterator[str]) -> StreamingResponse:
+    """Wrap a text stream as server-sent events (token*, then done or error)"""
+    context = contextvars.copy_context()
+    
+    def events():
+        started = time.perf_counter()
+        first_token_ms = None
+        try:
+            for chunk in _in_context(context, chunks):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield f"event: token\ndata: {json.dumps({'text': chunk})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        done = {
+            "time_to_first_token_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "completed_at": datetime.now().isoformat()
+        }
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _model_call(call, *args, **kwargs):
+    """A model call whose generation stops once the AI branch's timeout passes"""
+    deadline = Deadline(settings.fanout_ai_timeout_ms / 1000.0, parent=current_deadline())
+    with request_deadline(deadline):
+        return await call(*args, **kwargs)
+
+async def _branch(awaitable: Awaitable, timeout_ms: float) -> Tuple[Any, Dict]:
+    """Await one fan-out branch under its own timeout: (result or None, branch status)"""
+    started = time.perf_counter()
+    result, status = None, "ok"
+    try:
+        result = await asyncio.wait_for(awaitable, timeout_ms / 1000.0)
+    except (asyncio.TimeoutError, DeadlineExceededError):
+        status = "timeout"
+    except ServiceOverloadedError:
+        status = "overloaded"
+    return result, {"status": status, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+async def _fan_out(structured: Awaitable, ai: Awaitable, kind: str, partial: bool, http_request: Request) -> Tuple[Any, Any, Dict]:
+    """Run the knowledge-base and model branches concurrently
+    
+    Returns (structured result, AI result, branch statuses). In partial mode
+    the AI branch keeps running after the response and its place holds a
+    pending marker with the URL to poll for it.
+    """
+    if partial:
+        result_id = pending_results.submit(ai, kind, timeout=settings.fanout_ai_timeout_ms / 1000.0)
+        structured_result, structured_branch = await _branch(structured, settings.fanout_structured_timeout_ms)
+        pending = {
+            "status": "pending",
+            "result_id": result_id,
+            "poll_url": str(http_request.url_for("get_pending_result", result_id=result_id))
+        }
+        return structured_result, pending, {"structured": structured_branch, "ai": {"status": "pending"}}
+    
+    (structured_result, structured_branch), (ai_result, ai_branch) = await asyncio.gather(
+        _branch(structured, settings.fanout_structured_timeout_ms),
+        _branch(ai, settings.fanout_ai_timeout_ms)
+    )
+    if ai_result is None:
+        ai_result = {"status": ai_branch["status"]}
+    return structured_result, ai_result, {"structured": structured_branch, "ai": ai_branch}
 
 @router.post("/explain")
-async def explain_medical(request: ExplanationRequest):
+async def explain_medical(request: ExplanationRequest, http_request: Request):
     """Explain medical text in simple terms"""
+    patient_id = patient_scope(http_request, request.patient_id)
     try:
-        explanation = llama_service.explain_medical_text(
+        explanation = await llama_service.explain_medical_text_async(
             text=request.text,
-            context=request.context
+            context=request.context,
+            max_length=request.max_length,
+            simplify_level=request.simplify_level,
+            include_examples=request.include_examples,
+            patient_id=patient_id
         )
         return explanation
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/diagnosis/explain")
-async def explain_diagnosis(request: DiagnosisRequest):
-    """Explain medical diagnosis"""
+@router.post("/explain/batch")
+async def explain_medical_batch(request: ExplanationBatchRequest, http_request: Request):
+    """Explain a list of medical texts in one call; results keep input order"""
+    patient_id = patient_scope(http_request, request.patient_id)
     try:
-        # Use diagnosis explainer for comprehensive explanation
-        explanation = diagnosis_explainer.explain_diagnosis(
-            diagnosis=request.diagnosis,
-            patient_context={
-                "age": request.patient_age,
-                "gender": request.patient_gender,
-                "notes": request.notes
-            }
+        return await llama_service.explain_medical_batch_async(
+            request.items,
+            context=request.context,
+            max_length=request.max_length,
+            simplify_level=request.simplify_level,
+            include_examples=request.include_examples,
+            patient_id=patient_id
         )
-        
-        # Also get Llama's perspective
-        llama_explanation = llama_service.explain_diagnosis(
-            diagnosis=request.diagnosis,
-            notes=request.notes
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/explain/stream")
+async def explain_medical_stream(request: ExplanationRequest, http_request: Request):
+    """Stream a medical text explanation as server-sent events"""
+    patient_id = patient_scope(http_request, request.patient_id)
+    return _sse_response(llama_service.stream_medical_text(
+        text=request.text,
+        context=request.context,
+        max_length=request.max_length,
+        simplify_level=request.simplify_level,
+        include_examples=request.include_examples,
+        patient_id=patient_id
+    ))
+
+@router.post("/diagnosis/explain")
+async def explain_diagnosis(request: DiagnosisRequest, http_request: Request):
+    """Explain medical diagnosis from the knowledge base and Llama, concurrently"""
+    try:
+        explanation, llama_explanation, branches = await _fan_out(
+            # Structured explanation from the diagnosis knowledge base
+            run_in_threadpool(
+                diagnosis_explainer.explain_diagnosis,
+                diagnosis=request.diagnosis,
+                patient_context={
+                    "age": request.patient_age,
+                    "gender": request.patient_gender,
+                    "notes": request.notes
+                }
+            ),
+            # Llama's perspective
+            _model_call(
+                llama_service.explain_diagnosis_async,
+                diagnosis=request.diagnosis,
+                notes=request.notes,
+                include_treatments=request.include_treatments,
+                include_prognosis=request.include_prognosis,
+                include_prevention=request.include_prevention
+            ),
+            "diagnosis",
+            request.partial,
+            http_request
         )
         
         return {
             "structured_explanation": explanation,
             "ai_explanation": llama_explanation,
+            "branches": branches,
             "combined_at": datetime.now().isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/diagnosis/explain/stream")
+async def explain_diagnosis_stream(request: DiagnosisRequest):
+    """Stream the AI diagnosis explanation as server-sent events"""
+    return _sse_response(llama_service.stream_diagnosis(
+        diagnosis=request.diagnosis,
+        notes=request.notes,
+        include_treatments=request.include_treatments,
+        include_prognosis=request.include_prognosis,
+        include_prevention=request.include_prevention
+    ))
+
 @router.post("/labs/analyze")
 async def analyze_labs(request: LabAnalysisRequest):
     """Analyze lab results"""
     try:
-        # Get AI analysis
-        ai_analysis = llama_service.analyze_lab_results(request.lab_data)
-        
-        # Get medical analyzer categorization
-        categorization = medical_analyzer.categorize_lab_results(request.lab_data)
-        
-        # Calculate health score
-        health_score = medical_analyzer.calculate_health_score(request.lab_data)
+        # Categorization, score and risks are computed once and shared
+        context = medical_analyzer.analyze(request.lab_data, request.patient_info)
         
-        # Detect risk factors
-        risk_factors = medical_analyzer.detect_risk_factors(
-            request.lab_data,
-            request.patient_info.get("age", 50) if request.patient_info else 50
-        )
-        
-        # Generate health report
-        health_report = medical_analyzer.generate_health_report(
-            request.lab_data,
-            request.patient_info
-        )
+        # Get AI analysis
+        ai_analysis = await llama_service.analyze_lab_results_async(request.lab_data, context)
         
         return {
             "ai_analysis": ai_analysis,
-            "categorization": categorization,
-            "health_score": health_score,
-            "risk_factors": risk_factors,
-            "health_report": health_report,
+            "categorization": context.categorized,
+            "health_score": context.health_score,
+            "risk_factors": context.risk_factors,
+            "health_report": context.health_report,
             "analyzed_at": datetime.now().isoformat()
         }
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -100,7 +253,7 @@ async def analyze_labs(request: LabAnalysisRequest):
 async def explain_medication(request: MedicationExplanationRequest):
     """Explain medication"""
     try:
-        explanation = llama_service.explain_medication(request.medication_name)
+        explanation = await llama_service.explain_medication_async(request.medication_name)
         
         # Add context about patient conditions
         if request.patient_conditions:
@@ -110,31 +263,71 @@ async def explain_medication(request: MedicationExplanationRequest):
             }
         
         return explanation
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/medications/explain/batch")
+async def explain_medications_batch(request: MedicationBatchRequest):
+    """Explain a list of medications in one call; results keep input order"""
+    try:
+        return await llama_service.explain_medications_batch_async(request.medication_names)
+    except ServiceOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/medications/explain/stream")
+async def explain_medication_stream(request: MedicationExplanationRequest):
+    """Stream a medication explanation as server-sent events"""
+    return _sse_response(llama_service.stream_medication(request.medication_name))
+
 @router.post("/symptoms/analyze")
-async def analyze_symptoms(request: SymptomAnalysisRequest):
-    """Analyze symptoms and suggest possible conditions"""
+async def analyze_symptoms(request: SymptomAnalysisRequest, http_request: Request):
+    """Analyze symptoms and suggest possible conditions, with Llama context fetched concurrently"""
     try:
-        analysis = diagnosis_explainer.analyze_symptoms(
-            symptoms=request.symptoms,
-            patient_info=request.patient_info
-        )
-        
-        # Add Llama analysis for context
         symptom_text = ", ".join(request.symptoms)
-        llama_context = llama_service.explain_medical_text(
-            f"Symptoms: {symptom_text}",
-            "What could these symptoms indicate?"
+        analysis, llama_context, branches = await _fan_out(
+            run_in_threadpool(
+                diagnosis_explainer.analyze_symptoms,
+                symptoms=request.symptoms,
+                patient_info=request.patient_info
+            ),
+            # Add Llama analysis for context
+            _model_call(
+                llama_service.explain_medical_text_async,
+                f"Symptoms: {symptom_text}",
+                "What could these symptoms indicate?",
+                route="symptoms",
+                # Compared on the symptoms alone; the fixed wording would make lists differing by one item match
+                cache_text=symptom_text
+            ),
+            "symptoms",
+            request.partial,
+            http_request
         )
         
+        analysis = analysis or {"symptoms_provided": request.symptoms}
         analysis["ai_context"] = llama_context
+        analysis["branches"] = branches
         
         return analysis
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/results/{result_id}")
+async def get_pending_result(result_id: str, wait: float = Query(0, ge=0, le=30, description="Seconds to wait for a pending result")):
+    """Fetch the AI part of a partial-mode response; wait > 0 long-polls until it is ready"""
+    result = await pending_results.get(result_id, wait)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired result ID")
+    return result
+
 @router.post("/health/report")
 async def generate_health_report(request: LabAnalysisRequest):
     """Generate comprehensive health report"""
@@ -179,9 +372,17 @@ async def get_common_conditions():
     return conditions
 
 @router.post("/trends/analyze")
-async def analyze_trends(historical_data: List[dict]):
-    """Analyze trends from historical health data"""
+async def analyze_trends(http_request: Request, historical_data: Optional[List[dict]] = None,
+                         patient_id: Optional[str] = None):
+    """Analyze trends from historical health data, or from a patient's stored trend state"""
+    patient_id = patient_scope(http_request, patient_id)
+    if patient_id is None and historical_data is None:
+        raise HTTPException(status_code=400, detail="Provide historical data or a patient_id")
+    
     try:
+        if patient_id is not None:
+            # Kept up to date as lab results are saved, no history scan
+            return medical_analyzer.summarize_trends(supabase_service.get_lab_trends(patient_id))
         trends = medical_analyzer.generate_trend_analysis(historical_data)
         return trends
     except Exception as e:
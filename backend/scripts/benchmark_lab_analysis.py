@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Lab analysis benchmark: independent analyzer calls vs one shared context
+
+Replays the work /api/medical/labs/analyze does per request on synthetic
+panels, first the way it used to (categorization, score, risks and report
+as independent analyzer calls, plus the Llama service's own categorization)
+and then through a single LabAnalysisContext, and reports CPU time per
+request for each. Then scores the same panels as one cohort table with
+MedicalAnalyzer.analyze_cohort, checks it against the per-panel results and
+reports CPU time per panel.
+"""
+
+import sys
+import time
+import random
+import statistics
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+
+from services.medical_analyzer import MedicalAnalyzer
+
+
+def synthetic_panels(analyzer: MedicalAnalyzer, count: int, seed: int = 7):
+    """Panels of 4 to all known tests, values spread from well below to well above range"""
+    rng = random.Random(seed)
+    tests = list(analyzer.reference_ranges)
+    panels = []
+    for _ in range(count):
+        panel = {}
+        for test in rng.sample(tests, rng.randint(4, len(tests))):
+            ref = analyzer.reference_ranges[test]
+            low, high = ref["min"], ref["max"]
+            span = high - low
+            panel[test] = round(rng.uniform(max(low - span * 0.5, 0), high + span), 2)
+        panels.append((panel, {"age": rng.randint(20, 85)}))
+    return panels
+
+
+def independent_calls(analyzer: MedicalAnalyzer, lab_data, patient_info):
+    """Every entry point analyzes the panel on its own"""
+    return {
+        "categorization": analyzer.categorize_lab_results(lab_data),
+        "health_score": analyzer.calculate_health_score(lab_data),
+        "risk_factors": analyzer.detect_risk_factors(lab_data, patient_info.get("age", 50)),
+        "health_report": analyzer.generate_health_report(lab_data, patient_info),
+        "ai_categorization": analyzer.analyze(lab_data).severity_levels,
+    }
+
+
+def shared_context(analyzer: MedicalAnalyzer, lab_data, patient_info):
+    """One context per request, every stage computed once"""
+    context = analyzer.analyze(lab_data, patient_info)
+    return {
+        "categorization": context.categorized,
+        "health_score": context.health_score,
+        "risk_factors": context.risk_factors,
+        "health_report": context.health_report,
+        "ai_categorization": context.severity_levels,
+    }
+
+
+def run_benchmark(analyzer, panels, fn, rounds: int):
+    """Median over rounds of CPU microseconds per request"""
+    per_request = []
+    for _ in range(rounds):
+        started = time.process_time()
+        for lab_data, patient_info in panels:
+            fn(analyzer, lab_data, patient_info)
+        per_request.append((time.process_time() - started) / len(panels) * 1e6)
+    return statistics.median(per_request)
+
+
+def _comparable(result):
+    """Drop timestamps so both paths can be compared"""
+    if isinstance(result, dict):
+        return {
+            k: _comparable(v) for k, v in result.items()
+            if k not in ("calculated_at", "analyzed_at", "generated_at", "report_id")
+        }
+    if isinstance(result, list):
+        return [_comparable(v) for v in result]
+    return result
+
+
+def cohort_table(analyzer: MedicalAnalyzer, panels) -> pd.DataFrame:
+    """One row per panel, NaN for tests the panel does not have"""
+    table = pd.DataFrame(
+        [lab_data for lab_data, _ in panels], columns=list(analyzer.reference_ranges)
+    ).astype(float)
+    table["age"] = [patient_info["age"] for _, patient_info in panels]
+    return table
+
+
+def cohort_mismatches(analyzer: MedicalAnalyzer, panels, results: pd.DataFrame) -> int:
+    """Panels whose cohort row differs from the single-panel analysis"""
+    mismatches = 0
+    for (lab_data, patient_info), (_, row) in zip(panels, results.iterrows()):
+        context = analyzer.analyze(lab_data, patient_info)
+        expected = {
+            "health_score": context.health_score["score"],
+            "health_status": context.health_score["status"],
+            "total_risks": context.risk_factors["total_risks"],
+            "highest_risk": context.risk_factors["highest_risk"],
+        }
+        for test, data in context.categorized.items():
+            expected[f"{test}_status"] = data["status"]
+            expected[f"{test}_deviation_percent"] = data["deviation_percent"]
+        for category, score in context.health_score["category_scores"].items():
+            expected[f"{category.lower()}_score"] = score
+        mismatches += any(row[column] != value for column, value in expected.items())
+    return mismatches
+
+
+def run_cohort_benchmark(analyzer, table: pd.DataFrame, rounds: int):
+    """Median over rounds of CPU microseconds per panel"""
+    per_panel = []
+    for _ in range(rounds):
+        started = time.process_time()
+        analyzer.analyze_cohort(table)
+        per_panel.append((time.process_time() - started) / len(table) * 1e6)
+    return statistics.median(per_panel)
+
+
+def main(panels: int = 2000, rounds: int = 5):
+    print("=" * 60)
+    print("Lab Analysis Benchmark")
+    print("=" * 60)
+
+    analyzer = MedicalAnalyzer()
+    panel_set = synthetic_panels(analyzer, panels)
+    mismatches = sum(
+        _comparable(independent_calls(analyzer, *panel)) != _comparable(shared_context(analyzer, *panel))
+        for panel in panel_set
+    )
+    print(f"✓ {len(panel_set)} synthetic panels; {mismatches} with differing results")
+
+    before = run_benchmark(analyzer, panel_set, independent_calls, rounds)
+    after = run_benchmark(analyzer, panel_set, shared_context, rounds)
+    print(f"\n{'path':<20} {'CPU us/request':>16}")
+    print(f"{'independent calls':<20} {before:>16.1f}")
+    print(f"{'shared context':<20} {after:>16.1f}")
+    print(f"\nCPU reduction: {(1 - after / before) * 100:.1f}% ({before / after:.2f}x)")
+
+    table = cohort_table(analyzer, panel_set)
+    results = analyzer.analyze_cohort(table)
+    print(f"\n✓ cohort of {len(table)}; {cohort_mismatches(analyzer, panel_set, results)} rows differing from single-panel analysis")
+
+    single = run_benchmark(analyzer, panel_set, lambda a, lab_data, patient_info: (
+        a.categorize_lab_results(lab_data),
+        a.calculate_health_score(lab_data),
+        a.detect_risk_factors(lab_data, patient_info["age"])
+    ), rounds)
+    cohort = run_cohort_benchmark(analyzer, table, rounds)
+    print(f"\n{'path':<20} {'CPU us/panel':>16}")
+    print(f"{'per panel':<20} {single:>16.1f}")
+    print(f"{'cohort':<20} {cohort:>16.1f}")
+    print(f"\nSpeedup: {single / cohort:.1f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark per-request lab analysis CPU time")
+    parser.add_argument("--panels", type=int, default=2000, help="Number of synthetic lab panels")
+    parser.add_argument("--rounds", type=int, default=5, help="Timing rounds (median is reported)")
+
+    args = parser.parse_args()
+    main(args.panels, args.rounds)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark: vector vs BM25 vs hybrid (reciprocal rank fusion)
+
+Builds a throwaway knowledge index from the built-in knowledge base (or a
+text/JSONL corpus), generates a synthetic query set from the indexed chunks
+and reports recall@k and latency for each retrieval mode.
+"""
+
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import statistics
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import settings
+from services.model_registry import model_registry
+from services.knowledge_index import KnowledgeIndex, chunk_id
+from services.hybrid_retriever import tokenize
+from services.llama_service import MEDICAL_KNOWLEDGE
+
+QUERY_TEMPLATES = [
+    "what is {terms}",
+    "explain {terms} in simple terms",
+    "{terms}",
+    "should I worry about {terms}",
+]
+
+
+def load_corpus(path: str = None):
+    """Built-in knowledge, or one document per line (.txt) / per record (.jsonl)"""
+    if not path:
+        return list(MEDICAL_KNOWLEDGE)
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            texts.append(json.loads(line)["text"] if path.endswith(".jsonl") else line)
+    return texts
+
+
+def synthetic_queries(documents, count: int, seed: int = 7):
+    """Queries built from each chunk's rarest terms; the chunk is the expected hit"""
+    rng = random.Random(seed)
+    doc_freq = {}
+    for document in documents:
+        for term in set(tokenize(document.page_content)):
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+
+    queries = []
+    for _ in range(count):
+        document = rng.choice(documents)
+        terms = sorted(set(tokenize(document.page_content)), key=lambda t: (doc_freq[t], rng.random()))
+        if not terms:
+            continue
+        picked = terms[:rng.randint(1, min(3, len(terms)))]
+        query = rng.choice(QUERY_TEMPLATES).format(terms=" ".join(picked))
+        queries.append((query, chunk_id(document)))
+    return queries
+
+
+def run_benchmark(retriever, queries):
+    latencies = []
+    hits = 0
+    for query, expected in queries:
+        started = time.perf_counter()
+        documents = retriever.get_relevant_documents(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += any(chunk_id(d) == expected for d in documents)
+    latencies.sort()
+    return {
+        "recall": hits / len(queries),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+class _BM25Only:
+    """Adapter so the BM25 index can be timed like a retriever"""
+
+    def __init__(self, bm25, k: int):
+        self.bm25 = bm25
+        self.k = k
+
+    def get_relevant_documents(self, query):
+        return [self.bm25.document(row) for row, _ in self.bm25.search(query, self.k)]
+
+
+def main(corpus: str = None, queries: int = 200, k: int = 3, backend: str = None):
+    print("=" * 60)
+    print("Retrieval Benchmark")
+    print("=" * 60)
+
+    index_dir = tempfile.mkdtemp(prefix="retrieval_bench_")
+    embeddings = model_registry.acquire("embeddings")
+    try:
+        index = KnowledgeIndex(
+            embeddings,
+            index_dir=index_dir,
+            chunk_size=settings.rag_chunk_size,
+            chunk_overlap=settings.rag_chunk_overlap,
+            backend=backend or settings.vector_backend,
+            flat_dtype=settings.flat_index_dtype
+        ).open(load_corpus(corpus))
+        documents = [index.bm25.document(row) for row in range(len(index.bm25))]
+        query_set = synthetic_queries(documents, queries)
+        print(f"✓ Indexed {len(documents)} chunks ({index.backend}); {len(query_set)} synthetic queries, k={k}")
+
+        retrievers = {
+            "vector": index.as_retriever({"k": k}),
+            "bm25": _BM25Only(index.bm25, k),
+            # Cache disabled so repeated queries are measured, not memoized
+            "hybrid": index.as_retriever(
+                {"k": k},
+                hybrid=True,
+                candidates=settings.hybrid_candidates,
+                rrf_k=settings.hybrid_rrf_k,
+                cache_size=0
+            ),
+        }
+        cached = index.as_retriever(
+            {"k": k},
+            hybrid=True,
+            candidates=settings.hybrid_candidates,
+            rrf_k=settings.hybrid_rrf_k,
+            cache_size=settings.retrieval_cache_size
+        )
+        run_benchmark(cached, query_set)
+        retrievers["hybrid (cached)"] = cached
+
+        print(f"\n{'mode':<16} {'recall@' + str(k):>10} {'p50 ms':>10} {'p95 ms':>10}")
+        for name, retriever in retrievers.items():
+            result = run_benchmark(retriever, query_set)
+            print(f"{name:<16} {result['recall']:>10.3f} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f}")
+    finally:
+        model_registry.release("embeddings")
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark vector, BM25 and hybrid retrieval")
+    parser.add_argument("--corpus", help="Corpus file (.txt: one document per line, .jsonl: {\"text\": ...})")
+    parser.add_argument("--queries", type=int, default=200, help="Number of synthetic queries")
+    parser.add_argument("--k", type=int, default=3, help="Documents retrieved per query")
+    parser.add_argument("--backend", choices=["chroma", "flat"], help="Vector backend (default: settings)")
+
+    args = parser.parse_args()
+    main(args.corpus, args.queries, args.k, args.backend)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Knowledge base ingestion: stream curated articles into the RAG index
+
+Reads .txt/.md files (one article each) and .jsonl files (one
+{"text", "title", "id"} article per line), appends their chunks to the active
+knowledge index in fixed-size batches and checkpoints progress, so an
+interrupted run picks up where it stopped.
+"""
+
+import sys
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import settings
+from services.model_registry import model_registry
+from services.knowledge_index import KnowledgeIndex
+from services.knowledge_ingestion import KnowledgeIngestor
+from services.llama_service import MEDICAL_KNOWLEDGE
+
+
+def report(progress):
+    print(
+        f"  {progress['articles']} articles, {progress['chunks']} chunks "
+        f"({progress['chunks_added']} new), {progress['chunks_per_second']} chunks/s"
+        f" - {progress['current_file']}"
+    )
+
+
+def main(paths, batch_size: int, checkpoint_every: int, resume: bool = True):
+    print("=" * 60)
+    print("Knowledge Base Ingestion")
+    print("=" * 60)
+
+    embeddings = model_registry.acquire("embeddings")
+    try:
+        index = KnowledgeIndex(
+            embeddings,
+            index_dir=settings.knowledge_index_dir,
+            chunk_size=settings.rag_chunk_size,
+            chunk_overlap=settings.rag_chunk_overlap,
+            backend=settings.vector_backend,
+            flat_dtype=settings.flat_index_dtype,
+            ingest_batch_size=batch_size
+        ).open(MEDICAL_KNOWLEDGE)
+        print(f"✓ Knowledge index {index.version[:12]} ({index.chunk_count} chunks, {index.backend})")
+
+        progress = KnowledgeIngestor(index, batch_size, checkpoint_every).run(paths, resume=resume, on_progress=report)
+    finally:
+        model_registry.release("embeddings")
+
+    if progress["status"] != "completed":
+        print(f"✗ Ingestion {progress['status']}: {progress.get('error')}")
+        return 1
+    print(
+        f"✓ Ingested {progress['articles']} articles: {progress['chunks_added']} new chunks "
+        f"in {progress['elapsed_seconds']}s ({progress['chunks_per_second']} chunks/s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream curated medical articles into the knowledge index")
+    parser.add_argument("paths", nargs="+", help="Source files or directories (.txt, .md, .jsonl)")
+    parser.add_argument("--batch-size", type=int, default=settings.ingest_batch_size, help="Chunks per appended batch")
+    parser.add_argument("--checkpoint-every", type=int, default=settings.ingest_checkpoint_every, help="Batches between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start from the beginning")
+
+    args = parser.parse_args()
+    sys.exit(main(args.paths, args.batch_size, args.checkpoint_every, resume=not args.restart))
@@ -0,0 +1,85 @@
+"""
+Request priority classes for model traffic.
+
+Every request runs in one of three classes: ``interactive`` (a person is
+waiting on the answer), ``normal`` and ``background`` (bulk work). The
+class and the caller's identity travel with the request in context
+variables, so the inference executor and the generation scheduler see them
+without threading extra arguments through every service call.
+
+``WeightedFairSelector`` does stride scheduling across the classes: each
+class advances a virtual clock by 1/weight per unit of work it is granted,
+and the class furthest behind goes next. Interactive work therefore gets
+most of the capacity under contention without starving the others.
+"""
+
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BACKGROUND = "background"
+# Highest priority first; also the shedding order, reversed
+PRIORITIES = (INTERACTIVE, NORMAL, BACKGROUND)
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("request_priority", default=NORMAL)
+_user: contextvars.ContextVar = contextvars.ContextVar("request_user", default=None)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def current_user() -> Optional[str]:
+    return _user.get()
+
+
+def rank(priority: str) -> int:
+    """0 for the most important class"""
+    return PRIORITIES.index(priority) if priority in PRIORITIES else PRIORITIES.index(NORMAL)
+
+
+def classify_path(path: str, rules: Dict[str, str], default: str = NORMAL) -> str:
+    """Priority of a request path: the first rule whose pattern occurs in it"""
+    for pattern, priority in rules.items():
+        if pattern in path and priority in PRIORITIES:
+            return priority
+    return default
+
+
+@contextmanager
+def request_priority(priority: str, user: Optional[str] = None):
+    """Run a block (and any work it hands to the executor) in a priority class"""
+    priority_token = _priority.set(priority if priority in PRIORITIES else NORMAL)
+    user_token = _user.set(user if user is not None else _user.get())
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _user.reset(user_token)
+
+
+class WeightedFairSelector:
+    """Stride scheduling over priority classes (not thread-safe; callers lock)"""
+
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = {p: max(float(weights.get(p, 1)), 0.001) for p in PRIORITIES}
+        self._pass = {p: 0.0 for p in PRIORITIES}
+        self._virtual_time = 0.0
+
+    def pick(self, active: Iterable[str]) -> Optional[str]:
+        """The active class that is furthest behind its fair share"""
+        present = set(active)
+        active = [p for p in PRIORITIES if p in present]
+        if not active:
+            return None
+        for priority in active:
+            # A class that sat idle does not bank credit for a later burst
+            self._pass[priority] = max(self._pass[priority], self._virtual_time)
+        chosen = min(active, key=lambda p: (self._pass[p], rank(p)))
+        self._virtual_time = self._pass[chosen]
+        return chosen
+
+    def charge(self, priority: str, amount: float = 1.0):
+        self._pass[priority] += amount / self.weights[priority]
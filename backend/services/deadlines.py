@@ -0,0 +1,82 @@
+"""
+Request deadlines for model calls.
+
+Every HTTP request gets a ``Deadline``: a point in time after which nobody
+is waiting for its answer, which a client disconnect can also trip early.
+Like the priority class (see ``services.admission``) it travels with the
+request in a context variable, so generation requests pick it up without
+extra arguments and the generation backends can check it between decode
+steps and stop spending tokens on an answer that will never be read.
+"""
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+# Why a request stopped early
+DEADLINE = "deadline"
+DISCONNECT = "disconnect"
+CANCELLED = "cancelled"
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+class Deadline:
+    """Expiry time plus a cancellation flag, safe to check from any thread
+
+    A deadline with a parent (e.g. one branch of a fan-out request) expires no
+    later than the parent and is cancelled along with it.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional["Deadline"] = None):
+        self.timeout = timeout
+        self.parent = parent
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        if parent is not None and parent.expires_at is not None:
+            self.expires_at = parent.expires_at if self.expires_at is None else min(self.expires_at, parent.expires_at)
+        self._cancelled = threading.Event()
+        self._reason: Optional[str] = None
+
+    def cancel(self, reason: str = CANCELLED):
+        if not self._cancelled.is_set():
+            self._reason = reason
+            self._cancelled.set()
+
+    @property
+    def expired(self) -> bool:
+        """True once cancelled or past the expiry time"""
+        if self._cancelled.is_set():
+            return True
+        if self.parent is not None and self.parent.expired:
+            self.cancel(self.parent.reason)
+            return True
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.cancel(DEADLINE)
+            return True
+        return False
+
+    @property
+    def reason(self) -> Optional[str]:
+        return self._reason if self.expired else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without an expiry time"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+@contextmanager
+def request_deadline(deadline: Optional[Deadline]):
+    """Run a block (and any model work it starts) under a deadline"""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
@@ -5,6 +5,8 @@ import re
 from typing import Dict, Any
 import os
 
+from services.medical_glossary import medical_glossary
+
 class DocumentProcessor:
     """Process medical documents (PDF, DOCX, TXT)"""
     
@@ -17,15 +19,22 @@ class DocumentProcessor:
         # Extract text based on file type
         text = self.extract_text(file_path)
         
-        # Process based on document type
+        return self.process_text(text, doc_type)
+    
+    def process_text(self, text: str, doc_type: str) -> Dict[str, Any]:
+        """Process extracted text based on document type"""
         if doc_type == "lab_report":
-            return self.process_lab_report(text)
+            result = self.process_lab_report(text)
         elif doc_type == "doctor_note":
-            return self.process_doctor_notes(text)
+            result = self.process_doctor_notes(text)
         elif doc_type == "prescription":
-            return self.process_prescription(text)
+            result = self.process_prescription(text)
         else:
-            return self.process_general_document(text)
+            result = self.process_general_document(text)
+        
+        # Every jargon term in the document, found in one pass
+        result["medical_terms"] = medical_glossary.summarize(text)
+        return result
     
     def extract_text(self, file_path: str) -> str:
         """Extract text from various file formats"""
@@ -0,0 +1,348 @@
+"""
+In-process flat vector index backed by a memory-mapped embedding matrix.
+
+Layout of an index directory:
+
+- ``vectors.bin``  raw row-major float16/float32 matrix of L2-normalized
+  embeddings, mapped read-only so every worker process shares the same pages
+  through the OS page cache
+- ``chunks.jsonl`` side table, one ``{"id", "text", "metadata"}`` row per vector
+- ``offsets.bin``  int64 byte offset of each row in ``chunks.jsonl``, also
+  mapped, so texts and metadata are read from disk only for the rows a
+  search returns
+- ``keys.bin``     uint64 key of each row's chunk ID, kept in memory sorted
+  for duplicate checks
+- ``header.json``  dimension, dtype, the number of committed rows and the
+  committed length of ``chunks.jsonl``
+
+Rows are appended in place: vectors and side-table rows are written first and
+the header is replaced last, so readers only ever see fully written rows.
+Search is a vectorized dot product over the matrix followed by a top-k
+partition; several queries are scored together in one matrix product. An
+index opened with a ``partition_key`` keeps the rows of each value of that
+metadata key (e.g. a patient ID), and a search filtered on it scores only
+those rows.
+"""
+
+import os
+import json
+import threading
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+
+from services.hybrid_retriever import _id_key
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.bin"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.bin"
+KEYS_FILE = "keys.bin"
+HEADER_FILE = "header.json"
+# Rows scored per block, so float16 matrices are upcast a slice at a time
+SEARCH_BLOCK_ROWS = 65536
+# Matching rows kept for filters not on the partition key (least recently used go first)
+FILTER_CACHE_SIZE = 64
+
+
+def _value_key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class FlatVectorIndex:
+    """Append-only, memory-mapped matrix of normalized embeddings
+
+    Per worker only the sorted ID keys (and with a ``partition_key`` the
+    rows of each partition) are held in memory; everything else is mapped
+    or read from disk on a hit.
+    """
+
+    def __init__(self, index_dir: str, dtype: str = "float16", partition_key: Optional[str] = None):
+        self.index_dir = index_dir
+        self.partition_key = partition_key
+        self._lock = threading.RLock()
+        self._matrix: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        # Sorted ID keys of the committed rows
+        self._keys = np.zeros(0, dtype=np.uint64)
+        # Rows per partition key value, in ascending order
+        self._partitions: Dict[str, array] = {}
+        self._filter_cache: "OrderedDict[Tuple[str, int], np.ndarray]" = OrderedDict()
+        self._chunks_bytes = 0
+        self._chunks_file = None
+        self._header_mtime = None
+        os.makedirs(index_dir, exist_ok=True)
+        header = self._read_header()
+        self.dtype = np.dtype(header.get("dtype", dtype))
+        self.dim: Optional[int] = header.get("dim")
+        self.count = 0
+        self.refresh()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _read_header(self) -> Dict[str, Any]:
+        try:
+            with open(self._path(HEADER_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def refresh(self):
+        """Pick up rows committed by another process since the last look"""
+        try:
+            mtime = os.path.getmtime(self._path(HEADER_FILE))
+        except OSError:
+            return
+        with self._lock:
+            if mtime == self._header_mtime:
+                return
+            header = self._read_header()
+            count = header.get("count", 0)
+            self.dim = header.get("dim")
+            if count > self.count:
+                self._load_rows(count, header.get("chunks_bytes"))
+                self._matrix = np.memmap(self._path(VECTORS_FILE), dtype=self.dtype, mode="r", shape=(count, self.dim))
+                self.count = count
+            self._header_mtime = mtime
+
+    def _load_rows(self, count: int, chunks_bytes: Optional[int]):
+        """Map the offsets and take in the keys and partitions of rows self.count..count (lock held)"""
+        if self._side_rows() < count:
+            # Written before the offsets and keys files existed
+            chunks_bytes = self._rebuild_side_files(count)
+        self._offsets = np.memmap(self._path(OFFSETS_FILE), dtype=np.int64, mode="r", shape=(count,))
+        new_keys = np.fromfile(
+            self._path(KEYS_FILE), dtype=np.uint64, count=count - self.count, offset=self.count * 8
+        )
+        self._keys = np.sort(np.concatenate([self._keys, new_keys]))
+        if self.partition_key is not None:
+            for row, chunk in enumerate(self._read_chunks(self.count, count), start=self.count):
+                value = _value_key(chunk.get("metadata", {}).get(self.partition_key))
+                self._partitions.setdefault(value, array("q")).append(row)
+        if chunks_bytes is not None:
+            self._chunks_bytes = chunks_bytes
+
+    def _side_rows(self) -> int:
+        try:
+            return min(os.path.getsize(self._path(OFFSETS_FILE)), os.path.getsize(self._path(KEYS_FILE))) // 8
+        except OSError:
+            return 0
+
+    def _rebuild_side_files(self, count: int) -> int:
+        """Offsets and keys of the first count rows from the side table; returns its committed length"""
+        offsets = np.zeros(count, dtype=np.int64)
+        keys = np.zeros(count, dtype=np.uint64)
+        with open(self._path(CHUNKS_FILE), "rb") as f:
+            for row in range(count):
+                offsets[row] = f.tell()
+                keys[row] = _id_key(json.loads(f.readline())["id"])
+            position = f.tell()
+        for name, values in ((OFFSETS_FILE, offsets), (KEYS_FILE, keys)):
+            tmp_path = f"{self._path(name)}.{os.getpid()}.tmp"
+            values.tofile(tmp_path)
+            os.replace(tmp_path, self._path(name))
+        return position
+
+    def _read_chunks(self, start: int, stop: int) -> Iterator[Dict[str, Any]]:
+        """Side-table rows start..stop, read sequentially"""
+        if start >= stop:
+            return
+        with open(self._path(CHUNKS_FILE), "rb") as f:
+            f.seek(int(self._offsets[start]))
+            for _ in range(stop - start):
+                yield json.loads(f.readline())
+
+    def _chunk(self, row: int) -> Dict[str, Any]:
+        with self._lock:
+            if self._chunks_file is None:
+                self._chunks_file = open(self._path(CHUNKS_FILE), "rb")
+            self._chunks_file.seek(int(self._offsets[row]))
+            line = self._chunks_file.readline()
+        return json.loads(line)
+
+    def contains(self, chunk_id: str) -> bool:
+        key = np.uint64(_id_key(chunk_id))
+        keys = self._keys
+        i = int(np.searchsorted(keys, key))
+        return i < len(keys) and keys[i] == key
+
+    def add(self, ids: List[str], texts: List[str], vectors, metadatas: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Append rows whose IDs are not present yet; returns how many were added"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in ids]
+        keys = np.asarray([_id_key(chunk_id) for chunk_id in ids], dtype=np.uint64)
+        with self._lock:
+            self.refresh()
+            found = np.searchsorted(self._keys, keys).clip(max=max(len(self._keys) - 1, 0))
+            known = self._keys[found] == keys if len(self._keys) else np.zeros(len(keys), dtype=bool)
+            keep = []
+            seen = set()
+            for i, (key, is_known) in enumerate(zip(keys.tolist(), known.tolist())):
+                if not is_known and key not in seen:
+                    seen.add(key)
+                    keep.append(i)
+            if not keep:
+                return 0
+            rows = vectors[keep]
+            norms = np.linalg.norm(rows, axis=1, keepdims=True)
+            rows = (rows / np.where(norms > 0, norms, 1)).astype(self.dtype)
+            if self.dim is None:
+                self.dim = rows.shape[1]
+            lines = [
+                json.dumps({"id": ids[i], "text": texts[i], "metadata": metadatas[i]}).encode("utf-8") + b"\n"
+                for i in keep
+            ]
+            offsets = np.zeros(len(lines), dtype=np.int64)
+            position = self._chunks_bytes
+            for i, line in enumerate(lines):
+                offsets[i] = position
+                position += len(line)
+
+            # Drop any bytes past the last committed row left by a failed write
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.truncate(self.count * self.dim * self.dtype.itemsize)
+                f.write(rows.tobytes())
+            with open(self._path(CHUNKS_FILE), "ab") as f:
+                f.truncate(self._chunks_bytes)
+                f.write(b"".join(lines))
+            for name, values in ((OFFSETS_FILE, offsets), (KEYS_FILE, keys[keep])):
+                with open(self._path(name), "ab") as f:
+                    f.truncate(self.count * 8)
+                    f.write(values.tobytes())
+            self._write_header(self.count + len(keep), position)
+            self._header_mtime = None
+            self.refresh()
+            return len(keep)
+
+    def _write_header(self, count: int, chunks_bytes: int):
+        path = self._path(HEADER_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": count, "chunks_bytes": chunks_bytes}, f)
+        os.replace(tmp_path, path)
+
+    def _filter_rows(self, search_filter: Dict[str, Any]) -> np.ndarray:
+        """Ascending rows whose metadata matches every key of the filter (lock held)"""
+        rest = dict(search_filter)
+        if self.partition_key in rest:
+            posting = self._partitions.get(_value_key(rest.pop(self.partition_key)))
+            rows = np.array(posting if posting is not None else [], dtype=np.int64)
+            if not rest:
+                return rows
+            metadatas = (self._chunk(row).get("metadata", {}) for row in rows.tolist())
+            return rows[np.fromiter(
+                (all(m.get(key) == value for key, value in rest.items()) for m in metadatas),
+                dtype=bool, count=len(rows)
+            )]
+
+        cache_key = (_value_key(rest), self.count)
+        rows = self._filter_cache.get(cache_key)
+        if rows is not None:
+            self._filter_cache.move_to_end(cache_key)
+            return rows
+        rows = np.asarray([
+            row for row, chunk in enumerate(self._read_chunks(0, self.count))
+            if all(chunk.get("metadata", {}).get(key) == value for key, value in rest.items())
+        ], dtype=np.int64)
+        self._filter_cache[cache_key] = rows
+        while len(self._filter_cache) > FILTER_CACHE_SIZE:
+            self._filter_cache.popitem(last=False)
+        return rows
+
+    def search(self, vector, k: int = 3, search_filter: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity) pairs, optionally restricted by metadata"""
+        return self.search_many([vector], k, search_filter)[0]
+
+    def search_many(self, vectors, k: int = 3, search_filter: Optional[Dict[str, Any]] = None) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, cosine similarity) pairs for each query vector"""
+        queries = np.asarray(vectors, dtype=np.float32)
+        self.refresh()
+        with self._lock:
+            matrix, count = self._matrix, self.count
+            # Only the matching rows are scored
+            candidates = self._filter_rows(search_filter) if search_filter else None
+        total = count if candidates is None else len(candidates)
+        if matrix is None or total == 0 or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+        k = min(k, total)
+        # Running top-k per query, merged block by block
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            if candidates is None:
+                block = matrix[start:start + SEARCH_BLOCK_ROWS]
+                block_rows = np.arange(start, start + len(block))
+            else:
+                block_rows = candidates[start:start + SEARCH_BLOCK_ROWS]
+                block = matrix[block_rows]
+            scores = queries @ block.astype(np.float32, copy=False).T
+            take = min(k, len(block))
+            top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, block_rows[top]], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in zip(best_rows, best_scores)
+        ]
+
+    def document(self, row: int, score: Optional[float] = None) -> Document:
+        chunk = self._chunk(row)
+        metadata = chunk.get("metadata", {})
+        if score is not None:
+            metadata["score"] = round(score, 4)
+        return Document(page_content=chunk["text"], metadata=metadata)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": "flat",
+            "rows": self.count,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "matrix_mb": round(self.count * (self.dim or 0) * self.dtype.itemsize / (1024**2), 2),
+            "partitions": len(self._partitions) if self.partition_key else None,
+        }
+
+
+class FlatVectorRetriever(BaseRetriever):
+    """LangChain retriever over a FlatVectorIndex"""
+
+    index: Any
+    embeddings: Any
+    k: int = 3
+    search_filter: Optional[Dict[str, Any]] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        vector = self.embeddings.embed_query(query)
+        return [self.index.document(row, score) for row, score in self.index.search(vector, self.k, self.search_filter)]
+
+    def retrieve_batch(self, queries: List[str], vectors=None) -> List[List[Document]]:
+        """Documents for several queries, embedded and scored together"""
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(queries)
+        return [
+            [self.index.document(row, score) for row, score in hits]
+            for hits in self.index.search_many(vectors, self.k, self.search_filter)
+        ]
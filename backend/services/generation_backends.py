@@ -0,0 +1,461 @@
+"""
+Pluggable text generation backends.
+
+Every backend exposes the same API to LlamaMedicalService and the generation
+scheduler:
+
+- ``generate(batch)`` decodes a batch of GenerationRequests and returns one
+  ``{"text", "new_tokens"}`` dict per request. A request carrying a
+  ``streamer`` also receives its text incrementally. Backends check each
+  request's ``cancelled`` flag between decode steps; a request stopped that
+  way is returned with ``"cancelled": True`` and the ``tokens_saved``.
+- ``max_batch_size`` caps how many requests the scheduler may group.
+- ``prepare_prefix(prefix)`` precomputes the attention state of a static
+  prompt prefix so requests starting with it only prefill their suffix.
+- ``close()`` releases whatever the backend holds.
+
+The backend is chosen by ``settings.generation_backend``.
+"""
+
+import os
+import time
+import queue
+import random
+import threading
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import settings
+from exceptions import ConfigurationError
+from services.generation_budget import truncate_at_stop
+
+logger = logging.getLogger(__name__)
+
+
+class TextQueueStreamer:
+    """Thread-safe text stream: the generation thread puts, a consumer iterates"""
+
+    _END = object()
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+
+    def put_text(self, text: str):
+        if text:
+            self._queue.put(text)
+
+    def end(self):
+        self._queue.put(self._END)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            item = self._queue.get(timeout=self.timeout)
+            if item is self._END:
+                return
+            yield item
+
+
+class GenerationBackend:
+    """Base class for generation backends"""
+
+    name = "base"
+    max_batch_size: Optional[int] = None
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._prefill = {
+            "batches": 0,
+            "seconds": 0.0,
+            "tokens": 0,
+            "reused_prefix_tokens": 0,
+            "prefix_hits": 0,
+            "prefix_misses": 0,
+        }
+
+    def generate(self, batch: List[Any]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def prepare_prefix(self, prefix: str):
+        pass
+
+    def close(self):
+        pass
+
+    def _record_prefill(self, seconds: float, tokens: int = 0, reused_prefix_tokens: int = 0):
+        with self._stats_lock:
+            self._prefill["batches"] += 1
+            self._prefill["seconds"] += seconds
+            self._prefill["tokens"] += tokens
+            self._prefill["reused_prefix_tokens"] += reused_prefix_tokens
+
+    def _record_prefix_lookup(self, hit: bool):
+        with self._stats_lock:
+            self._prefill["prefix_hits" if hit else "prefix_misses"] += 1
+
+    def describe(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            p = dict(self._prefill)
+        return {
+            "backend": self.name,
+            "max_batch_size": self.max_batch_size,
+            "prefill": {
+                "batches": p["batches"],
+                "total_seconds": round(p["seconds"], 3),
+                "avg_ms": round(p["seconds"] / p["batches"] * 1000, 1) if p["batches"] else None,
+                "prefilled_tokens": p["tokens"],
+                "reused_prefix_tokens": p["reused_prefix_tokens"],
+                "prefix_cache_hits": p["prefix_hits"],
+                "prefix_cache_misses": p["prefix_misses"],
+            }
+        }
+
+
+class TransformersBackend(GenerationBackend):
+    """Hugging Face transformers backend (GPU, 8-bit quantized when available)"""
+
+    name = "transformers"
+
+    def __init__(self):
+        super().__init__()
+        from services.model_registry import model_registry
+        self._registry = model_registry
+        # prefix text -> (prefix token ids, past_key_values) for the loaded model
+        self._prefix_states: Dict[str, Any] = {}
+        self.tokenizer = model_registry.acquire("tokenizer")
+        try:
+            self.model = model_registry.acquire("model")
+        except Exception:
+            model_registry.release("tokenizer")
+            raise
+
+        self.draft_model = None
+        self._forward_calls = {"target": 0, "draft": 0}
+        self._speculative: Dict[str, Dict[str, float]] = {}
+        # Removed in close(): the shared registry models outlive this backend
+        self._hooks: List[Any] = []
+        if settings.speculative_decoding_enabled:
+            try:
+                self.draft_model = model_registry.acquire("draft_model")
+            except Exception as e:
+                logger.error(f"Draft model unavailable, speculative decoding disabled: {e}")
+            else:
+                self._hooks = [
+                    self.model.register_forward_hook(self._count_forward("target")),
+                    self.draft_model.register_forward_hook(self._count_forward("draft"))
+                ]
+
+    def prepare_prefix(self, prefix: str):
+        if settings.prefix_cache_enabled:
+            self._prefix_state(prefix)
+
+    def _prefix_state(self, prefix: str):
+        """Token ids and KV cache of a static prompt prefix, computed once"""
+        state = self._prefix_states.get(prefix)
+        self._record_prefix_lookup(state is not None)
+        if state is None:
+            import torch
+            prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+            with torch.no_grad():
+                past_key_values = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+            state = (prefix_ids[0].tolist(), past_key_values)
+            self._prefix_states[prefix] = state
+        return state
+
+    def _count_forward(self, role: str):
+        def hook(module, inputs, output):
+            self._forward_calls[role] += 1
+        return hook
+
+    def _encode(self, batch: List[Any], use_prefix: bool = True):
+        """Inputs for model.generate, plus the number of prefix tokens reused"""
+        prefix = batch[0].prefix if use_prefix and settings.prefix_cache_enabled else None
+        suffixes = None
+        if prefix:
+            suffixes = [
+                self.tokenizer(request.prompt[len(prefix):], add_special_tokens=False)["input_ids"]
+                for request in batch
+            ]
+        if not suffixes or not all(suffixes):
+            encoded = self.tokenizer([r.prompt for r in batch], return_tensors="pt", padding=True)
+            return dict(encoded.to(self.model.device)), int(encoded["attention_mask"].sum()), 0
+
+        import torch
+        prefix_ids, past_key_values = self._prefix_state(prefix)
+        # Padding sits between the cached prefix and each suffix; the
+        # attention mask hides it and position ids skip over it
+        width = max(len(ids) for ids in suffixes)
+        rows, masks = [], []
+        for ids in suffixes:
+            padding = width - len(ids)
+            rows.append(prefix_ids + [self.tokenizer.pad_token_id] * padding + ids)
+            masks.append([1] * len(prefix_ids) + [0] * padding + [1] * len(ids))
+        size = len(batch)
+        inputs = {
+            "input_ids": torch.tensor(rows, device=self.model.device),
+            "attention_mask": torch.tensor(masks, device=self.model.device),
+            "past_key_values": tuple(
+                tuple(tensor.expand(size, -1, -1, -1) for tensor in layer)
+                for layer in past_key_values
+            ),
+        }
+        return inputs, sum(len(ids) for ids in suffixes), len(prefix_ids) * size
+
+    def generate(self, batch: List[Any]) -> List[Dict[str, Any]]:
+        import torch
+
+        budgets = [request.max_new_tokens for request in batch]
+        eligible = len(batch) == 1 and batch[0].speculative and self.draft_model is not None
+        # A small share of eligible requests runs without the draft so the
+        # speed-up can be measured against plain decoding
+        speculative = eligible and random.random() >= settings.speculative_baseline_fraction
+        extra = {}
+        if speculative:
+            # Assisted generation manages its own KV caches for both models
+            extra["assistant_model"] = self.draft_model
+        inputs, prefill_tokens, reused_tokens = self._encode(batch, use_prefix=not speculative)
+        prompt_length = inputs["input_ids"].shape[1]
+        eos_token_id = self.tokenizer.eos_token_id
+
+        streamer = None
+        if len(batch) == 1 and batch[0].streamer is not None:
+            streamer = _forwarding_streamer(self.tokenizer, batch[0].streamer)
+
+        stopping_criteria = _batch_stopping_criteria(
+            prompt_length, budgets, eos_token_id,
+            stops=[request.stop for request in batch], tokenizer=self.tokenizer, requests=batch
+        )
+        self._forward_calls["target"] = self._forward_calls["draft"] = 0
+        started = time.perf_counter()
+        with torch.no_grad():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max(budgets),
+                temperature=batch[0].temperature,
+                top_p=batch[0].top_p,
+                repetition_penalty=1.1,
+                do_sample=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=stopping_criteria,
+                streamer=streamer,
+                **extra
+            )
+        elapsed = time.perf_counter() - started
+        # The stopping criteria first run once the prompt has been prefilled
+        first_token_at = stopping_criteria[0].first_call_at
+        if first_token_at is not None:
+            self._record_prefill(first_token_at - started, prefill_tokens, reused_tokens)
+
+        results = []
+        decode_steps = output.shape[1] - prompt_length
+        cancelled = stopping_criteria[0].cancelled
+        for index, (row, request) in enumerate(zip(output, batch)):
+            new_ids = row[prompt_length:prompt_length + request.max_new_tokens].tolist()
+            if eos_token_id in new_ids:
+                new_ids = new_ids[:new_ids.index(eos_token_id)]
+            text = self.tokenizer.decode(new_ids, skip_special_tokens=True)
+            result = {
+                "text": truncate_at_stop(text, request.stop),
+                "new_tokens": len(new_ids)
+            }
+            if cancelled[index]:
+                result["cancelled"] = True
+                result["tokens_saved"] = max(request.max_new_tokens - decode_steps, 0)
+            results.append(result)
+        if eligible:
+            self._record_speculative(batch[0].endpoint, speculative, results[0]["new_tokens"], elapsed)
+        return results
+
+    def _record_speculative(self, endpoint: str, speculative: bool, new_tokens: int, elapsed: float):
+        """Track draft acceptance and decode speed against the plain baseline"""
+        with self._stats_lock:
+            stats = self._speculative.setdefault(endpoint, {
+                "requests": 0, "tokens": 0, "seconds": 0.0, "drafted": 0, "accepted": 0,
+                "baseline_requests": 0, "baseline_tokens": 0, "baseline_seconds": 0.0,
+            })
+            if not speculative:
+                stats["baseline_requests"] += 1
+                stats["baseline_tokens"] += new_tokens
+                stats["baseline_seconds"] += elapsed
+                return
+            # Every target forward pass verifies the drafted candidates and
+            # contributes one token of its own; the rest were accepted drafts
+            stats["requests"] += 1
+            stats["tokens"] += new_tokens
+            stats["seconds"] += elapsed
+            stats["drafted"] += self._forward_calls["draft"]
+            stats["accepted"] += max(new_tokens - self._forward_calls["target"], 0)
+
+    def close(self):
+        self._prefix_states.clear()
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        if self.draft_model is not None:
+            self._registry.release("draft_model")
+        self._registry.release("model")
+        self._registry.release("tokenizer")
+
+    def describe(self) -> Dict[str, Any]:
+        speculative = {}
+        with self._stats_lock:
+            for endpoint, s in self._speculative.items():
+                tps = s["tokens"] / s["seconds"] if s["seconds"] > 0 else None
+                baseline_tps = s["baseline_tokens"] / s["baseline_seconds"] if s["baseline_seconds"] > 0 else None
+                speculative[endpoint] = {
+                    "requests": s["requests"],
+                    "baseline_requests": s["baseline_requests"],
+                    "acceptance_rate": round(s["accepted"] / s["drafted"], 3) if s["drafted"] else None,
+                    "tokens_per_second": round(tps, 2) if tps else None,
+                    "baseline_tokens_per_second": round(baseline_tps, 2) if baseline_tps else None,
+                    "speedup": round(tps / baseline_tps, 2) if tps and baseline_tps else None,
+                }
+        return {
+            **super().describe(),
+            "model": settings.hf_model_name,
+            "draft_model": settings.speculative_draft_model if self.draft_model is not None else None,
+            "speculative": speculative,
+        }
+
+
+class LlamaCppBackend(GenerationBackend):
+    """CPU backend running 4/8-bit GGUF weights through llama.cpp"""
+
+    name = "llamacpp"
+    # llama-cpp-python decodes one sequence per call
+    max_batch_size = 1
+
+    def __init__(self):
+        super().__init__()
+        if not settings.gguf_model_path:
+            raise ConfigurationError("gguf_model_path must be set to use the llamacpp backend")
+        from llama_cpp import Llama, LlamaRAMCache
+        self.llm = Llama(
+            model_path=settings.gguf_model_path,
+            n_ctx=settings.llamacpp_context_size,
+            n_threads=settings.llamacpp_threads or os.cpu_count(),
+            verbose=False
+        )
+        if settings.speculative_decoding_enabled:
+            logger.warning("Speculative decoding is only supported by the transformers backend")
+        if settings.prefix_cache_enabled:
+            # llama.cpp restores the saved state with the longest shared token
+            # prefix and only evaluates the remainder of the prompt
+            self.llm.set_cache(LlamaRAMCache())
+
+    def prepare_prefix(self, prefix: str):
+        if settings.prefix_cache_enabled:
+            self.llm(prefix, max_tokens=1)
+
+    def generate(self, batch: List[Any]) -> List[Dict[str, Any]]:
+        results = []
+        for request in batch:
+            started = time.perf_counter()
+            pieces = []
+            cancelled = request.cancelled
+            # Always stream so time to the first token (prefill) can be measured
+            for chunk in [] if cancelled else self.llm(
+                request.prompt,
+                max_tokens=request.max_new_tokens,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                repeat_penalty=1.1,
+                stop=request.stop or [],
+                stream=True
+            ):
+                if not pieces:
+                    self._record_prefill(time.perf_counter() - started)
+                text = chunk["choices"][0]["text"]
+                pieces.append(text)
+                if request.streamer is not None:
+                    request.streamer.put_text(text)
+                if request.cancelled:
+                    # Leaving the stream stops llama.cpp before the next token
+                    cancelled = True
+                    break
+            if request.streamer is not None:
+                request.streamer.end()
+            # Each streamed chunk carries exactly one token
+            result = {"text": "".join(pieces), "new_tokens": len(pieces)}
+            if cancelled:
+                result["cancelled"] = True
+                result["tokens_saved"] = max(request.max_new_tokens - len(pieces), 0)
+            results.append(result)
+        return results
+
+    def close(self):
+        self.llm = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "model_path": settings.gguf_model_path}
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    LlamaCppBackend.name: LlamaCppBackend,
+}
+
+
+def create_backend(name: Optional[str] = None) -> GenerationBackend:
+    """Instantiate the backend selected in settings"""
+    name = name or settings.generation_backend
+    if name not in BACKENDS:
+        raise ConfigurationError(f"Unknown generation backend '{name}'. Available: {', '.join(BACKENDS)}")
+    logger.info(f"Using generation backend: {name}")
+    return BACKENDS[name]()
+
+
+def _forwarding_streamer(tokenizer, sink: TextQueueStreamer):
+    """HF streamer that forwards decoded text into a TextQueueStreamer"""
+    from transformers import TextStreamer
+
+    class _ForwardingStreamer(TextStreamer):
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            sink.put_text(text)
+            if stream_end:
+                sink.end()
+
+    return _ForwardingStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+
+def _batch_stopping_criteria(
+    prompt_length: int,
+    budgets: List[int],
+    eos_token_id: int,
+    stops: Optional[List[Optional[List[str]]]] = None,
+    tokenizer=None,
+    requests: Optional[List[Any]] = None
+):
+    """Stop a batch once every row has hit EOS, a stop sequence, its own token budget or was cancelled"""
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    stops = stops or [None] * len(budgets)
+    # Stop sequences are matched against the last few decoded tokens only
+    tail_tokens = 16
+
+    class _BatchBudgetCriteria(StoppingCriteria):
+        first_call_at: Optional[float] = None
+
+        def __init__(self):
+            self.stopped = [False] * len(budgets)
+            self.cancelled = [False] * len(budgets)
+
+        def __call__(self, input_ids, scores, **kwargs) -> bool:
+            if self.first_call_at is None:
+                self.first_call_at = time.perf_counter()
+            generated = input_ids.shape[1] - prompt_length
+            finished = (input_ids[:, prompt_length:] == eos_token_id).any(dim=1).tolist()
+            for row, stop in enumerate(stops):
+                if stop and not self.stopped[row] and not finished[row]:
+                    tail = tokenizer.decode(input_ids[row, -min(generated, tail_tokens):], skip_special_tokens=True)
+                    self.stopped[row] = any(s in tail for s in stop)
+            # Deadline and disconnect checks are a clock read and a flag per row
+            for row, request in enumerate(requests or ()):
+                if not self.cancelled[row] and not finished[row] and request.cancelled:
+                    self.cancelled[row] = True
+            return all(
+                done or stopped or cancelled or generated >= budget
+                for done, stopped, cancelled, budget in zip(finished, self.stopped, self.cancelled, budgets)
+            )
+
+    return StoppingCriteriaList([_BatchBudgetCriteria()])
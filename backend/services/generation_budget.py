@@ -0,0 +1,183 @@
+"""
+Token budgets, prompt sections and stop sequences derived from request options.
+
+ExplanationRequest and DiagnosisRequest describe how long and how detailed an
+answer should be. The budgets below turn those options into the instruction
+block that opens the prompt, a ``max_new_tokens`` cap and stop sequences, so
+short requests stop decoding as soon as the requested content is written.
+"""
+
+import math
+from typing import Any, Dict, List, Optional
+
+# Rough English average used to turn word limits into token budgets
+TOKENS_PER_WORD = 4 / 3
+
+SIMPLIFY_LEVEL_INSTRUCTIONS = {
+    "patient": "Uses everyday language (no medical jargon)",
+    "student": "Uses plain language and briefly defines any medical term it uses",
+    "professional": "Uses precise medical terminology",
+}
+
+# Diagnosis sections in answer order: (key, question, token budget)
+DIAGNOSIS_SECTIONS = [
+    ("meaning", "What does this diagnosis mean in everyday language?", 90),
+    ("symptoms", "What are the main symptoms or effects?", 80),
+    ("causes", "What causes this condition?", 70),
+    ("treatments", "What treatments are available?", 90),
+    ("prognosis", "What is the usual outlook?", 70),
+    ("prevention", "What lifestyle changes can help?", 80),
+]
+
+# Markers that show the model has started writing a new prompt of its own
+RUNAWAY_STOPS = ["\nPatient Question:", "\nMedical Context:", "\nDiagnosis:"]
+
+
+class ExplanationBudget:
+    """Prompt and decode budget for a free-text explanation"""
+
+    def __init__(
+        self,
+        max_length: Optional[int] = None,
+        simplify_level: str = "patient",
+        include_examples: bool = True,
+        max_tokens_cap: int = 512
+    ):
+        self.max_length = max_length
+        self.simplify_level = simplify_level if simplify_level in SIMPLIFY_LEVEL_INSTRUCTIONS else "patient"
+        self.include_examples = include_examples
+        self.max_tokens_cap = max_tokens_cap
+
+    @property
+    def max_new_tokens(self) -> int:
+        if not self.max_length:
+            return self.max_tokens_cap
+        return max(32, min(self.max_tokens_cap, math.ceil(self.max_length * TOKENS_PER_WORD)))
+
+    @property
+    def prefix(self) -> str:
+        """Static instruction block; identical for every request with these options"""
+        instructions = [
+            SIMPLIFY_LEVEL_INSTRUCTIONS[self.simplify_level],
+            "Is accurate but easy to understand",
+            "Includes practical advice",
+            "Is reassuring but honest",
+        ]
+        if self.include_examples:
+            instructions.append("Includes one short, concrete example")
+        numbered = "\n".join(f"{i}. {line}" for i, line in enumerate(instructions, 1))
+        return (
+            "You are a medical expert explaining complex medical information to patients "
+            "in simple, easy-to-understand language.\n\n"
+            f"Please provide a clear, simple explanation that:\n{numbered}\n\n"
+        )
+
+    def prompt(self, context: str, question: str) -> str:
+        limit = f" (at most {self.max_length} words)" if self.max_length else ""
+        return self.prefix + f"""Medical Context: {context}
+
+Patient Question: {question}
+
+Simple Explanation{limit}:"""
+
+    @property
+    def stop(self) -> List[str]:
+        return list(RUNAWAY_STOPS)
+
+    @property
+    def cache_params(self) -> Dict[str, Any]:
+        return {
+            "max_length": self.max_length,
+            "simplify_level": self.simplify_level,
+            "include_examples": self.include_examples,
+        }
+
+    @property
+    def variant(self) -> str:
+        """Short label distinguishing non-default option combinations"""
+        return f"{self.simplify_level}/{int(self.include_examples)}/{self.max_length or 0}"
+
+
+class DiagnosisBudget:
+    """Prompt sections and decode budget for a diagnosis explanation"""
+
+    def __init__(
+        self,
+        include_treatments: bool = True,
+        include_prognosis: bool = True,
+        include_prevention: bool = True,
+        max_tokens_cap: int = 500
+    ):
+        included = {
+            "treatments": include_treatments,
+            "prognosis": include_prognosis,
+            "prevention": include_prevention,
+        }
+        self.sections = [s for s in DIAGNOSIS_SECTIONS if included.get(s[0], True)]
+        self.max_tokens_cap = max_tokens_cap
+
+    @property
+    def max_new_tokens(self) -> int:
+        return min(self.max_tokens_cap, 20 + sum(budget for _, _, budget in self.sections))
+
+    @property
+    def prefix(self) -> str:
+        numbered = "\n".join(f"{i}. {question}" for i, (_, question, _) in enumerate(self.sections, 1))
+        return (
+            "Please explain this diagnosis to a patient in simple terms.\n"
+            f"Answer in exactly {len(self.sections)} numbered sections, one short paragraph each:\n"
+            f"{numbered}\n\n"
+            "Keep explanations simple, clear, and reassuring.\n\n"
+        )
+
+    def prompt(self, diagnosis: str, notes: str = "") -> str:
+        return self.prefix + f"""Diagnosis: {diagnosis}
+Doctor's Notes: {notes}
+
+Explanation:"""
+
+    @property
+    def stop(self) -> List[str]:
+        # A section numbered past the last requested one means the answer is done
+        return [f"\n{len(self.sections) + 1}."] + RUNAWAY_STOPS
+
+    @property
+    def cache_params(self) -> Dict[str, Any]:
+        return {"sections": [key for key, _, _ in self.sections]}
+
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> str:
+    """Cut text at the earliest stop sequence it contains"""
+    if not stop:
+        return text
+    cut = min((text.find(s) for s in stop if s in text), default=-1)
+    return text[:cut] if cut >= 0 else text
+
+
+class StopSequenceFilter:
+    """Streams text up to (not including) the first stop sequence"""
+
+    def __init__(self, stop: List[str]):
+        self.stop = stop
+        self._buffer = ""
+        self._stopped = False
+        # Keep enough text back that a stop sequence split across chunks still matches
+        self._hold = max((len(s) for s in stop), default=1) - 1
+
+    def feed(self, chunk: str) -> str:
+        if self._stopped:
+            return ""
+        self._buffer += chunk
+        cut = truncate_at_stop(self._buffer, self.stop)
+        if len(cut) < len(self._buffer):
+            self._stopped = True
+            self._buffer = ""
+            return cut
+        if len(self._buffer) <= self._hold:
+            return ""
+        ready, self._buffer = self._buffer[:len(self._buffer) - self._hold], self._buffer[len(self._buffer) - self._hold:]
+        return ready
+
+    def finish(self) -> str:
+        tail, self._buffer = self._buffer, ""
+        return "" if self._stopped else tail
@@ -0,0 +1,340 @@
+"""
+Dynamic batching scheduler for text generation.
+
+Callers from every endpoint submit prompts; a single generation thread
+groups compatible requests into batches (bounded by a max batch size and a
+max wait time), runs them together and routes each result back to the
+caller's future. Requests carry the priority class of the call that made
+them; the class whose oldest request leads the next batch is chosen by
+weighted fair scheduling, and compatible requests of more important classes
+fill the batch first.
+
+A request whose deadline has passed (or whose client went away) is dropped
+before it reaches a batch; one already decoding is stopped by the backend
+between decode steps. Either way its future raises DeadlineExceededError
+and the tokens it no longer needs are counted as saved.
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from exceptions import DeadlineExceededError
+from services.admission import PRIORITIES, WeightedFairSelector, current_priority, rank
+from services.deadlines import CANCELLED, DISCONNECT, Deadline, current_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest:
+    """A single prompt waiting for generation"""
+
+    def __init__(
+        self,
+        prompt: str,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        endpoint: str = "default",
+        streamer: Any = None,
+        prefix: Optional[str] = None,
+        speculative: bool = False,
+        stop: Optional[List[str]] = None,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None
+    ):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.endpoint = endpoint
+        self.streamer = streamer
+        # Static leading part of the prompt whose KV state the backend may reuse
+        self.prefix = prefix if prefix and prompt.startswith(prefix) else None
+        # Eligible for draft-model speculative decoding (batch size 1 only)
+        self.speculative = speculative
+        # Decoding for this request ends at the first of these sequences
+        self.stop = stop
+        # Priority class of the request that is waiting on this prompt
+        self.priority = priority or current_priority()
+        # Deadline of the request that is waiting on this prompt
+        self.deadline = deadline or current_deadline()
+        self._cancelled = False
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+
+    def cancel(self):
+        """Stop generating for this prompt (e.g. its stream consumer went away)"""
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        """Checked by the backends between decode steps"""
+        return self._cancelled or (self.deadline is not None and self.deadline.expired)
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        if self._cancelled:
+            return CANCELLED
+        return self.deadline.reason if self.deadline is not None else None
+
+    @property
+    def batch_key(self) -> Tuple:
+        """Requests sharing this key can be decoded in the same batch"""
+        if self.streamer is not None or self.speculative:
+            # Streamed requests decode alone so tokens reach one consumer;
+            # speculative decoding only supports a single sequence
+            return ("solo", id(self))
+        return (self.temperature, self.top_p, self.prefix)
+
+
+class GenerationScheduler:
+    """Collects pending prompts into dynamic batches on one generation thread"""
+
+    def __init__(
+        self,
+        generate_batch: Callable[[List[GenerationRequest]], List[Dict[str, Any]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 25,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self._generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Deque[GenerationRequest] = deque()
+        self._selector = WeightedFairSelector(weights or {})
+        self._class_waits = {p: {"requests": 0, "wait_seconds": 0.0} for p in PRIORITIES}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._metrics = {
+            "batches": 0,
+            "requests": 0,
+            "failed_requests": 0,
+            "generated_tokens": 0,
+            "generation_seconds": 0.0,
+            "queue_wait_seconds": 0.0,
+            "occupancy_sum": 0.0,
+            "cancelled_requests": 0,
+            "cancelled_before_start": 0,
+            "tokens_saved": 0,
+        }
+        self._cancelled_by_reason: Dict[str, int] = {}
+        self._batch_size_histogram: Dict[int, int] = {}
+        self._last_batch: Dict[str, Any] = {}
+
+    def submit(self, request: GenerationRequest) -> Future:
+        """Queue a request; its future resolves to {"text", "new_tokens"}"""
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Generation scheduler is stopped")
+            self._ensure_worker()
+            self._queue.append(request)
+            self._cond.notify()
+        return request.future
+
+    def submit_many(self, requests: List[GenerationRequest]) -> List[Future]:
+        """Queue several requests at once so compatible ones share a batch"""
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Generation scheduler is stopped")
+            self._ensure_worker()
+            self._queue.extend(requests)
+            self._cond.notify()
+        return [request.future for request in requests]
+
+    def generate(self, request: GenerationRequest, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Submit a request and block until its result is ready"""
+        return self.submit(request).result(timeout=timeout)
+
+    def stop(self):
+        """Stop the worker after its current batch; queued requests fail right away"""
+        with self._cond:
+            self._stopped = True
+            for request in self._queue:
+                if request.streamer is not None:
+                    request.streamer.end()
+                request.future.set_exception(RuntimeError("Generation scheduler is stopped"))
+            self._metrics["failed_requests"] += len(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._execute(batch)
+
+    def _next_batch(self) -> Optional[List[GenerationRequest]]:
+        """Wait for work, then take a fairly chosen head request plus compatible ones"""
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            self._drop_cancelled()
+            if not self._queue:
+                return []
+
+            # Oldest request of the class that is furthest behind its share
+            head_priority = self._selector.pick(r.priority for r in self._queue)
+            head = next(r for r in self._queue if r.priority == head_priority)
+            key = head.batch_key
+            dispatch_at = head.enqueued_at + self.max_wait
+            # Hold an under-filled batch open until the oldest request has
+            # waited max_wait; a full batch (or a backlog) goes immediately
+            while key[0] != "solo" and self._count_compatible(key) < self.max_batch_size and not self._stopped:
+                remaining = dispatch_at - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._stopped:
+                return None
+
+            # Fill the batch from the most important classes first, oldest first
+            compatible = sorted((r for r in self._queue if r.batch_key == key), key=lambda r: rank(r.priority))
+            batch = compatible[:self.max_batch_size]
+            if head not in batch:
+                batch[-1] = head
+            chosen = set(map(id, batch))
+            self._queue = deque(r for r in self._queue if id(r) not in chosen)
+            for request in batch:
+                self._selector.charge(request.priority)
+            return batch
+
+    def _drop_cancelled(self):
+        """Fail queued requests nobody is waiting for any more (lock held)"""
+        if not any(r.cancelled for r in self._queue):
+            return
+        kept: Deque[GenerationRequest] = deque()
+        for request in self._queue:
+            if not request.cancelled:
+                kept.append(request)
+                continue
+            self._metrics["cancelled_before_start"] += 1
+            self._count_cancelled(request, request.max_new_tokens)
+            if request.streamer is not None:
+                request.streamer.end()
+            request.future.set_exception(_cancelled_error(request))
+        self._queue = kept
+
+    def _count_cancelled(self, request: GenerationRequest, tokens_saved: int):
+        reason = request.cancel_reason or CANCELLED
+        self._metrics["cancelled_requests"] += 1
+        self._metrics["tokens_saved"] += tokens_saved
+        self._cancelled_by_reason[reason] = self._cancelled_by_reason.get(reason, 0) + 1
+
+    def _count_compatible(self, key: Tuple) -> int:
+        return sum(1 for r in self._queue if r.batch_key == key)
+
+    def _execute(self, batch: List[GenerationRequest]):
+        started = time.perf_counter()
+        for request in batch:
+            request.started_at = started
+        try:
+            results = self._generate_batch(batch)
+        except Exception as e:
+            logger.error(f"Batch generation failed: {e}")
+            for request in batch:
+                if request.streamer is not None:
+                    request.streamer.end()
+                request.future.set_exception(e)
+            with self._cond:
+                self._metrics["failed_requests"] += len(batch)
+            return
+
+        elapsed = time.perf_counter() - started
+        new_tokens = 0
+        cancelled = []
+        for request, result in zip(batch, results):
+            new_tokens += result.get("new_tokens", 0)
+            if result.get("cancelled"):
+                # A partial answer must not reach callers (or their caches)
+                cancelled.append((request, result.get("tokens_saved", 0)))
+                request.future.set_exception(_cancelled_error(request))
+            else:
+                request.future.set_result(result)
+        self._record(batch, new_tokens, elapsed, started, cancelled)
+
+    def _record(
+        self,
+        batch: List[GenerationRequest],
+        new_tokens: int,
+        elapsed: float,
+        started: float,
+        cancelled: List[Tuple[GenerationRequest, int]]
+    ):
+        with self._cond:
+            for request, tokens_saved in cancelled:
+                self._count_cancelled(request, tokens_saved)
+            size = len(batch)
+            self._metrics["batches"] += 1
+            self._metrics["requests"] += size
+            self._metrics["generated_tokens"] += new_tokens
+            self._metrics["generation_seconds"] += elapsed
+            self._metrics["queue_wait_seconds"] += sum(started - r.enqueued_at for r in batch)
+            for request in batch:
+                waits = self._class_waits.setdefault(request.priority, {"requests": 0, "wait_seconds": 0.0})
+                waits["requests"] += 1
+                waits["wait_seconds"] += started - request.enqueued_at
+            self._metrics["occupancy_sum"] += size / self.max_batch_size
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(size, 0) + 1
+            self._last_batch = {
+                "size": size,
+                "endpoints": sorted(set(r.endpoint for r in batch)),
+                "new_tokens": new_tokens,
+                "seconds": round(elapsed, 3),
+                "tokens_per_second": round(new_tokens / elapsed, 2) if elapsed > 0 else None,
+            }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Throughput, batch occupancy and queueing statistics"""
+        with self._cond:
+            m = dict(self._metrics)
+            batches = m["batches"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "queued": len(self._queue),
+                "batches": batches,
+                "requests": m["requests"],
+                "failed_requests": m["failed_requests"],
+                "generated_tokens": m["generated_tokens"],
+                "tokens_per_second": round(m["generated_tokens"] / m["generation_seconds"], 2) if m["generation_seconds"] > 0 else None,
+                "avg_batch_size": round(m["requests"] / batches, 2) if batches else None,
+                "avg_batch_occupancy": round(m["occupancy_sum"] / batches, 3) if batches else None,
+                "avg_queue_wait_ms": round(m["queue_wait_seconds"] / m["requests"] * 1000, 1) if m["requests"] else None,
+                "avg_queue_wait_ms_by_priority": {
+                    p: round(w["wait_seconds"] / w["requests"] * 1000, 1) if w["requests"] else None
+                    for p, w in self._class_waits.items()
+                },
+                "queued_by_priority": {p: sum(1 for r in self._queue if r.priority == p) for p in PRIORITIES},
+                "cancelled_requests": m["cancelled_requests"],
+                "cancelled_before_start": m["cancelled_before_start"],
+                "cancelled_by_reason": dict(self._cancelled_by_reason),
+                "tokens_saved": m["tokens_saved"],
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "last_batch": self._last_batch,
+                "timestamp": datetime.now().isoformat()
+            }
+
+
+def _cancelled_error(request: GenerationRequest) -> DeadlineExceededError:
+    reason = request.cancel_reason or CANCELLED
+    if reason == DISCONNECT:
+        return DeadlineExceededError("Client disconnected before generation finished", reason=reason)
+    if reason == CANCELLED:
+        return DeadlineExceededError("Generation cancelled", reason=reason)
+    return DeadlineExceededError(reason=reason)
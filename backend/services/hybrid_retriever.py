@@ -0,0 +1,442 @@
+"""
+Hybrid lexical + vector retrieval.
+
+``BM25Index`` is a compact inverted index (per-term numpy arrays of chunk
+rows and term frequencies) built when the knowledge index is built and saved
+next to it as append-only segments, so ingestion checkpoints only write what
+they add and chunk texts stay on disk. ``HybridRetriever`` runs BM25 and the vector retriever, fuses the
+two rankings with reciprocal rank fusion and caches fused results per query,
+so exact terms such as drug names or "hba1c" are found even when the
+embedding misses them.
+"""
+
+import os
+import re
+import bisect
+import json
+import math
+import threading
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+
+logger = logging.getLogger(__name__)
+
+BM25_MANIFEST_FILE = "bm25.json"
+BM25_TEXTS_FILE = "bm25_texts.jsonl"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _id_key(doc_id: str) -> int:
+    """64-bit key of a chunk ID (a hex digest), kept instead of the ID itself"""
+    return int(doc_id[:16], 16)
+
+
+class _Segment:
+    """Postings of a contiguous run of rows in CSR form (rows local to the segment)
+
+    An unsaved segment holds its chunks' texts and metadata; once saved only
+    their byte offsets in the texts file are kept.
+    """
+
+    def __init__(
+        self,
+        start: int,
+        terms: List[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        lengths: np.ndarray,
+        keys: np.ndarray,
+        documents: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+        text_offsets: Optional[np.ndarray] = None
+    ):
+        self.start = start
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths
+        # Sorted ID keys of the segment's chunks, for duplicate checks
+        self.keys = keys
+        self.documents = documents
+        self.text_offsets = text_offsets
+        self.file: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def saved(self) -> bool:
+        return self.text_offsets is not None
+
+    def posting(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        i = self.term_ids.get(term)
+        if i is None:
+            return None
+        return self.rows[self.offsets[i]:self.offsets[i + 1]], self.tfs[self.offsets[i]:self.offsets[i + 1]]
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.searchsorted(self.keys, keys).clip(max=max(len(self.keys) - 1, 0))
+        return self.keys[found] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+
+    @classmethod
+    def from_documents(cls, start: int, documents: List[Document], keys: List[int]) -> "_Segment":
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for row, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                rows, tfs = postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[t][0]) for t in terms], out=offsets[1:])
+        return cls(
+            start,
+            terms,
+            offsets,
+            np.asarray([r for t in terms for r in postings[t][0]], dtype=np.int32),
+            np.asarray([f for t in terms for f in postings[t][1]], dtype=np.float32),
+            np.asarray(lengths, dtype=np.float32),
+            np.sort(np.asarray(keys, dtype=np.uint64)),
+            documents=[(d.page_content, dict(d.metadata)) for d in documents]
+        )
+
+    @classmethod
+    def load(cls, index_dir: str, name: str) -> "_Segment":
+        with np.load(os.path.join(index_dir, name)) as arrays:
+            segment = cls(
+                int(arrays["start"]),
+                arrays["terms"].tolist(),
+                arrays["offsets"],
+                arrays["rows"],
+                arrays["tfs"],
+                arrays["lengths"],
+                arrays["keys"],
+                text_offsets=arrays["text_offsets"]
+            )
+        segment.file = name
+        return segment
+
+    @classmethod
+    def merge(cls, segments: List["_Segment"]) -> "_Segment":
+        """One segment covering consecutive segments, postings still sorted by row"""
+        start = segments[0].start
+        terms = sorted(set().union(*(segment.terms for segment in segments)))
+        term_ids = {term: i for i, term in enumerate(terms)}
+        posting_terms, rows, tfs = [], [], []
+        for segment in segments:
+            mapping = np.asarray([term_ids[t] for t in segment.terms], dtype=np.int64)
+            posting_terms.append(np.repeat(mapping, np.diff(segment.offsets)))
+            rows.append(segment.rows + (segment.start - start))
+            tfs.append(segment.tfs)
+        posting_terms = np.concatenate(posting_terms)
+        # Segments are in row order, so a stable sort by term keeps rows ascending
+        order = np.argsort(posting_terms, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+        saved = all(segment.saved for segment in segments)
+        return cls(
+            start,
+            terms,
+            offsets,
+            np.concatenate(rows)[order].astype(np.int32),
+            np.concatenate(tfs)[order],
+            np.concatenate([segment.lengths for segment in segments]),
+            np.sort(np.concatenate([segment.keys for segment in segments])),
+            documents=None if saved else [d for segment in segments for d in segment.documents],
+            text_offsets=np.concatenate([segment.text_offsets for segment in segments]) if saved else None
+        )
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring, kept as append-only segments
+
+    Each ``add`` makes a small segment; ``save`` writes the segments added
+    since the last save as one new segment file and appends their chunk texts
+    to a texts file, so a checkpoint costs only what it adds. ``compact``
+    merges the saved segments into one. Saved chunk texts are read back from
+    the texts file on demand instead of being held in memory.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._segments: List[_Segment] = []
+        self._starts: List[int] = []
+        self._count = 0
+        self._total_length = 0.0
+        self._index_dir: Optional[str] = None
+        self._next_segment = 0
+        self._texts_file = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], ids: Optional[List[str]] = None) -> "BM25Index":
+        index = cls()
+        index.add(documents, ids)
+        return index
+
+    def add(self, documents: List[Document], ids: Optional[List[str]] = None) -> int:
+        """Index documents whose IDs are not present yet"""
+        from services.knowledge_index import chunk_id
+        ids = ids or [chunk_id(d) for d in documents]
+        keys = np.asarray([_id_key(doc_id) for doc_id in ids], dtype=np.uint64)
+        with self._lock:
+            known = np.zeros(len(keys), dtype=bool)
+            for segment in self._segments:
+                known |= segment.contains(keys)
+            new_documents, new_keys, seen = [], [], set()
+            for document, key, is_known in zip(documents, keys.tolist(), known.tolist()):
+                if is_known or key in seen:
+                    continue
+                seen.add(key)
+                new_documents.append(document)
+                new_keys.append(key)
+            if not new_documents:
+                return 0
+            segment = _Segment.from_documents(self._count, new_documents, new_keys)
+            self._segments.append(segment)
+            self._starts.append(segment.start)
+            self._count += len(segment)
+            self._total_length += float(segment.lengths.sum())
+            return len(segment)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Top-k (row, BM25 score) pairs"""
+        with self._lock:
+            segments = list(self._segments)
+            n = self._count
+            avg_length = self._total_length / n if n else 1.0
+        if not n:
+            return []
+        avg_length = avg_length or 1.0
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            postings = [(segment, segment.posting(term)) for segment in segments]
+            postings = [(segment, posting) for segment, posting in postings if posting is not None]
+            if not postings:
+                continue
+            df = sum(len(rows) for _, (rows, _) in postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for segment, (rows, tfs) in postings:
+                norm = self.k1 * (1 - self.b + self.b * segment.lengths[rows] / avg_length)
+                scores[segment.start + rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        hits = np.flatnonzero(scores)
+        if not hits.size:
+            return []
+        k = min(k, hits.size)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def document(self, row: int) -> Document:
+        with self._lock:
+            segment = self._segments[bisect.bisect_right(self._starts, row) - 1]
+            if not segment.saved:
+                text, metadata = segment.documents[row - segment.start]
+                return Document(page_content=text, metadata=dict(metadata))
+            if self._texts_file is None:
+                self._texts_file = open(os.path.join(self._index_dir, BM25_TEXTS_FILE), "rb")
+            self._texts_file.seek(int(segment.text_offsets[row - segment.start]))
+            line = self._texts_file.readline()
+        chunk = json.loads(line)
+        return Document(page_content=chunk["text"], metadata=chunk["metadata"])
+
+    def save(self, index_dir: str):
+        """Write the segments added since the last save as one new segment"""
+        with self._lock:
+            unsaved = [segment for segment in self._segments if not segment.saved]
+        if not unsaved:
+            return
+        segment = _Segment.merge(unsaved)
+        text_offsets = np.zeros(len(segment), dtype=np.int64)
+        with open(os.path.join(index_dir, BM25_TEXTS_FILE), "ab") as f:
+            position = f.tell()
+            for i, (text, metadata) in enumerate(segment.documents):
+                line = json.dumps({"text": text, "metadata": metadata}).encode("utf-8") + b"\n"
+                text_offsets[i] = position
+                f.write(line)
+                position += len(line)
+        segment.documents = None
+        segment.text_offsets = text_offsets
+        with self._lock:
+            segments = [s for s in self._segments if s.saved] + [segment]
+            segments += [s for s in self._segments if not s.saved and s not in unsaved]
+            self._write(index_dir, segments, new=[segment])
+
+    def compact(self, index_dir: str):
+        """Merge the saved segments into one; chunk texts are not rewritten"""
+        with self._lock:
+            saved = [segment for segment in self._segments if segment.saved]
+        if len(saved) < 2:
+            return
+        merged = _Segment.merge(saved)
+        with self._lock:
+            segments = [merged] + [s for s in self._segments if s not in saved]
+            self._write(index_dir, segments, new=[merged])
+        for segment in saved:
+            try:
+                os.remove(os.path.join(index_dir, segment.file))
+            except OSError:
+                pass
+
+    def _write(self, index_dir: str, segments: List[_Segment], new: List[_Segment]):
+        """Write new segment files, then the manifest listing the saved ones (lock held)"""
+        for segment in new:
+            segment.file = f"bm25_{self._next_segment:05d}.npz"
+            self._next_segment += 1
+            np.savez(
+                os.path.join(index_dir, segment.file),
+                start=np.int64(segment.start),
+                terms=np.asarray(segment.terms, dtype=str),
+                offsets=segment.offsets,
+                rows=segment.rows,
+                tfs=segment.tfs,
+                lengths=segment.lengths,
+                keys=segment.keys,
+                text_offsets=segment.text_offsets
+            )
+        self._segments = segments
+        self._starts = [segment.start for segment in segments]
+        self._index_dir = index_dir
+        manifest = {
+            "k1": self.k1,
+            "b": self.b,
+            "documents": sum(len(segment) for segment in segments if segment.saved),
+            "segments": [segment.file for segment in segments if segment.saved],
+            "next_segment": self._next_segment,
+        }
+        path = os.path.join(index_dir, BM25_MANIFEST_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_dir: str, attempts: int = 3) -> Optional["BM25Index"]:
+        """Open a saved index; None when none was saved in index_dir"""
+        for attempt in range(attempts):
+            try:
+                with open(os.path.join(index_dir, BM25_MANIFEST_FILE), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            try:
+                segments = [_Segment.load(index_dir, name) for name in manifest["segments"]]
+            except FileNotFoundError:
+                # Merged by a concurrent compact(); its manifest lists the new segment
+                if attempt == attempts - 1:
+                    raise
+                continue
+            index = cls(manifest["k1"], manifest["b"])
+            index._segments = segments
+            index._starts = [segment.start for segment in segments]
+            index._count = sum(len(segment) for segment in segments)
+            index._total_length = float(sum(segment.lengths.sum() for segment in segments))
+            index._index_dir = index_dir
+            index._next_segment = manifest["next_segment"]
+            return index
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            segments = list(self._segments)
+        return {
+            "documents": self._count,
+            "terms": len(set().union(*(segment.terms for segment in segments))),
+            "postings": sum(len(segment.rows) for segment in segments),
+            "segments": len(segments),
+            "unsaved_documents": sum(len(segment) for segment in segments if not segment.saved),
+        }
+
+
+class HybridRetriever(BaseRetriever):
+    """Reciprocal rank fusion of BM25 and vector retrieval, cached per query"""
+
+    vector_retriever: Any
+    bm25: Any
+    k: int = 3
+    candidates: int = 20
+    rrf_k: int = 60
+    cache_size: int = 512
+    cache: Any = None
+    cache_lock: Any = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def clear_cache(self):
+        with self.cache_lock:
+            self.cache.clear()
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        cached = self._cache_get(query)
+        if cached is not None:
+            return cached
+        return self._fuse(query, self.vector_retriever.get_relevant_documents(query))
+
+    def retrieve_batch(self, queries: List[str], vectors=None) -> List[List[Document]]:
+        """Fused documents for several queries; cache misses share one vector search"""
+        from services.knowledge_index import retrieve_batch
+        results: List[Optional[List[Document]]] = [self._cache_get(query) for query in queries]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            vector_docs = retrieve_batch(
+                self.vector_retriever,
+                [queries[i] for i in misses],
+                [vectors[i] for i in misses] if vectors is not None else None
+            )
+            for i, docs in zip(misses, vector_docs):
+                results[i] = self._fuse(queries[i], docs)
+        return results
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _cache_get(self, query: str) -> Optional[List[Document]]:
+        key = self._cache_key(query)
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return list(self.cache[key])
+        return None
+
+    def _fuse(self, query: str, vector_docs: List[Document]) -> List[Document]:
+        """Reciprocal rank fusion of the vector ranking with BM25, then cache"""
+        from services.knowledge_index import chunk_id
+        fused: Dict[str, float] = {}
+        documents: Dict[str, Document] = {}
+        lexical_docs = [self.bm25.document(row) for row, _ in self.bm25.search(query, self.candidates)] if self.bm25 else []
+        for ranking in (vector_docs, lexical_docs):
+            for rank, document in enumerate(ranking):
+                doc_id = chunk_id(document)
+                documents.setdefault(doc_id, document)
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        result = [documents[doc_id] for doc_id in ranked]
+
+        with self.cache_lock:
+            self.cache[self._cache_key(query)] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return list(result)
@@ -0,0 +1,281 @@
+"""
+Bounded, priority-aware worker pool for blocking model inference.
+
+Async routes hand their model calls to this executor so a long generation
+never runs on the uvicorn event loop. Calls wait in one queue per priority
+class (see ``services.admission``); whenever a worker is free the next call
+is taken by weighted fair scheduling across the classes, skipping callers
+that already have their maximum number of calls running.
+
+Under overload the lowest classes are shed first: each class may only fill
+its share of the queue, a new call is rejected when its class's estimated
+queue wait exceeds the class SLO, and a full queue makes room for a more
+important call by evicting the newest queued call of a less important
+class. Rejected and evicted calls raise ServiceOverloadedError (503 +
+Retry-After).
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Optional
+
+from config import settings
+from exceptions import ServiceOverloadedError
+from services.admission import PRIORITIES, WeightedFairSelector, current_priority, current_user, rank
+
+logger = logging.getLogger(__name__)
+
+# Recent queue waits kept per class for percentiles
+WAIT_SAMPLES = 512
+
+
+class _Ticket:
+    """A call waiting for a worker"""
+
+    __slots__ = ("priority", "user", "enqueued_at", "future", "loop", "granted")
+
+    def __init__(self, priority: str, user: Optional[str], loop: asyncio.AbstractEventLoop):
+        self.priority = priority
+        self.user = user
+        self.enqueued_at = time.perf_counter()
+        self.loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self.granted = False
+
+
+class InferenceExecutor:
+    """Awaitable, depth-limited thread pool for model calls"""
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue_depth: int = 16,
+        retry_after_seconds: int = 5,
+        weights: Optional[Dict[str, float]] = None,
+        queue_shares: Optional[Dict[str, float]] = None,
+        queue_slo_ms: Optional[Dict[str, float]] = None,
+        max_per_user: int = 0
+    ):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.retry_after_seconds = retry_after_seconds
+        self.queue_shares = {p: (queue_shares or {}).get(p, 1.0) for p in PRIORITIES}
+        self.queue_slo_ms = {p: (queue_slo_ms or {}).get(p) for p in PRIORITIES}
+        self.max_per_user = max_per_user
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._selector = WeightedFairSelector(weights or {})
+        self._queues: Dict[str, Deque[_Ticket]] = {p: deque() for p in PRIORITIES}
+        self._running = 0
+        self._running_by_user: Dict[str, int] = {}
+        # Smoothed seconds per call, for queue wait estimates
+        self._service_seconds: Optional[float] = None
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._class_stats = {
+            p: {"submitted": 0, "completed": 0, "rejected": 0, "shed": 0, "slo_violations": 0, "wait_seconds": 0.0, "dispatched": 0}
+            for p in PRIORITIES
+        }
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls waiting for a free worker"""
+        return sum(len(q) for q in self._queues.values())
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable on the pool and await its result"""
+        loop = asyncio.get_running_loop()
+        ticket = _Ticket(current_priority(), current_user(), loop)
+        with self._lock:
+            self._admit(ticket)
+            self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if ticket.granted:
+                    # Granted a worker just as the caller went away
+                    self._release(ticket)
+                elif ticket in self._queues[ticket.priority]:
+                    self._queues[ticket.priority].remove(ticket)
+            raise
+
+        # Carry request-scoped context variables into the worker thread
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._pool, call)
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._observe_service(time.perf_counter() - started)
+                self._release(ticket)
+
+        with self._lock:
+            self._stats["completed"] += 1
+            self._class_stats[ticket.priority]["completed"] += 1
+        return result
+
+    def _admit(self, ticket: _Ticket):
+        """Queue a ticket or raise ServiceOverloadedError (lock held)"""
+        priority = ticket.priority
+        stats = self._class_stats[priority]
+        self._stats["submitted"] += 1
+        stats["submitted"] += 1
+
+        if self._running < self.max_workers and not self.queue_depth:
+            self._queues[priority].append(ticket)
+            return
+
+        queued = self.queue_depth
+        share = self.queue_shares[priority]
+        if share < 1.0 and queued >= share * self.max_queue_depth:
+            self._reject(priority)
+        slo_ms = self.queue_slo_ms[priority]
+        # The top class is never shed for a predicted SLO miss, only counted
+        if slo_ms and rank(priority) > 0 and self._estimated_wait(priority) * 1000 > slo_ms:
+            self._reject(priority)
+        if queued >= self.max_queue_depth and not self._evict_below(priority):
+            self._reject(priority)
+        self._queues[priority].append(ticket)
+
+    def _reject(self, priority: str):
+        self._stats["rejected"] += 1
+        self._class_stats[priority]["rejected"] += 1
+        raise ServiceOverloadedError(retry_after=self.retry_after_seconds)
+
+    def _evict_below(self, priority: str) -> bool:
+        """Drop the newest queued call of the least important class below priority"""
+        for lower in reversed(PRIORITIES):
+            if rank(lower) <= rank(priority):
+                return False
+            if self._queues[lower]:
+                victim = self._queues[lower].pop()
+                self._class_stats[lower]["shed"] += 1
+                self._stats["rejected"] += 1
+                error = ServiceOverloadedError(retry_after=self.retry_after_seconds)
+                victim.loop.call_soon_threadsafe(_set_exception, victim.future, error)
+                return True
+        return False
+
+    def _estimated_wait(self, priority: str) -> float:
+        """Seconds a new call of this class would queue, ignoring lower classes"""
+        if not self._service_seconds:
+            return 0.0
+        ahead = sum(len(self._queues[p]) for p in PRIORITIES if rank(p) <= rank(priority))
+        return (ahead + 1) * self._service_seconds / self.max_workers
+
+    def _observe_service(self, seconds: float):
+        if self._service_seconds is None:
+            self._service_seconds = seconds
+        else:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+
+    def _dispatch(self):
+        """Hand free workers to queued calls, fairly across classes (lock held)"""
+        while self._running < self.max_workers:
+            eligible = {p: self._next_eligible(p) for p in PRIORITIES}
+            priority = self._selector.pick(p for p, ticket in eligible.items() if ticket is not None)
+            if priority is None:
+                return
+            ticket = eligible[priority]
+            self._queues[priority].remove(ticket)
+            self._selector.charge(priority)
+            ticket.granted = True
+            self._running += 1
+            if ticket.user is not None:
+                self._running_by_user[ticket.user] = self._running_by_user.get(ticket.user, 0) + 1
+
+            waited = time.perf_counter() - ticket.enqueued_at
+            stats = self._class_stats[priority]
+            stats["dispatched"] += 1
+            stats["wait_seconds"] += waited
+            self._waits[priority].append(waited)
+            slo_ms = self.queue_slo_ms[priority]
+            if slo_ms and waited * 1000 > slo_ms:
+                stats["slo_violations"] += 1
+            ticket.loop.call_soon_threadsafe(_set_result, ticket.future)
+
+    def _next_eligible(self, priority: str) -> Optional[_Ticket]:
+        """Oldest queued call of a class whose caller is under the concurrency cap"""
+        for ticket in self._queues[priority]:
+            if not self.max_per_user or ticket.user is None or self._running_by_user.get(ticket.user, 0) < self.max_per_user:
+                return ticket
+        return None
+
+    def _release(self, ticket: _Ticket):
+        """A granted call finished (lock held)"""
+        self._running -= 1
+        if ticket.user is not None:
+            remaining = self._running_by_user.get(ticket.user, 1) - 1
+            if remaining > 0:
+                self._running_by_user[ticket.user] = remaining
+            else:
+                self._running_by_user.pop(ticket.user, None)
+        self._dispatch()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current load, lifetime counters and queue waits per priority class"""
+        with self._lock:
+            classes = {}
+            for priority in PRIORITIES:
+                stats = self._class_stats[priority]
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    "queued": len(self._queues[priority]),
+                    "submitted": stats["submitted"],
+                    "completed": stats["completed"],
+                    "rejected": stats["rejected"],
+                    "shed": stats["shed"],
+                    "slo_ms": self.queue_slo_ms[priority],
+                    "slo_violations": stats["slo_violations"],
+                    "avg_wait_ms": round(stats["wait_seconds"] / stats["dispatched"] * 1000, 1) if stats["dispatched"] else None,
+                    "p95_wait_ms": round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0] * 1000, 1) if waits else None,
+                }
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_depth": self.max_queue_depth,
+                "max_per_user": self.max_per_user,
+                "running": self._running,
+                "queue_depth": self.queue_depth,
+                "avg_service_ms": round(self._service_seconds * 1000, 1) if self._service_seconds else None,
+                **self._stats,
+                "classes": classes,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait)
+
+
+def _set_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _set_exception(future: asyncio.Future, error: Exception):
+    if not future.done():
+        future.set_exception(error)
+
+
+# Global executor instance
+inference_executor = InferenceExecutor(
+    max_workers=settings.inference_workers,
+    max_queue_depth=settings.inference_max_queue,
+    retry_after_seconds=settings.inference_retry_after_seconds,
+    weights=settings.admission_weights,
+    queue_shares=settings.admission_queue_shares,
+    queue_slo_ms=settings.admission_queue_slo_ms,
+    max_per_user=settings.admission_max_per_user
+)
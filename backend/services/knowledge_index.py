@@ -0,0 +1,495 @@
+"""
+Versioned, persistent vector index over the medical knowledge corpus.
+
+Each index version lives in its own directory named after a content hash of
+the corpus, the splitter settings and the embedding model. On startup the
+active version is simply opened when its hash still matches; when the corpus
+changes the previous version keeps serving while the new one is built in a
+background thread, then retrievers are switched over to it. Chunks are keyed
+by a hash of their content, so a chunk that is already stored is never added
+twice.
+
+Vectors live either in Chroma or in a memory-mapped FlatVectorIndex
+(``settings.vector_backend``); both are exposed as LangChain retrievers. A
+BM25 inverted index over the same chunks is saved with every version for
+hybrid retrieval. Curated articles are streamed into the active version by
+``services.knowledge_ingestion``; their sources are recorded in the manifest
+and re-ingested whenever a new version is built.
+
+Every build and ingestion checkpoint bumps the manifest revision. Other
+processes (uvicorn workers, or all of them after a CLI ingestion) notice it
+through ``refresh`` and reopen the active version.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores import Chroma
+
+from services.flat_vector_index import FlatVectorIndex, FlatVectorRetriever
+from services.hybrid_retriever import BM25Index, HybridRetriever
+from services.knowledge_ingestion import iter_chunk_batches
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+COLLECTION_NAME = "medical_knowledge"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "build.lock"
+# A build lock older than this is assumed to belong to a crashed process
+STALE_LOCK_SECONDS = 3600
+# Chunks embedded per call when filling a flat index
+EMBED_BATCH_SIZE = 64
+
+
+def chunk_id(document: Document) -> str:
+    """Stable ID of a chunk: hash of its text and source"""
+    source = str(document.metadata.get("source", ""))
+    return hashlib.sha256(f"{source}\x00{document.page_content}".encode("utf-8")).hexdigest()
+
+
+def add_unique(store: Any, documents: List[Document], embeddings: Any = None) -> int:
+    """Add chunks whose IDs are not in the store yet; returns how many were added"""
+    unique: Dict[str, Document] = {}
+    for document in documents:
+        unique.setdefault(chunk_id(document), document)
+    if not unique:
+        return 0
+
+    if isinstance(store, FlatVectorIndex):
+        new_ids = [i for i in unique if not store.contains(i)]
+        added = 0
+        for start in range(0, len(new_ids), EMBED_BATCH_SIZE):
+            batch_ids = new_ids[start:start + EMBED_BATCH_SIZE]
+            texts = [unique[i].page_content for i in batch_ids]
+            added += store.add(
+                batch_ids,
+                texts,
+                embeddings.embed_documents(texts),
+                [unique[i].metadata for i in batch_ids]
+            )
+        return added
+
+    existing = set(store._collection.get(ids=list(unique), include=[])["ids"])
+    new_ids = [i for i in unique if i not in existing]
+    for start in range(0, len(new_ids), EMBED_BATCH_SIZE):
+        batch_ids = new_ids[start:start + EMBED_BATCH_SIZE]
+        store.add_documents([unique[i] for i in batch_ids], ids=batch_ids)
+    return len(new_ids)
+
+
+def open_store(backend: str, path: str, embeddings: Any, flat_dtype: str = "float16",
+               collection_name: str = COLLECTION_NAME, partition_key: Optional[str] = None):
+    """Chroma collection or flat index persisted at path
+
+    ``partition_key`` names the metadata key searches are usually filtered
+    on; the flat index keeps its rows per value (Chroma ignores it).
+    """
+    if backend == "flat":
+        return FlatVectorIndex(path, dtype=flat_dtype, partition_key=partition_key)
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        persist_directory=path
+    )
+
+
+def store_retriever(store: Any, embeddings: Any, search_kwargs: Dict[str, Any]):
+    """LangChain retriever over either kind of store"""
+    if isinstance(store, FlatVectorIndex):
+        return FlatVectorRetriever(
+            index=store,
+            embeddings=embeddings,
+            k=search_kwargs.get("k", 4),
+            search_filter=search_kwargs.get("filter")
+        )
+    return store.as_retriever(search_kwargs=search_kwargs)
+
+
+def retrieve_batch(retriever: Any, queries: List[str], vectors=None) -> List[List[Document]]:
+    """Documents for several queries, embedding them in one call where possible"""
+    if hasattr(retriever, "retrieve_batch"):
+        return retriever.retrieve_batch(queries, vectors)
+    store = getattr(retriever, "vectorstore", None)
+    if not isinstance(store, Chroma) or getattr(retriever, "search_type", "similarity") != "similarity":
+        return [retriever.get_relevant_documents(query) for query in queries]
+    if vectors is None:
+        vectors = store.embeddings.embed_documents(queries)
+    search_kwargs = retriever.search_kwargs
+    rows = store._collection.query(
+        query_embeddings=[list(map(float, v)) for v in vectors],
+        n_results=search_kwargs.get("k", 4),
+        where=search_kwargs.get("filter") or None,
+        include=["documents", "metadatas"]
+    )
+    return [
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(rows["documents"], rows["metadatas"])
+    ]
+
+
+class KnowledgeIndex:
+    """Content-hashed vector index with background rebuilds"""
+
+    def __init__(
+        self,
+        embeddings: Any,
+        index_dir: str = "./medical_knowledge_db",
+        chunk_size: int = 500,
+        chunk_overlap: int = 50,
+        backend: str = "chroma",
+        flat_dtype: str = "float16",
+        ingest_batch_size: int = 256,
+        check_seconds: float = 5.0
+    ):
+        self.embeddings = embeddings
+        self.index_dir = index_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.backend = backend
+        self.flat_dtype = flat_dtype
+        self.ingest_batch_size = ingest_batch_size
+        self.check_seconds = check_seconds
+        self.store: Any = None
+        self.bm25: Optional[BM25Index] = None
+        self.version: Optional[str] = None
+        # Bumped in the manifest by every build and ingestion checkpoint
+        self.revision = 0
+        self.chunk_count = 0
+        self.building: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self._retrievers: List[Any] = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._manifest_mtime: Optional[int] = None
+        self._checked_at = 0.0
+        os.makedirs(index_dir, exist_ok=True)
+
+    def splitter(self) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
+    def corpus_hash(self, texts: Iterable[str]) -> str:
+        """Version key: corpus content, splitter settings and embedding model"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "backend": self.backend,
+            "flat_dtype": self.flat_dtype if self.backend == "flat" else None,
+        }, sort_keys=True).encode("utf-8"))
+        for text in texts:
+            digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def open(self, texts: List[str]) -> "KnowledgeIndex":
+        """Open the index for this corpus, building or scheduling a rebuild if needed"""
+        version = self.corpus_hash(texts)
+        manifest = self._read_manifest()
+        active = manifest.get("active")
+
+        if active == version and os.path.isdir(self.version_dir(version)):
+            self._activate(version, manifest)
+            logger.info(f"Opened knowledge index {version[:12]} ({self.chunk_count} chunks)")
+            return self
+
+        if active and os.path.isdir(self.version_dir(active)):
+            # Keep serving the previous version while the new one builds
+            self._activate(active, manifest)
+            logger.info(f"Knowledge corpus changed; rebuilding {version[:12]} in the background")
+            threading.Thread(
+                target=self._build_or_follow, args=(version, texts), name="knowledge-index-build", daemon=True
+            ).start()
+            return self
+
+        # Nothing usable on disk yet: the first build has to finish before serving
+        if not self._build(version, texts) and not self._wait_for(version):
+            raise RuntimeError(f"Could not build knowledge index: {self.last_error}")
+        return self
+
+    def _build_or_follow(self, version: str, texts: List[str]):
+        """Background rebuild; while another process holds the build lock, wait
+        for it and switch to the version it publishes, else build it here"""
+        self.last_error = None
+        while not self._build(version, texts):
+            if self.last_error is not None or self._wait_for(version):
+                return
+
+    def _wait_for(self, version: str, timeout: float = STALE_LOCK_SECONDS) -> bool:
+        """Wait for another process's build of this version to be published"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and os.path.exists(os.path.join(self.index_dir, LOCK_FILE)):
+            time.sleep(1)
+        manifest = self._read_manifest()
+        if manifest.get("active") != version:
+            return False
+        self._activate(version, manifest)
+        return True
+
+    def refresh(self) -> bool:
+        """Follow builds and ingestions published by other processes
+
+        Checks the manifest at most every check_seconds; when it names another
+        version or a newer revision, the store and BM25 index are reopened.
+        Returns whether anything was reloaded.
+        """
+        if time.monotonic() - self._checked_at < self.check_seconds or self.building:
+            return False
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            mtime = self._manifest_file_mtime()
+            if mtime == self._manifest_mtime:
+                return False
+            self._manifest_mtime = mtime
+            manifest = self._read_manifest()
+            active = manifest.get("active")
+            if not active or not os.path.isdir(self.version_dir(active)):
+                return False
+            if active == self.version and manifest.get("revision", 0) <= self.revision:
+                return False
+            self._activate(active, manifest)
+            logger.info(f"Reloaded knowledge index {active[:12]} revision {self.revision}")
+            return True
+        except Exception as e:
+            # Retried at the next check
+            self._manifest_mtime = None
+            logger.error(f"Could not reload the knowledge index: {e}")
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    def as_retriever(
+        self,
+        search_kwargs: Optional[Dict[str, Any]] = None,
+        hybrid: bool = False,
+        candidates: int = 20,
+        rrf_k: int = 60,
+        cache_size: int = 512
+    ):
+        """Retriever that follows the index across background rebuilds"""
+        search_kwargs = search_kwargs or {}
+        if hybrid:
+            # Both rankings supply `candidates` chunks; fusion keeps the top k
+            vector_retriever = self.as_retriever({**search_kwargs, "k": candidates})
+            with self._lock:
+                retriever = HybridRetriever(
+                    vector_retriever=vector_retriever,
+                    bm25=self.bm25,
+                    k=search_kwargs.get("k", 4),
+                    candidates=candidates,
+                    rrf_k=rrf_k,
+                    cache_size=cache_size
+                )
+                self._retrievers.append(retriever)
+            return retriever
+        with self._lock:
+            retriever = store_retriever(self.store, self.embeddings, search_kwargs)
+            self._retrievers.append(retriever)
+        return retriever
+
+    def _open_store(self, path: str):
+        return open_store(self.backend, path, self.embeddings, self.flat_dtype)
+
+    def version_dir(self, version: Optional[str] = None) -> str:
+        """Directory of a version (the active one by default)"""
+        return os.path.join(self.index_dir, f"v_{(version or self.version)[:16]}")
+
+    def _all_documents(self, store) -> List[Document]:
+        if isinstance(store, FlatVectorIndex):
+            return [store.document(row) for row in range(len(store))]
+        rows = store._collection.get(include=["documents", "metadatas"])
+        return [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(rows["documents"], rows["metadatas"])
+        ]
+
+    def _activate(self, version: str, manifest: Dict[str, Any]):
+        version_dir = self.version_dir(version)
+        store = self._open_store(version_dir)
+        bm25 = BM25Index.load(version_dir)
+        if bm25 is None:
+            # Versions built before hybrid retrieval get their BM25 index now
+            bm25 = BM25Index.from_documents(self._all_documents(store))
+            bm25.save(version_dir)
+        with self._lock:
+            self.store = store
+            self.bm25 = bm25
+            self.version = version
+            self.revision = manifest.get("revision", 0)
+            self.chunk_count = manifest.get("chunk_count", 0)
+            for retriever in self._retrievers:
+                if isinstance(retriever, HybridRetriever):
+                    retriever.bm25 = bm25
+                    retriever.clear_cache()
+                elif isinstance(retriever, FlatVectorRetriever):
+                    retriever.index = store
+                else:
+                    retriever.vectorstore = store
+
+    def _build(self, version: str, texts: List[str]) -> bool:
+        if not self._acquire_build_lock():
+            logger.info("Another process is building the knowledge index")
+            return False
+        self.building = version
+        started = time.perf_counter()
+        version_dir = self.version_dir(version)
+        try:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            documents = self.splitter().split_documents(
+                [Document(page_content=text, metadata={"source": "knowledge"}) for text in texts]
+            )
+            store = self._open_store(version_dir)
+            chunk_count = add_unique(store, documents, self.embeddings)
+            bm25 = BM25Index.from_documents(documents)
+            # Articles ingested into the previous version are carried over
+            manifest = self._read_manifest()
+            sources = [p for p in manifest.get("sources", []) if os.path.exists(p)]
+            for batch, _ in iter_chunk_batches(sources, self.splitter(), self.ingest_batch_size):
+                chunk_count += add_unique(store, batch, self.embeddings)
+                bm25.add(batch)
+                self._touch_build_lock()
+            bm25.save(version_dir)
+            previous = manifest.get("active")
+            manifest = self._write_manifest({
+                "active": version,
+                "chunk_count": chunk_count,
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "embedding_model": EMBEDDING_MODEL_NAME,
+                "backend": self.backend,
+                "sources": sources,
+                "built_at": datetime.now().isoformat(),
+                "build_seconds": round(time.perf_counter() - started, 2),
+            })
+            self._activate(version, manifest)
+            self._prune(keep={version, previous})
+            self.last_error = None
+            logger.info(f"Built knowledge index {version[:12]}: {chunk_count} chunks")
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Knowledge index build failed: {e}")
+            return False
+        finally:
+            self.building = None
+            self._release_build_lock()
+
+    def begin_ingestion(self) -> bool:
+        """Take the build lock so ingestion and rebuilds never overlap"""
+        return self.version is not None and self._acquire_build_lock()
+
+    def append(self, documents: List[Document]) -> int:
+        """Add chunks to the active version; returns how many were new"""
+        with self._lock:
+            store, bm25 = self.store, self.bm25
+        added = add_unique(store, documents, self.embeddings)
+        bm25.add(documents)
+        with self._lock:
+            self.chunk_count += added
+        return added
+
+    def commit_ingestion(self, sources: List[str]):
+        """Save the BM25 postings added since the last checkpoint and record the ingested sources"""
+        self.bm25.save(self.version_dir())
+        manifest = self._read_manifest()
+        manifest["chunk_count"] = self.chunk_count
+        manifest["sources"] = sorted(set(manifest.get("sources", [])) | set(sources))
+        manifest["ingested_at"] = datetime.now().isoformat()
+        manifest = self._write_manifest(manifest)
+        self.revision = manifest["revision"]
+        with self._lock:
+            for retriever in self._retrievers:
+                if isinstance(retriever, HybridRetriever):
+                    retriever.clear_cache()
+        self._touch_build_lock()
+
+    def end_ingestion(self):
+        """Merge the checkpoint segments of the BM25 index, then release the lock"""
+        try:
+            self.bm25.compact(self.version_dir())
+        except Exception as e:
+            logger.error(f"Could not compact the BM25 index: {e}")
+        finally:
+            self._release_build_lock()
+
+    def _prune(self, keep):
+        """Remove old versions; the previous one stays for workers still using it"""
+        keep_dirs = {os.path.basename(self.version_dir(v)) for v in keep if v}
+        for name in os.listdir(self.index_dir):
+            if name.startswith("v_") and name not in keep_dirs:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Publish a manifest with the next revision (build lock held)"""
+        manifest = {**manifest, "revision": self._read_manifest().get("revision", 0) + 1}
+        path = os.path.join(self.index_dir, MANIFEST_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+        return manifest
+
+    def _manifest_file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.index_dir, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _acquire_build_lock(self) -> bool:
+        path = os.path.join(self.index_dir, LOCK_FILE)
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(fd, str(os.getpid()).encode("utf-8"))
+        os.close(fd)
+        return True
+
+    def _touch_build_lock(self):
+        """Keep a long-running build or ingestion from looking stale"""
+        try:
+            os.utime(os.path.join(self.index_dir, LOCK_FILE))
+        except OSError:
+            pass
+
+    def _release_build_lock(self):
+        try:
+            os.remove(os.path.join(self.index_dir, LOCK_FILE))
+        except OSError:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version[:12] if self.version else None,
+            "revision": self.revision,
+            "backend": self.backend,
+            "chunk_count": self.chunk_count,
+            "index_dir": self.index_dir,
+            "building": self.building[:12] if self.building else None,
+            "last_error": self.last_error,
+            "store": self.store.describe() if isinstance(self.store, FlatVectorIndex) else None,
+            "bm25": self.bm25.describe() if self.bm25 else None,
+        }
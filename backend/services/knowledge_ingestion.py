@@ -0,0 +1,222 @@
+"""
+Streaming ingestion of curated medical articles into the knowledge index.
+
+Sources are ``.txt``/``.md`` files (one article per file) and ``.jsonl``
+files (one ``{"text", "title"?, "id"?}`` article per line), given as files or
+directories. Articles are read one at a time, split with the index's
+splitter and appended to the active index version in fixed-size chunk
+batches, so memory is bounded by the batch size rather than the corpus.
+
+Progress is checkpointed in the index version directory as the file being
+read and a byte offset into it. An interrupted run resumes from there; files
+are walked in sorted order, and chunks already stored are skipped by ID, so
+re-reading a few articles after a crash is harmless.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = {".txt", ".md", ".markdown", ".jsonl"}
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+
+
+def discover_sources(paths: List[str]) -> Iterator[str]:
+    """Source files under the given paths, in a stable sorted order"""
+    for root in paths:
+        if os.path.isfile(root):
+            yield os.path.abspath(root)
+            continue
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS:
+                    yield os.path.abspath(os.path.join(directory, name))
+
+
+def read_articles(path: str, offset: int = 0) -> Iterator[Tuple[Document, int]]:
+    """Articles in a source file with the byte offset just past each one"""
+    if not path.lower().endswith(".jsonl"):
+        if offset:
+            return
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        if text.strip():
+            yield Document(page_content=text, metadata={"source": "knowledge", "origin": path}), os.path.getsize(path)
+        return
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        line_number = 0
+        for line in iter(f.readline, b""):
+            line_number += 1
+            end = f.tell()
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping malformed line at byte {end - len(line)} of {path}")
+                continue
+            text = record.get("text") if isinstance(record, dict) else None
+            if not text:
+                continue
+            metadata = {"source": "knowledge", "origin": path}
+            for key in ("title", "id"):
+                if record.get(key) is not None:
+                    metadata[key] = str(record[key])
+            yield Document(page_content=text, metadata=metadata), end
+
+
+def iter_chunk_batches(
+    paths: List[str],
+    splitter: Any,
+    batch_size: int,
+    start: Optional[Dict[str, Any]] = None
+) -> Iterator[Tuple[List[Document], Dict[str, Any]]]:
+    """Chunk batches from the sources, each with the position after it.
+
+    A batch is only cut after a whole article, so the position is always a
+    safe place to resume; a batch may exceed ``batch_size`` by at most one
+    article's chunks.
+    """
+    resume_path = (start or {}).get("path")
+    resume_offset = (start or {}).get("offset", 0)
+    if resume_path and not os.path.exists(resume_path):
+        logger.warning(f"Checkpoint source {resume_path} is gone; ingesting from the start")
+        resume_path = None
+
+    batch: List[Document] = []
+    position: Dict[str, Any] = {"path": resume_path, "offset": resume_offset, "articles": 0}
+    for path in discover_sources(paths):
+        offset = 0
+        if resume_path:
+            if path != resume_path:
+                continue
+            offset, resume_path = resume_offset, None
+        for article, end in read_articles(path, offset):
+            batch.extend(splitter.split_documents([article]))
+            position = {"path": path, "offset": end, "articles": position["articles"] + 1}
+            if len(batch) >= batch_size:
+                yield batch, position
+                batch = []
+    if batch:
+        yield batch, position
+
+
+class KnowledgeIngestor:
+    """Runs (or resumes) an ingestion into a KnowledgeIndex and reports progress"""
+
+    def __init__(self, index: Any, batch_size: int = 256, checkpoint_every: int = 10):
+        self.index = index
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.progress: Dict[str, Any] = {"status": "idle"}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.progress.get("status") == "running"
+
+    def start(self, paths: List[str], resume: bool = True, on_progress: Optional[Callable[[Dict], None]] = None) -> bool:
+        """Run in a background thread; False if an ingestion is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self.progress = {"status": "running", "sources": paths}
+        threading.Thread(
+            target=self.run, args=(paths, resume, on_progress), name="knowledge-ingest", daemon=True
+        ).start()
+        return True
+
+    def run(self, paths: List[str], resume: bool = True, on_progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, Any]:
+        """Ingest the sources, checkpointing every few batches"""
+        paths = [os.path.abspath(p) for p in paths]
+        if not self.index.begin_ingestion():
+            self.progress = {"status": "failed", "error": "Knowledge index is being built or ingested by another process"}
+            return self.progress
+
+        checkpoint = self._load_checkpoint(paths) if resume else None
+        started = time.perf_counter()
+        progress = {
+            "status": "running",
+            "sources": paths,
+            "resumed_from": checkpoint,
+            "batches": 0,
+            "articles": 0,
+            "chunks": 0,
+            "chunks_added": 0,
+            "current_file": None,
+            "elapsed_seconds": 0.0,
+            "chunks_per_second": 0.0,
+        }
+        self.progress = progress
+        position = checkpoint
+        try:
+            for batch, position in iter_chunk_batches(paths, self.index.splitter(), self.batch_size, checkpoint):
+                added = self.index.append(batch)
+                elapsed = time.perf_counter() - started
+                progress.update({
+                    "batches": progress["batches"] + 1,
+                    "articles": position["articles"],
+                    "chunks": progress["chunks"] + len(batch),
+                    "chunks_added": progress["chunks_added"] + added,
+                    "current_file": position["path"],
+                    "elapsed_seconds": round(elapsed, 2),
+                    "chunks_per_second": round((progress["chunks"] + len(batch)) / elapsed, 1) if elapsed else 0.0,
+                })
+                if progress["batches"] % self.checkpoint_every == 0:
+                    self.index.commit_ingestion(paths)
+                    self._save_checkpoint(paths, position, complete=False)
+                if on_progress:
+                    on_progress(dict(progress))
+
+            self.index.commit_ingestion(paths)
+            self._save_checkpoint(paths, position, complete=True)
+            progress["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Knowledge ingestion failed: {e}")
+            progress.update({"status": "failed", "error": str(e)})
+        finally:
+            self.index.end_ingestion()
+            progress["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+            progress["finished_at"] = datetime.now().isoformat()
+        logger.info(
+            f"Knowledge ingestion {progress['status']}: {progress['chunks_added']} new chunks "
+            f"from {progress['articles']} articles ({progress['chunks_per_second']} chunks/s)"
+        )
+        return progress
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.index.version_dir(), CHECKPOINT_FILE)
+
+    def _load_checkpoint(self, paths: List[str]) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._checkpoint_path(), "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if checkpoint.get("sources") != paths or checkpoint.get("complete"):
+            return None
+        logger.info(f"Resuming knowledge ingestion at {checkpoint['path']} byte {checkpoint['offset']}")
+        return {"path": checkpoint["path"], "offset": checkpoint["offset"], "articles": checkpoint.get("articles", 0)}
+
+    def _save_checkpoint(self, paths: List[str], position: Optional[Dict[str, Any]], complete: bool):
+        path = self._checkpoint_path()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "sources": paths,
+                **(position or {"path": None, "offset": 0, "articles": 0}),
+                "complete": complete,
+                "updated_at": datetime.now().isoformat(),
+            }, f, indent=2)
+        os.replace(tmp_path, path)
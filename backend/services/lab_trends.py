@@ -0,0 +1,175 @@
+"""
+Incremental lab trends.
+
+A patient's history of one lab test is summarized by a small state that is
+updated in O(1) as each result is saved: the count, running means and
+co-moments for a least-squares slope over time (Welford's method), an
+exponentially weighted moving average, min/max and the first and last
+result by date. Trend analysis reads these states instead of regrouping and
+re-sorting the whole history. States are plain JSON-serializable dicts, so
+they can be stored next to the lab results (see
+``SupabaseService.save_lab_results``); without a database they live in
+``lab_trend_store``.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+SECONDS_PER_DAY = 86400
+
+
+def parse_trend_time(date: Optional[str]) -> Optional[float]:
+    """Days since the epoch of an ISO date (naive dates are local time); None if missing or unparsable"""
+    try:
+        return datetime.fromisoformat(date).timestamp() / SECONDS_PER_DAY
+    except (TypeError, ValueError):
+        return None
+
+
+def trend_time(date: Optional[str]) -> float:
+    """Days since the epoch of an ISO date; now if missing or unparsable"""
+    t = parse_trend_time(date)
+    return datetime.now().timestamp() / SECONDS_PER_DAY if t is None else t
+
+
+def update_trend_state(state: Optional[Dict[str, Any]], value: float, date: str,
+                       alpha: Optional[float] = None, t: Optional[float] = None) -> Dict[str, Any]:
+    """New state with one more result
+
+    The EWMA follows the order results are added in: add them by date, or
+    fold a whole history with ``trend_states_from_history``. ``t`` overrides
+    the time taken from ``date``.
+    """
+    alpha = settings.trend_ewma_alpha if alpha is None else alpha
+    t = trend_time(date) if t is None else t
+    if state is None:
+        return {
+            "count": 1,
+            "mean_t": t,
+            "mean_value": float(value),
+            "m2_t": 0.0,
+            "c_tv": 0.0,
+            "ewma": float(value),
+            "min": value,
+            "max": value,
+            "first_value": value,
+            "first_date": date,
+            "first_t": t,
+            "last_value": value,
+            "last_date": date,
+            "last_t": t
+        }
+
+    state = dict(state)
+    count = state["count"] + 1
+    dt = t - state["mean_t"]
+    state["mean_t"] += dt / count
+    state["mean_value"] += (value - state["mean_value"]) / count
+    state["m2_t"] += dt * (t - state["mean_t"])
+    state["c_tv"] += dt * (value - state["mean_value"])
+    state["count"] = count
+    state["ewma"] = alpha * value + (1 - alpha) * state["ewma"]
+    state["min"] = min(state["min"], value)
+    state["max"] = max(state["max"], value)
+    if t < state["first_t"]:
+        state.update(first_value=value, first_date=date, first_t=t)
+    if t >= state["last_t"]:
+        state.update(last_value=value, last_date=date, last_t=t)
+    return state
+
+
+def update_trend_states(states: Dict[str, Dict[str, Any]], lab_data: Dict, date: str,
+                        alpha: Optional[float] = None, t: Optional[float] = None) -> List[str]:
+    """Fold one panel into per-test states (in place); returns the tests updated"""
+    updated = []
+    for test, value in lab_data.items():
+        if isinstance(value, (int, float)):
+            states[test] = update_trend_state(states.get(test), value, date, alpha, t)
+            updated.append(test)
+    return updated
+
+
+def trend_states_from_history(panels: Iterable[Tuple[str, Dict]],
+                              alpha: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """Per-test states of a history of (date, lab_data) panels, folded in date order
+
+    If any date is missing or unparsable there is no common time axis: the
+    panels are folded in the order given, timed by position (one unit per
+    panel), and each state is marked ``ordinal`` so no per-day slope is
+    read from it.
+    """
+    panels = list(panels)
+    times = [parse_trend_time(date) for date, _ in panels]
+    states: Dict[str, Dict[str, Any]] = {}
+    if None in times:
+        for position, (date, lab_data) in enumerate(panels):
+            update_trend_states(states, lab_data, date, alpha, float(position))
+        for state in states.values():
+            state["ordinal"] = True
+        return states
+    for t, (date, lab_data) in sorted(zip(times, panels), key=lambda timed: timed[0]):
+        update_trend_states(states, lab_data, date, alpha, t)
+    return states
+
+
+def trend_slope(state: Dict[str, Any]) -> float:
+    """Least-squares slope of the value, per day (0 when all results share one date)"""
+    return state["c_tv"] / state["m2_t"] if state["m2_t"] > 0 else 0.0
+
+
+def fitted_change(state: Dict[str, Any]) -> Dict[str, float]:
+    """Start value and change over the observed period along the least-squares line
+
+    With two results (or all on one date) this is simply first to last.
+    """
+    if state["m2_t"] > 0:
+        slope = trend_slope(state)
+        start = state["mean_value"] + slope * (state["first_t"] - state["mean_t"])
+        change = slope * (state["last_t"] - state["first_t"])
+    else:
+        start = state["first_value"]
+        change = state["last_value"] - state["first_value"]
+    return {"start": start, "change": change}
+
+
+class LabTrendStore:
+    """Trend states per patient and test in process memory, for running without a database
+
+    Bounded by patient count; the least recently updated patients go first.
+    """
+
+    def __init__(self, max_patients: int = 10000):
+        self.max_patients = max_patients
+        self._patients: "OrderedDict[str, Dict[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"updates": 0, "evicted": 0}
+
+    def add(self, patient_id: str, lab_data: Dict, date: str) -> List[str]:
+        with self._lock:
+            states = self._patients.pop(patient_id, {})
+            updated = update_trend_states(states, lab_data, date)
+            self._patients[patient_id] = states
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+                self._stats["evicted"] += 1
+            self._stats["updates"] += 1
+            return updated
+
+    def get(self, patient_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._patients.get(patient_id, {}))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_patients": self.max_patients,
+            "patients": len(self._patients),
+            **self._stats,
+        }
+
+
+# Global store instance
+lab_trend_store = LabTrendStore(max_patients=settings.trend_store_max_patients)
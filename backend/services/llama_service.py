@@ -1,109 +1,259 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-from langchain_huggingface import HuggingFacePipeline
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.llms.base import LLM
+from langchain.llms.utils import enforce_stop_tokens
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 import os
 import json
+import threading
+import time
 from datetime import datetime
 import logging
 
+from services.model_registry import model_registry
+from services.inference_executor import inference_executor
+from services.generation_scheduler import GenerationRequest, GenerationScheduler
+from services.generation_backends import TextQueueStreamer
+from services.generation_budget import ExplanationBudget, DiagnosisBudget, StopSequenceFilter
+from services.response_cache import response_cache, normalize_text
+from services.semantic_cache import semantic_cache, semantic_key
+from services.medical_glossary import MEDICAL_DICTIONARY, medical_glossary
+from services.medical_analyzer import LabAnalysisContext, MedicalAnalyzer
+from services.knowledge_index import KnowledgeIndex, retrieve_batch
+from services.knowledge_ingestion import KnowledgeIngestor
+from services.patient_index import PatientDocumentIndex
+from config import settings
+from exceptions import DeadlineExceededError
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Technical phrases rewritten in AI explanations
+EXPLANATION_REPLACEMENTS = {
+    "it is important to note that": "",
+    "in medical terms": "",
+    "clinically speaking": "",
+    "the patient should": "you should",
+    "the individual": "you"
+}
+
+# Bump whenever a prompt template changes so cached responses are not reused
+PROMPT_VERSION = "3"
+
+# Static instruction blocks that open each prompt. They come before any
+# request-specific text so the backend can reuse their attention KV state.
+# Explanation and diagnosis blocks depend on request options (see
+# services/generation_budget.py).
+LAB_PROMPT_PREFIX = """Analyze these lab results and provide a patient-friendly summary.
+
+Please provide:
+1. Overall health status summary
+2. Any concerning values (highlight in red/orange/green)
+3. What each abnormal value means
+4. Recommendations for follow-up
+5. Questions to ask the doctor
+
+Use simple language that a patient can understand.
+
+"""
+
+MEDICATION_PROMPT_PREFIX = """Explain this medication to a patient:
+1. What is it for? (main purpose)
+2. How does it work? (simple mechanism)
+3. Common side effects
+4. Important warnings
+5. How to take it properly
+
+Keep it simple and practical.
+
+"""
+
+PROMPT_PREFIXES = [ExplanationBudget().prefix, DiagnosisBudget().prefix, LAB_PROMPT_PREFIX, MEDICATION_PROMPT_PREFIX]
+
+# Built-in medical knowledge base
+MEDICAL_KNOWLEDGE = [
+    "Diabetes: Condition where blood sugar is too high. Type 2: body doesn't use insulin properly.",
+    "Hypertension: High blood pressure (>130/80 mmHg). Can cause heart disease, stroke.",
+    "Cholesterol: Fatty substance in blood. LDL bad, HDL good. High LDL increases heart risk.",
+    "Heart Attack: Blood flow to heart blocked. Symptoms: chest pain, shortness of breath.",
+    "Metformin: Diabetes medication. Lowers glucose production in liver.",
+    "Lisinopril: Blood pressure medication. Relaxes blood vessels.",
+    "Atorvastatin: Cholesterol medication. Reduces cholesterol production.",
+    "Healthy diet: Fruits, vegetables, whole grains, lean proteins. Limit salt, sugar, saturated fat.",
+    "Exercise: 30 minutes daily improves heart health, diabetes control, blood pressure.",
+    "Blood tests: Check glucose, cholesterol, kidney function. Often require fasting.",
+    "Medication side effects: Report nausea, dizziness, rash to doctor.",
+    "Symptoms to watch: Chest pain, severe headache, vision changes, difficulty breathing."
+]
+
+# Longest wait for the next streamed token before giving up
+STREAM_TOKEN_TIMEOUT_SECONDS = 120
+
+class IncrementalCleaner:
+    """Applies EXPLANATION_REPLACEMENTS to a token stream as it arrives"""
+    
+    def __init__(self):
+        self._buffer = ""
+        self._started = False
+        # Keep enough text back that a phrase split across chunks still matches
+        self._hold = max(len(phrase) for phrase in EXPLANATION_REPLACEMENTS) - 1
+    
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        for old, new in EXPLANATION_REPLACEMENTS.items():
+            self._buffer = self._buffer.replace(old, new)
+        if len(self._buffer) <= self._hold:
+            return ""
+        ready, self._buffer = self._buffer[:-self._hold], self._buffer[-self._hold:]
+        return self._emit(ready)
+    
+    def finish(self) -> str:
+        ready, self._buffer = self._buffer.rstrip(), ""
+        return self._emit(ready)
+    
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+class ScheduledLLM(LLM):
+    """LangChain LLM that routes prompts through the generation scheduler"""
+    
+    scheduler: Any
+    max_new_tokens: int = 512
+    temperature: float = 0.7
+    top_p: float = 0.95
+    endpoint: str = "rag"
+    prefix: Optional[str] = None
+    
+    class Config:
+        arbitrary_types_allowed = True
+    
+    @property
+    def _llm_type(self) -> str:
+        return "scheduled_llama"
+    
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        result = self.scheduler.generate(GenerationRequest(
+            prompt,
+            max_new_tokens=self.max_new_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            endpoint=self.endpoint,
+            prefix=self.prefix,
+            stop=stop
+        ))
+        text = result["text"]
+        if stop:
+            text = enforce_stop_tokens(text, stop)
+        return text
+
+class _BatchTracker:
+    """Deduplicates batch inputs and records when each one was answered"""
+    
+    def __init__(self, inputs: List[str]):
+        self.inputs = inputs
+        self.started = time.perf_counter()
+        self.slots: List[Dict] = []
+        self._slot_of: List[int] = []
+        first_index: Dict[str, int] = {}
+        for index, value in enumerate(inputs):
+            key = normalize_text(value)
+            if key not in first_index:
+                first_index[key] = len(self.slots)
+                self.slots.append({"input": value, "index": index})
+            self._slot_of.append(first_index[key])
+    
+    def resolve(self, slot: Dict, response: Dict, resolved_by: str):
+        slot["response"] = response
+        slot["resolved_by"] = resolved_by
+        slot["elapsed_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+    
+    def unresolved(self) -> List[Dict]:
+        return [slot for slot in self.slots if "response" not in slot]
+    
+    def result(self) -> Dict:
+        """Items in input order; repeated inputs point at their first occurrence"""
+        items = []
+        for index, slot_index in enumerate(self._slot_of):
+            slot = self.slots[slot_index]
+            item = {
+                "index": index,
+                "input": self.inputs[index],
+                "resolved_by": slot["resolved_by"],
+                "elapsed_ms": slot["elapsed_ms"],
+                "result": slot["response"]
+            }
+            if slot["index"] != index:
+                item["duplicate_of"] = slot["index"]
+            items.append(item)
+        resolved_by: Dict[str, int] = {}
+        for slot in self.slots:
+            resolved_by[slot["resolved_by"]] = resolved_by.get(slot["resolved_by"], 0) + 1
+        return {
+            "items": items,
+            "count": len(items),
+            "unique": len(self.slots),
+            "resolved_by": resolved_by,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "completed_at": datetime.now().isoformat()
+        }
+
 class LlamaMedicalService:
     """Llama 3.2 11B Medical AI Service"""
     
     def __init__(self):
         logger.info("Initializing Llama 3.2 11B Medical Service...")
         self.model_loaded = False
+        self._acquired: List[str] = []
         self.initialize_models()
         
         # Medical knowledge base
         self.medical_knowledge = self.load_medical_knowledge()
         self.initialize_rag_system()
         
-        # Medical translation dictionary
-        self.medical_dictionary = {
-            # Cardiovascular
-            "myocardial infarction": "heart attack",
-            "hypertension": "high blood pressure",
-            "arrhythmia": "irregular heartbeat",
-            "tachycardia": "fast heart rate",
-            "bradycardia": "slow heart rate",
-            "hyperlipidemia": "high cholesterol",
-            "edema": "swelling",
-            "thrombosis": "blood clot",
-            
-            # Diabetes
-            "hyperglycemia": "high blood sugar",
-            "hypoglycemia": "low blood sugar",
-            "polyuria": "frequent urination",
-            "polydipsia": "excessive thirst",
-            "polyphagia": "excessive hunger",
-            
-            # General
-            "prognosis": "expected outcome",
-            "etiology": "cause",
-            "pathology": "disease process",
-            "contraindication": "reason not to use",
-            "benign": "not cancerous",
-            "malignant": "cancerous",
-            "chronic": "long-lasting",
-            "acute": "sudden/severe",
-            "remission": "no symptoms period",
-            "metastasis": "cancer spread",
-        }
+        # Medical translation dictionary, compiled into a glossary matcher
+        self.medical_dictionary = MEDICAL_DICTIONARY
+        self.glossary = medical_glossary
+        
+        # Reference ranges for lab categorization
+        self.lab_analyzer = MedicalAnalyzer()
     
     def initialize_models(self):
-        """Initialize Llama 3.2 11B model"""
+        """Attach to the shared Llama 3.2 11B artifacts in the model registry"""
         try:
-            HF_TOKEN = os.getenv("HF_TOKEN")
-            MODEL_NAME = "meta-llama/Llama-3.2-11B"
+            # The generation backend and embeddings are loaded once per
+            # process and shared by every service instance
+            self.backend = self._acquire("generation_backend")
             
-            logger.info(f"Loading model: {MODEL_NAME}")
-            
-            # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                MODEL_NAME,
-                token=HF_TOKEN,
-                trust_remote_code=True
-            )
-            
-            # Load model with quantization for memory efficiency
-            self.model = AutoModelForCausalLM.from_pretrained(
-                MODEL_NAME,
-                token=HF_TOKEN,
-                torch_dtype=torch.float16,
-                device_map="auto" if torch.cuda.is_available() else None,
-                load_in_8bit=True,  # 8-bit quantization for 11B model
-                trust_remote_code=True
+            # All generation goes through one batching scheduler
+            max_batch_size = settings.generation_max_batch_size
+            if self.backend.max_batch_size:
+                max_batch_size = min(max_batch_size, self.backend.max_batch_size)
+            self.scheduler = GenerationScheduler(
+                self.backend.generate,
+                max_batch_size=max_batch_size,
+                max_wait_ms=settings.generation_max_wait_ms,
+                weights=settings.admission_weights
             )
             
-            # Create pipeline
-            self.pipeline = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                max_new_tokens=512,
-                temperature=0.7,
-                top_p=0.95,
-                repetition_penalty=1.1,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+            # Prefill the static template prefixes once per loaded model
+            if settings.prefix_cache_enabled:
+                for prefix in PROMPT_PREFIXES:
+                    self.backend.prepare_prefix(prefix)
             
             # LangChain wrapper
-            self.llm = HuggingFacePipeline(pipeline=self.pipeline)
+            self.llm = ScheduledLLM(
+                scheduler=self.scheduler,
+                max_new_tokens=settings.model_max_tokens,
+                temperature=settings.model_temperature,
+                top_p=settings.model_top_p,
+                prefix=ExplanationBudget().prefix
+            )
             
             # Embeddings for RAG
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
+            self.embeddings = self._acquire("embeddings")
             
             self.model_loaded = True
             logger.info("Llama 3.2 11B model loaded successfully")
@@ -112,303 +262,798 @@ class LlamaMedicalService:
             logger.error(f"Error loading Llama model: {e}")
             self.model_loaded = False
     
+    def _acquire(self, name: str):
+        """Take a reference to a shared artifact, remembering it for close()"""
+        value = model_registry.acquire(name)
+        self._acquired.append(name)
+        return value
+    
+    def close(self):
+        """Release every shared artifact held by this service"""
+        if getattr(self, "scheduler", None):
+            self.scheduler.stop()
+        while self._acquired:
+            model_registry.release(self._acquired.pop())
+        self.model_loaded = False
+    
+    def _generate(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        endpoint: str,
+        prefix: Optional[str] = None,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """Generate a completion for one prompt via the batching scheduler"""
+        result = self.scheduler.generate(GenerationRequest(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=settings.model_top_p,
+            endpoint=endpoint,
+            prefix=prefix,
+            speculative=self._speculative(endpoint),
+            stop=stop
+        ))
+        return result["text"]
+    
+    @staticmethod
+    def _speculative(endpoint: str) -> bool:
+        return settings.speculative_decoding_enabled and endpoint in settings.speculative_endpoints
+    
+    def get_inference_metrics(self) -> Dict:
+        """Generation metrics for monitoring endpoints"""
+        if not self.model_loaded:
+            return {"model_loaded": False}
+        return {
+            "model_loaded": True,
+            "backend": self.backend.describe(),
+            "scheduler": self.scheduler.get_metrics(),
+            "response_cache": response_cache.get_stats(),
+            "semantic_cache": semantic_cache.get_stats(),
+            "knowledge_index": self.knowledge_index.describe() if getattr(self, "knowledge_index", None) else None,
+            "knowledge_ingestion": self.get_ingestion_status(),
+            "patient_index": self.patient_index.describe() if getattr(self, "patient_index", None) else None
+        }
+    
     def load_medical_knowledge(self) -> List[str]:
         """Load medical knowledge base"""
-        return [
-            "Diabetes: Condition where blood sugar is too high. Type 2: body doesn't use insulin properly.",
-            "Hypertension: High blood pressure (>130/80 mmHg). Can cause heart disease, stroke.",
-            "Cholesterol: Fatty substance in blood. LDL bad, HDL good. High LDL increases heart risk.",
-            "Heart Attack: Blood flow to heart blocked. Symptoms: chest pain, shortness of breath.",
-            "Metformin: Diabetes medication. Lowers glucose production in liver.",
-            "Lisinopril: Blood pressure medication. Relaxes blood vessels.",
-            "Atorvastatin: Cholesterol medication. Reduces cholesterol production.",
-            "Healthy diet: Fruits, vegetables, whole grains, lean proteins. Limit salt, sugar, saturated fat.",
-            "Exercise: 30 minutes daily improves heart health, diabetes control, blood pressure.",
-            "Blood tests: Check glucose, cholesterol, kidney function. Often require fasting.",
-            "Medication side effects: Report nausea, dizziness, rash to doctor.",
-            "Symptoms to watch: Chest pain, severe headache, vision changes, difficulty breathing."
-        ]
+        return list(MEDICAL_KNOWLEDGE)
     
     def initialize_rag_system(self):
         """Initialize RAG system for medical knowledge"""
         if not self.model_loaded:
             return
         
-        # Create documents
-        from langchain.schema import Document
-        documents = [Document(page_content=text) for text in self.medical_knowledge]
-        
-        # Split documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50
-        )
-        split_docs = text_splitter.split_documents(documents)
+        # Shared, persistent vector index; opened once per process and only
+        # rebuilt when the knowledge corpus changes
+        model_registry.register("vector_store", self._open_knowledge_index, self._release_index)
+        try:
+            self.knowledge_index = self._acquire("vector_store")
+            self.vector_store = self.knowledge_index.store
+            self.knowledge_ingestor = KnowledgeIngestor(
+                self.knowledge_index,
+                batch_size=settings.ingest_batch_size,
+                checkpoint_every=settings.ingest_checkpoint_every
+            )
+        except Exception as e:
+            logger.error(f"Error building medical knowledge index: {e}")
+            self.model_loaded = False
+            return
         
-        # Create vector store
-        self.vector_store = Chroma.from_documents(
-            documents=split_docs,
-            embedding=self.embeddings,
-            persist_directory="./medical_knowledge_db"
-        )
+        # Patient documents are optional context; explanations work without them
+        self.patient_index = None
+        if settings.patient_index_enabled:
+            model_registry.register("patient_index", self._open_patient_index, self._release_index)
+            try:
+                self.patient_index = self._acquire("patient_index")
+            except Exception as e:
+                logger.error(f"Error opening patient document index: {e}")
         
         # Create prompt template
         self.prompt_template = PromptTemplate(
             input_variables=["context", "question"],
-            template="""You are a medical expert explaining complex medical information to patients in simple, easy-to-understand language.
-
-Medical Context: {context}
-
-Patient Question: {question}
-
-Please provide a clear, simple explanation that:
-1. Uses everyday language (no medical jargon)
-2. Is accurate but easy to understand
-3. Includes practical advice
-4. Is reassuring but honest
-
-Simple Explanation:"""
+            template=ExplanationBudget().prompt("{context}", "{question}")
         )
         
         # Create QA chain
         self.qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
             chain_type="stuff",
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 3}),
+            retriever=self.knowledge_index.as_retriever(
+                search_kwargs={"k": 3},
+                hybrid=settings.retrieval_mode == "hybrid",
+                candidates=settings.hybrid_candidates,
+                rrf_k=settings.hybrid_rrf_k,
+                cache_size=settings.retrieval_cache_size
+            ),
             chain_type_kwargs={"prompt": self.prompt_template},
             return_source_documents=True
         )
     
-    def explain_medical_text(self, text: str, context: str = "") -> Dict:
-        """Explain medical text using Llama 3.2"""
+    def _open_knowledge_index(self) -> KnowledgeIndex:
+        """Open the persisted medical knowledge index, building it if needed"""
+        embeddings = model_registry.acquire("embeddings")
+        try:
+            return KnowledgeIndex(
+                embeddings,
+                index_dir=settings.knowledge_index_dir,
+                chunk_size=settings.rag_chunk_size,
+                chunk_overlap=settings.rag_chunk_overlap,
+                backend=settings.vector_backend,
+                flat_dtype=settings.flat_index_dtype,
+                ingest_batch_size=settings.ingest_batch_size,
+                check_seconds=settings.knowledge_index_check_seconds
+            ).open(self.load_medical_knowledge())
+        except Exception:
+            model_registry.release("embeddings")
+            raise
+    
+    def _open_patient_index(self) -> PatientDocumentIndex:
+        embeddings = model_registry.acquire("embeddings")
+        try:
+            return PatientDocumentIndex(
+                embeddings,
+                index_dir=settings.patient_index_dir,
+                chunk_size=settings.rag_chunk_size,
+                chunk_overlap=settings.rag_chunk_overlap,
+                backend=settings.vector_backend,
+                flat_dtype=settings.flat_index_dtype
+            )
+        except Exception:
+            model_registry.release("embeddings")
+            raise
+    
+    @staticmethod
+    def _release_index(index):
+        """Indexes hold a reference to the shared embeddings"""
+        model_registry.release("embeddings")
+    
+    def index_patient_document(self, patient_id: str, text: str, metadata: Optional[Dict] = None) -> int:
+        """Add an uploaded document to the patient's partition (run in the background)"""
+        if not getattr(self, "patient_index", None):
+            return 0
+        try:
+            return self.patient_index.add_document(patient_id, text, metadata)
+        except Exception as e:
+            logger.error(f"Error indexing document for patient {patient_id}: {e}")
+            return 0
+    
+    def ingest_knowledge(self, paths: List[str], resume: bool = True) -> Dict:
+        """Start streaming curated articles into the knowledge index"""
+        if not getattr(self, "knowledge_ingestor", None):
+            raise RuntimeError("Knowledge index is not available")
+        root = os.path.realpath(settings.knowledge_sources_dir)
+        resolved = []
+        for path in paths:
+            full_path = os.path.realpath(os.path.join(root, path))
+            if os.path.commonpath([root, full_path]) != root:
+                raise ValueError(f"Path {path} is outside the knowledge sources directory")
+            if not os.path.exists(full_path):
+                raise FileNotFoundError(f"Knowledge source {path} not found")
+            resolved.append(full_path)
+        if not self.knowledge_ingestor.start(resolved, resume=resume):
+            raise RuntimeError("A knowledge ingestion is already running")
+        return self.get_ingestion_status()
+    
+    def get_ingestion_status(self) -> Dict:
+        ingestor = getattr(self, "knowledge_ingestor", None)
+        return dict(ingestor.progress) if ingestor else {"status": "unavailable"}
+    
+    def explain_medical_text(
+        self,
+        text: str,
+        context: str = "",
+        route: str = "explain",
+        max_length: Optional[int] = None,
+        simplify_level: str = "patient",
+        include_examples: bool = True,
+        patient_id: Optional[str] = None,
+        cache_text: Optional[str] = None
+    ) -> Dict:
+        """Explain medical text using Llama 3.2, optionally grounded in a patient's documents
+
+        ``cache_text`` is what the semantic cache compares (the text and
+        context by default); callers that wrap the user's input in fixed
+        wording pass the input alone.
+        """
         if not self.model_loaded:
             return self._fallback_explanation(text)
         
         try:
             # First check dictionary
-            simple_term = self._check_medical_dictionary(text)
-            if simple_term:
+            matches = self.glossary.find(text)
+            if matches:
                 return {
                     "original": text,
-                    "explanation": simple_term,
+                    "explanation": self._glossary_explanation(matches),
+                    "terms": [m.to_dict() for m in matches],
                     "confidence": "high",
                     "source": "dictionary",
                     "timestamp": datetime.now().isoformat()
                 }
             
-            # Use RAG for detailed explanation
-            query = f"Explain in simple terms for a patient: {text}"
-            if context:
-                query += f" Context: {context}"
-            
-            result = self.qa_chain({"query": query})
-            
-            explanation = result["result"]
-            sources = [doc.page_content for doc in result.get("source_documents", [])]
+            budget = self._explanation_budget(max_length, simplify_level, include_examples)
+            patient_id = patient_id if getattr(self, "patient_index", None) else None
+            cache_key = self._explain_cache_key(text, context, budget, patient_id)
+            cached = self._cache_get(cache_key)
+            if cached:
+                return {**cached, "original": text, "cached": True}
             
-            # Clean up explanation
-            explanation = self._clean_explanation(explanation)
+            # Near-duplicate questions are answered from the semantic cache,
+            # except when the answer depends on one patient's records
+            query = self._rag_query(text, context)
+            semantic_route = f"{route}/{budget.variant}"
+            query_vector = None
+            if settings.semantic_cache_enabled and not patient_id:
+                query_vector = self.embeddings.embed_query(cache_text or semantic_key(text, context))
+                hit = semantic_cache.lookup(semantic_route, query_vector)
+                if hit:
+                    cached, similarity = hit
+                    return {**cached, "original": text, "cached": True, "similarity": round(similarity, 4)}
             
-            return {
-                "original": text,
-                "explanation": explanation,
-                "confidence": "medium",
-                "sources": sources[:2],
-                "model": "Llama 3.2 11B",
-                "timestamp": datetime.now().isoformat()
-            }
+            # Use RAG for detailed explanation
+            docs = self._retrieve(query, patient_id)
+            explanation = self._generate(
+                self._rag_prompt(query, docs, budget),
+                max_new_tokens=budget.max_new_tokens,
+                temperature=settings.model_temperature,
+                endpoint="explain",
+                prefix=budget.prefix,
+                stop=budget.stop
+            )
+            response = self._explanation_response(text, explanation, docs, patient_id)
+            self._cache_set(cache_key, response)
+            if query_vector is not None:
+                semantic_cache.add(semantic_route, query_vector, response)
+            return response
             
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(f"Error in explanation: {e}")
             return self._fallback_explanation(text)
     
-    def explain_diagnosis(self, diagnosis: str, notes: str = "") -> Dict:
-        """Explain medical diagnosis with context"""
+    def explain_medical_batch(
+        self,
+        texts: List[str],
+        context: str = "",
+        max_length: Optional[int] = None,
+        simplify_level: str = "patient",
+        include_examples: bool = True,
+        patient_id: Optional[str] = None
+    ) -> Dict:
+        """Explain several texts with one embedding call, one retrieval pass and one generation batch"""
+        batch = _BatchTracker(texts)
         if not self.model_loaded:
-            return self._fallback_diagnosis_explanation(diagnosis)
+            for slot in batch.slots:
+                batch.resolve(slot, self._fallback_explanation(slot["input"]), "fallback")
+            return batch.result()
         
         try:
-            prompt = f"""
-            Diagnosis: {diagnosis}
-            Doctor's Notes: {notes}
+            budget = self._explanation_budget(max_length, simplify_level, include_examples)
+            patient_id = patient_id if getattr(self, "patient_index", None) else None
             
-            Please explain this diagnosis to a patient in simple terms:
-            1. What does this diagnosis mean in everyday language?
-            2. What are the main symptoms or effects?
-            3. What causes this condition?
-            4. What treatments are available?
-            5. What lifestyle changes can help?
+            # Dictionary terms and exact cache hits are answered right away
+            pending = []
+            for slot in batch.slots:
+                text = slot["input"]
+                matches = self.glossary.find(text)
+                if matches:
+                    batch.resolve(slot, {
+                        "original": text,
+                        "explanation": self._glossary_explanation(matches),
+                        "terms": [m.to_dict() for m in matches],
+                        "confidence": "high",
+                        "source": "dictionary",
+                        "timestamp": datetime.now().isoformat()
+                    }, "dictionary")
+                    continue
+                slot["cache_key"] = self._explain_cache_key(text, context, budget, patient_id)
+                cached = self._cache_get(slot["cache_key"])
+                if cached:
+                    batch.resolve(slot, {**cached, "original": text, "cached": True}, "cache")
+                    continue
+                slot["query"] = self._rag_query(text, context)
+                pending.append(slot)
             
-            Keep explanations simple, clear, and reassuring.
-            """
+            # One embedding call serves retrieval and the semantic cache keys
+            semantic_route = f"explain/{budget.variant}"
+            use_semantic_cache = settings.semantic_cache_enabled and not patient_id
+            to_generate = []
+            if pending:
+                keys = [semantic_key(slot["input"], context) for slot in pending] if use_semantic_cache else []
+                vectors = self.embeddings.embed_documents([slot["query"] for slot in pending] + keys)
+                for i, slot in enumerate(pending):
+                    slot["vector"] = vectors[i]
+                    slot["key_vector"] = vectors[len(pending) + i] if use_semantic_cache else None
+                    hit = semantic_cache.lookup(semantic_route, slot["key_vector"]) if use_semantic_cache else None
+                    if hit:
+                        cached, similarity = hit
+                        batch.resolve(slot, {**cached, "original": slot["input"], "cached": True, "similarity": round(similarity, 4)}, "semantic_cache")
+                    else:
+                        to_generate.append(slot)
             
-            result = self.pipeline(
-                prompt,
-                max_new_tokens=500,
-                temperature=0.7,
-                do_sample=True
+            if to_generate:
+                docs_batch = self._retrieve_batch(
+                    [slot["query"] for slot in to_generate],
+                    [slot["vector"] for slot in to_generate],
+                    patient_id
+                )
+                futures = self.scheduler.submit_many([
+                    GenerationRequest(
+                        self._rag_prompt(slot["query"], docs, budget),
+                        max_new_tokens=budget.max_new_tokens,
+                        temperature=settings.model_temperature,
+                        top_p=settings.model_top_p,
+                        endpoint="explain",
+                        prefix=budget.prefix,
+                        stop=budget.stop
+                    )
+                    for slot, docs in zip(to_generate, docs_batch)
+                ])
+                for slot, docs, future in zip(to_generate, docs_batch, futures):
+                    try:
+                        explanation = future.result()["text"]
+                    except DeadlineExceededError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error in batch explanation: {e}")
+                        batch.resolve(slot, self._fallback_explanation(slot["input"]), "fallback")
+                        continue
+                    response = self._explanation_response(slot["input"], explanation, docs, patient_id)
+                    self._cache_set(slot["cache_key"], response)
+                    if use_semantic_cache:
+                        semantic_cache.add(semantic_route, slot["key_vector"], response)
+                    batch.resolve(slot, response, "model")
+        
+        except DeadlineExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in batch explanation: {e}")
+            for slot in batch.unresolved():
+                batch.resolve(slot, self._fallback_explanation(slot["input"]), "fallback")
+        return batch.result()
+    
+    def explain_diagnosis(
+        self,
+        diagnosis: str,
+        notes: str = "",
+        include_treatments: bool = True,
+        include_prognosis: bool = True,
+        include_prevention: bool = True
+    ) -> Dict:
+        """Explain medical diagnosis with context"""
+        if not self.model_loaded:
+            return self._fallback_diagnosis_explanation(diagnosis)
+        
+        try:
+            budget = DiagnosisBudget(include_treatments, include_prognosis, include_prevention)
+            cache_key = self._response_cache_key(
+                "diagnosis",
+                {"diagnosis": normalize_text(diagnosis), "notes": normalize_text(notes)},
+                {"max_new_tokens": budget.max_new_tokens, "temperature": 0.7, **budget.cache_params}
             )
+            cached = self._cache_get(cache_key)
+            if cached:
+                return {**cached, "diagnosis": diagnosis, "notes": notes, "cached": True}
             
-            explanation = result[0]['generated_text']
-            
-            # Extract the explanation part
-            lines = explanation.split('\n')
-            explanation_lines = []
-            for line in lines:
-                if any(keyword in line.lower() for keyword in ['means', 'symptoms', 'causes', 'treatments', 'lifestyle']):
-                    explanation_lines.append(line)
-            
-            final_explanation = '\n'.join(explanation_lines) if explanation_lines else explanation[:400]
+            # Only the requested sections are prompted for, and decoding
+            # stops once the last of them is written
+            explanation = self._generate(
+                budget.prompt(diagnosis, notes),
+                max_new_tokens=budget.max_new_tokens,
+                temperature=0.7,
+                endpoint="diagnosis",
+                prefix=budget.prefix,
+                stop=budget.stop
+            )
             
-            return {
+            response = {
                 "diagnosis": diagnosis,
-                "simple_explanation": final_explanation,
+                "simple_explanation": explanation.strip(),
                 "notes": notes,
                 "explained_at": datetime.now().isoformat(),
                 "model": "Llama 3.2 11B"
             }
+            self._cache_set(cache_key, response)
+            return response
             
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(f"Error explaining diagnosis: {e}")
             return self._fallback_diagnosis_explanation(diagnosis)
     
-    def analyze_lab_results(self, lab_data: Dict) -> Dict:
-        """Analyze lab results with AI"""
+    def analyze_lab_results(self, lab_data: Dict, context: Optional[LabAnalysisContext] = None) -> Dict:
+        """Analyze lab results with AI, reusing the request's lab analysis context if given"""
         if not self.model_loaded:
             return self._fallback_lab_analysis(lab_data)
         
         try:
-            # Format lab data for AI
-            lab_text = json.dumps(lab_data, indent=2)
-            
-            prompt = f"""
-            Analyze these lab results and provide a patient-friendly summary:
-            
-            Lab Results:
-            {lab_text}
-            
-            Please provide:
-            1. Overall health status summary
-            2. Any concerning values (highlight in red/orange/green)
-            3. What each abnormal value means
-            4. Recommendations for follow-up
-            5. Questions to ask the doctor
+            cache_key = self._response_cache_key(
+                "lab_analysis",
+                {str(test).strip().lower(): value for test, value in sorted(lab_data.items())},
+                {"max_new_tokens": 600, "temperature": 0.6}
+            )
+            cached = self._cache_get(cache_key)
+            if cached:
+                return {**cached, "cached": True}
             
-            Use simple language that a patient can understand.
-            """
+            prompt = self._lab_prompt(lab_data)
             
-            result = self.pipeline(
+            analysis = self._generate(
                 prompt,
                 max_new_tokens=600,
                 temperature=0.6,
-                do_sample=True
+                endpoint="lab_analysis",
+                prefix=LAB_PROMPT_PREFIX
             )
             
-            analysis = result[0]['generated_text']
-            
             # Categorize results
-            categorization = self._categorize_lab_results(lab_data)
+            categorization = self._categorize_lab_results(lab_data, context)
             
-            return {
+            response = {
                 "analysis": analysis,
                 "categorization": categorization,
                 "analyzed_at": datetime.now().isoformat(),
                 "model": "Llama 3.2 11B"
             }
+            self._cache_set(cache_key, response)
+            return response
             
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(f"Error analyzing lab results: {e}")
             return self._fallback_lab_analysis(lab_data)
     
     def explain_medication(self, medication: str) -> Dict:
         """Explain medication purpose and side effects"""
-        prompt = f"""
-        Medication: {medication}
-        
-        Explain this medication to a patient:
-        1. What is it for? (main purpose)
-        2. How does it work? (simple mechanism)
-        3. Common side effects
-        4. Important warnings
-        5. How to take it properly
-        
-        Keep it simple and practical.
-        """
+        prompt = self._medication_prompt(medication)
         
         try:
-            result = self.pipeline(
+            cache_key = self._medication_cache_key(medication)
+            cached = self._cache_get(cache_key)
+            if cached:
+                return {**cached, "medication": medication, "cached": True}
+            
+            explanation = self._generate(
                 prompt,
                 max_new_tokens=400,
                 temperature=0.7,
-                do_sample=True
+                endpoint="medication",
+                prefix=MEDICATION_PROMPT_PREFIX
             )
             
-            explanation = result[0]['generated_text']
-            
-            return {
+            response = {
                 "medication": medication,
                 "explanation": explanation,
                 "explained_at": datetime.now().isoformat()
             }
+            self._cache_set(cache_key, response)
+            return response
             
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             logger.error(f"Error explaining medication: {e}")
-            return {
-                "medication": medication,
-                "explanation": f"{medication} is a medication prescribed by your doctor. Take as directed and report any side effects.",
-                "explained_at": datetime.now().isoformat()
-            }
+            return self._fallback_medication(medication)
+    
+    def explain_medications_batch(self, medications: List[str]) -> Dict:
+        """Explain several medications, generating the uncached ones as one batch"""
+        batch = _BatchTracker(medications)
+        try:
+            pending = []
+            for slot in batch.slots:
+                slot["cache_key"] = self._medication_cache_key(slot["input"])
+                cached = self._cache_get(slot["cache_key"])
+                if cached:
+                    batch.resolve(slot, {**cached, "medication": slot["input"], "cached": True}, "cache")
+                else:
+                    pending.append(slot)
+            
+            futures = self.scheduler.submit_many([
+                GenerationRequest(
+                    self._medication_prompt(slot["input"]),
+                    max_new_tokens=400,
+                    temperature=0.7,
+                    top_p=settings.model_top_p,
+                    endpoint="medication",
+                    prefix=MEDICATION_PROMPT_PREFIX
+                )
+                for slot in pending
+            ]) if pending else []
+            for slot, future in zip(pending, futures):
+                try:
+                    explanation = future.result()["text"]
+                except DeadlineExceededError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in batch medication explanation: {e}")
+                    batch.resolve(slot, self._fallback_medication(slot["input"]), "fallback")
+                    continue
+                response = {
+                    "medication": slot["input"],
+                    "explanation": explanation,
+                    "explained_at": datetime.now().isoformat()
+                }
+                self._cache_set(slot["cache_key"], response)
+                batch.resolve(slot, response, "model")
+        
+        except DeadlineExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in batch medication explanation: {e}")
+            for slot in batch.unresolved():
+                batch.resolve(slot, self._fallback_medication(slot["input"]), "fallback")
+        return batch.result()
+    
+    def _response_cache_key(self, endpoint: str, payload, params: Dict) -> str:
+        params = {**params, "top_p": settings.model_top_p, "model": settings.hf_model_name}
+        return response_cache.make_key(endpoint, payload, PROMPT_VERSION, params)
+    
+    def _medication_cache_key(self, medication: str) -> str:
+        return self._response_cache_key(
+            "medication",
+            normalize_text(medication),
+            {"max_new_tokens": 400, "temperature": 0.7}
+        )
+    
+    def _explain_cache_key(self, text: str, context: str, budget: ExplanationBudget, patient_id: Optional[str] = None) -> Optional[str]:
+        """None for patient-scoped explanations: they quote the patient's
+        records, so they are never cached (in memory or on disk)"""
+        if patient_id:
+            return None
+        return self._response_cache_key(
+            "explain",
+            {"text": normalize_text(text), "context": normalize_text(context)},
+            {"max_new_tokens": budget.max_new_tokens, "temperature": settings.model_temperature, **budget.cache_params}
+        )
+    
+    @staticmethod
+    def _explanation_budget(max_length: Optional[int], simplify_level: str, include_examples: bool) -> ExplanationBudget:
+        return ExplanationBudget(max_length, simplify_level, include_examples, max_tokens_cap=settings.model_max_tokens)
+    
+    def _cache_get(self, key: Optional[str]) -> Optional[Dict]:
+        if key is None or not settings.response_cache_enabled:
+            return None
+        return response_cache.get(key)
+    
+    def _cache_set(self, key: Optional[str], response: Dict):
+        if key is not None and settings.response_cache_enabled:
+            response_cache.set(key, response)
+    
+    def _rag_query(self, text: str, context: str = "") -> str:
+        query = f"Explain in simple terms for a patient: {text}"
+        if context:
+            query += f" Context: {context}"
+        return query
+    
+    def _retrieve(self, query: str, patient_id: Optional[str] = None) -> List:
+        """General knowledge chunks, plus the patient's own document chunks"""
+        self.knowledge_index.refresh()
+        docs = self.qa_chain.retriever.get_relevant_documents(query)
+        if patient_id:
+            retriever = self.patient_index.as_retriever(patient_id, k=settings.patient_rag_k)
+            docs = docs + retriever.get_relevant_documents(query)
+        return docs
+    
+    def _retrieve_batch(self, queries: List[str], vectors: List, patient_id: Optional[str] = None) -> List[List]:
+        """_retrieve for several queries, reusing their precomputed embeddings"""
+        self.knowledge_index.refresh()
+        docs_batch = retrieve_batch(self.qa_chain.retriever, queries, vectors)
+        if patient_id:
+            retriever = self.patient_index.as_retriever(patient_id, k=settings.patient_rag_k)
+            docs_batch = [docs + patient_docs for docs, patient_docs in zip(docs_batch, retrieve_batch(retriever, queries, vectors))]
+        return docs_batch
+    
+    def _explanation_response(self, text: str, explanation: str, docs: List, patient_id: Optional[str] = None) -> Dict:
+        sources = [doc.page_content for doc in docs if "patient_id" not in doc.metadata]
+        response = {
+            "original": text,
+            "explanation": self._clean_explanation(explanation),
+            "confidence": "medium",
+            "sources": sources[:2],
+            "model": "Llama 3.2 11B",
+            "timestamp": datetime.now().isoformat()
+        }
+        if patient_id:
+            response["patient_sources"] = len(docs) - len(sources)
+        return response
+    
+    @staticmethod
+    def _rag_prompt(query: str, docs: List, budget: ExplanationBudget) -> str:
+        return budget.prompt("\n\n".join(
+            f"From the patient's records: {doc.page_content}" if "patient_id" in doc.metadata else doc.page_content
+            for doc in docs
+        ), query)
+    
+    def _lab_prompt(self, lab_data: Dict) -> str:
+        # Format lab data for AI
+        lab_text = json.dumps(lab_data, indent=2)
+        
+        return LAB_PROMPT_PREFIX + f"""Lab Results:
+{lab_text}
+
+Summary:"""
+    
+    def _medication_prompt(self, medication: str) -> str:
+        return MEDICATION_PROMPT_PREFIX + f"""Medication: {medication}
+
+Explanation:"""
+    
+    # Streaming variants: yield explanation text as tokens are generated
+    
+    def stream_medical_text(
+        self,
+        text: str,
+        context: str = "",
+        max_length: Optional[int] = None,
+        simplify_level: str = "patient",
+        include_examples: bool = True,
+        patient_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """Stream a simple explanation of medical text"""
+        if not self.model_loaded:
+            yield self._fallback_explanation(text)["explanation"]
+            return
+        
+        simple_term = self._check_medical_dictionary(text)
+        if simple_term:
+            yield simple_term
+            return
+        
+        budget = self._explanation_budget(max_length, simplify_level, include_examples)
+        patient_id = patient_id if getattr(self, "patient_index", None) else None
+        cached = self._cache_get(self._explain_cache_key(text, context, budget, patient_id))
+        if cached:
+            yield cached["explanation"]
+            return
+        
+        query = self._rag_query(text, context)
+        if settings.semantic_cache_enabled and not patient_id:
+            hit = semantic_cache.lookup(f"explain/{budget.variant}", self.embeddings.embed_query(semantic_key(text, context)))
+            if hit:
+                yield hit[0]["explanation"]
+                return
+        
+        docs = self._retrieve(query, patient_id)
+        yield from self._filtered_stream(
+            self._stream(
+                self._rag_prompt(query, docs, budget),
+                budget.max_new_tokens,
+                settings.model_temperature,
+                "explain",
+                budget.prefix,
+                budget.stop
+            ),
+            IncrementalCleaner()
+        )
+    
+    def stream_diagnosis(
+        self,
+        diagnosis: str,
+        notes: str = "",
+        include_treatments: bool = True,
+        include_prognosis: bool = True,
+        include_prevention: bool = True
+    ) -> Iterator[str]:
+        """Stream a patient-friendly diagnosis explanation"""
+        if not self.model_loaded:
+            yield self._fallback_diagnosis_explanation(diagnosis)["simple_explanation"]
+            return
+        
+        budget = DiagnosisBudget(include_treatments, include_prognosis, include_prevention)
+        yield from self._stream(
+            budget.prompt(diagnosis, notes),
+            budget.max_new_tokens,
+            0.7,
+            "diagnosis",
+            budget.prefix,
+            budget.stop
+        )
+    
+    def stream_medication(self, medication: str) -> Iterator[str]:
+        """Stream a medication explanation"""
+        if not self.model_loaded:
+            yield f"{medication} is a medication prescribed by your doctor. Take as directed and report any side effects."
+            return
+        
+        yield from self._stream(self._medication_prompt(medication), 400, 0.7, "medication", MEDICATION_PROMPT_PREFIX)
+    
+    def _stream(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        endpoint: str,
+        prefix: Optional[str] = None,
+        stop: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        """Generate one prompt on the scheduler thread, yielding text as it decodes"""
+        streamer = TextQueueStreamer(timeout=STREAM_TOKEN_TIMEOUT_SECONDS)
+        request = GenerationRequest(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=settings.model_top_p,
+            endpoint=endpoint,
+            streamer=streamer,
+            prefix=prefix,
+            speculative=self._speculative(endpoint),
+            stop=stop
+        )
+        future = self.scheduler.submit(request)
+        chunks = (chunk for chunk in streamer if chunk)
+        if stop:
+            # Hold back text that may turn out to be the start of a stop sequence
+            chunks = self._filtered_stream(chunks, StopSequenceFilter(stop))
+        try:
+            yield from chunks
+        except BaseException:
+            # The consumer stopped reading (closed stream, token timeout):
+            # stop decoding for it at the next step
+            request.cancel()
+            raise
+        # Surface generation errors instead of ending the stream silently
+        future.result()
+    
+    @staticmethod
+    def _filtered_stream(chunks: Iterator[str], text_filter) -> Iterator[str]:
+        for chunk in chunks:
+            output = text_filter.feed(chunk)
+            if output:
+                yield output
+        tail = text_filter.finish()
+        if tail:
+            yield tail
+    
+    # Async twins: run the blocking entry points on the inference executor so
+    # generation never blocks the event loop
+    
+    async def explain_medical_text_async(self, text: str, context: str = "", route: str = "explain", **options) -> Dict:
+        return await inference_executor.run(self.explain_medical_text, text, context, route, **options)
+    
+    async def explain_diagnosis_async(self, diagnosis: str, notes: str = "", **options) -> Dict:
+        return await inference_executor.run(self.explain_diagnosis, diagnosis, notes, **options)
+    
+    async def explain_medical_batch_async(self, texts: List[str], **options) -> Dict:
+        return await inference_executor.run(self.explain_medical_batch, texts, **options)
+    
+    async def explain_medications_batch_async(self, medications: List[str]) -> Dict:
+        return await inference_executor.run(self.explain_medications_batch, medications)
+    
+    async def analyze_lab_results_async(self, lab_data: Dict, context: Optional[LabAnalysisContext] = None) -> Dict:
+        return await inference_executor.run(self.analyze_lab_results, lab_data, context)
+    
+    async def explain_medication_async(self, medication: str) -> Dict:
+        return await inference_executor.run(self.explain_medication, medication)
     
     def _check_medical_dictionary(self, text: str) -> Optional[str]:
-        """Check if text matches medical dictionary"""
-        text_lower = text.lower()
-        for term, explanation in self.medical_dictionary.items():
-            if term in text_lower:
-                return f"'{term}' means {explanation}."
-        return None
+        """Explain every glossary term found in text, or None if there are none"""
+        return self._glossary_explanation(self.glossary.find(text))
+    
+    @staticmethod
+    def _glossary_explanation(matches: List) -> Optional[str]:
+        explained = {}
+        for m in matches:
+            explained.setdefault(m.term, f"'{m.term}' means {m.plain}.")
+        return " ".join(explained.values()) or None
     
     def _clean_explanation(self, explanation: str) -> str:
         """Clean up AI explanation"""
         # Remove technical phrases
-        replacements = {
-            "it is important to note that": "",
-            "in medical terms": "",
-            "clinically speaking": "",
-            "the patient should": "you should",
-            "the individual": "you"
-        }
-        
         cleaned = explanation
-        for old, new in replacements.items():
+        for old, new in EXPLANATION_REPLACEMENTS.items():
             cleaned = cleaned.replace(old, new)
         
         return cleaned.strip()
     
-    def _categorize_lab_results(self, lab_data: Dict) -> Dict:
+    def _categorize_lab_results(self, lab_data: Dict, context: Optional[LabAnalysisContext] = None) -> Dict:
         """Categorize lab results into critical levels"""
-        categories = {}
-        
-        # Reference ranges
-        ranges = {
-            "glucose": (70, 100),
-            "hba1c": (4.0, 5.6),
-            "cholesterol": (125, 200),
-            "ldl": (0, 100),
-            "hdl": (40, 60),
-            "triglycerides": (0, 150)
-        }
-        
-        for test, value in lab_data.items():
-            if test in ranges:
-                min_val, max_val = ranges[test]
-                if value < min_val * 0.8 or value > max_val * 1.3:
-                    categories[test] = {"level": "critical", "color": "red"}
-                elif value < min_val * 0.9 or value > max_val * 1.2:
-                    categories[test] = {"level": "slightly_critical", "color": "orange"}
-                else:
-                    categories[test] = {"level": "normal", "color": "green"}
-        
-        return categories
+        return (context or self.lab_analyzer.analyze(lab_data)).severity_levels
     
     def _fallback_explanation(self, text: str) -> Dict:
         """Fallback explanation when model fails"""
@@ -428,10 +1073,31 @@ Simple Explanation:"""
             "explained_at": datetime.now().isoformat()
         }
     
+    def _fallback_medication(self, medication: str) -> Dict:
+        return {
+            "medication": medication,
+            "explanation": f"{medication} is a medication prescribed by your doctor. Take as directed and report any side effects.",
+            "explained_at": datetime.now().isoformat()
+        }
+    
     def _fallback_lab_analysis(self, lab_data: Dict) -> Dict:
         """Fallback lab analysis"""
         return {
             "analysis": "Please consult with your healthcare provider for proper analysis of these lab results.",
             "categorization": {},
             "analyzed_at": datetime.now().isoformat()
-        }
\ No newline at end of file
+        }
+
+
+_shared_service: Optional[LlamaMedicalService] = None
+_shared_service_lock = threading.Lock()
+
+def get_llama_service() -> LlamaMedicalService:
+    """Get the process-wide LlamaMedicalService instance"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = LlamaMedicalService()
+    return _shared_service
+
@@ -1,41 +1,168 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
+from functools import cached_property
 import json
 from datetime import datetime
 import logging
 
+from services.reference_ranges import (
+    reference_table, ReferenceRangeTable, STATUSES, NOT_MEASURED, SEVERITY_COLORS
+)
+from services.risk_rules import risk_rules, RISK_LEVELS
+from services.lab_trends import trend_states_from_history, fitted_change, trend_slope
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Health score weight of each test category
+CATEGORY_WEIGHTS = {
+    "Metabolic": 0.3,
+    "Cardiovascular": 0.3,
+    "Renal": 0.2,
+    "Hematology": 0.1,
+    "Electrolytes": 0.1
+}
+
+# Health score points for each result status
+STATUS_POINTS = {
+    "normal": 100,
+    "good": 90,
+    "borderline": 70,
+    "warning": 40,
+    "critical": 10
+}
+
+# Overall status by minimum health score, best first; anything lower "Needs Attention"
+SCORE_BANDS = [
+    (85, "Excellent", "#10B981"),
+    (70, "Good", "#3B82F6"),
+    (50, "Fair", "#F59E0B"),
+    (float("-inf"), "Needs Attention", "#EF4444")
+]
+
+# Plain-language interpretation per test and status
+LAB_INTERPRETATIONS = {
+    "glucose": {
+        "normal": "Normal fasting blood glucose level.",
+        "borderline": "Slightly elevated blood glucose. Monitor diet.",
+        "warning": "High blood glucose. May indicate prediabetes.",
+        "critical": "Very high blood glucose. Possible diabetes."
+    },
+    "hba1c": {
+        "normal": "Good long-term blood sugar control.",
+        "borderline": "Moderate blood sugar control. Lifestyle changes recommended.",
+        "warning": "Poor blood sugar control. May indicate diabetes.",
+        "critical": "Very poor blood sugar control. Diabetes likely."
+    },
+    "ldl": {
+        "normal": "Optimal LDL cholesterol level.",
+        "borderline": "Borderline high LDL cholesterol.",
+        "warning": "High LDL cholesterol. Increased heart disease risk.",
+        "critical": "Very high LDL cholesterol. High heart disease risk."
+    },
+    "hdl": {
+        "normal": "Good HDL cholesterol level.",
+        "borderline": "Borderline low HDL cholesterol.",
+        "warning": "Low HDL cholesterol. Increased heart disease risk.",
+        "critical": "Very low HDL cholesterol. High heart disease risk."
+    },
+    "creatinine": {
+        "normal": "Normal kidney function.",
+        "borderline": "Slightly elevated creatinine. Monitor kidney function.",
+        "warning": "High creatinine. Possible kidney impairment.",
+        "critical": "Very high creatinine. Kidney dysfunction likely."
+    }
+}
+
+def _round_like_python(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """np.round, except values next to a rounding tie go through round() so results match it exactly"""
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, ndigits)
+    scaled = values * 10 ** ndigits
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(value), ndigits) for value in values[near_tie]]
+    return rounded
+
+
+def _select_labels(conditions: List[np.ndarray], labels: List[Any], default: Any = None) -> np.ndarray:
+    """np.select for labels: object array holding the label of the first true condition"""
+    selected = np.full(len(conditions[0]), default, dtype=object)
+    for condition, label in reversed(list(zip(conditions, labels))):
+        selected[condition] = label
+    return selected
+
+
+class LabAnalysisContext:
+    """One lab panel, analyzed at most once per stage
+    
+    Create one per request with ``MedicalAnalyzer.analyze`` and pass it to
+    every analyzer entry point (and to the Llama service): categorization,
+    health score, risk factors, recommendations and the report are computed
+    on first use and then shared, instead of each entry point starting over
+    from the raw values.
+    """
+    
+    def __init__(self, analyzer: "MedicalAnalyzer", lab_data: Dict, patient_info: Dict = None):
+        self.analyzer = analyzer
+        self.lab_data = lab_data or {}
+        self.patient_info = patient_info or {}
+    
+    @cached_property
+    def patient_age(self) -> int:
+        return self.patient_info.get("age", 50)
+    
+    @cached_property
+    def categorized(self) -> Dict:
+        """Status, deviation and interpretation per recognised test (the single pass over the panel)"""
+        return self.analyzer._categorize(self.lab_data)
+    
+    @cached_property
+    def health_score(self) -> Dict:
+        return self.analyzer._health_score(self.lab_data, self.categorized)
+    
+    @cached_property
+    def risk_factors(self) -> Dict:
+        return self.analyzer._risk_factors(self.lab_data, {**self.patient_info, "age": self.patient_age})
+    
+    @cached_property
+    def recommendations(self) -> List[str]:
+        return self.analyzer._generate_recommendations(self.categorized, self.risk_factors)
+    
+    @cached_property
+    def overall_assessment(self) -> str:
+        return self.analyzer._generate_overall_assessment(self.health_score, self.risk_factors)
+    
+    @cached_property
+    def severity_levels(self) -> Dict:
+        """Coarse critical / slightly_critical / normal levels used alongside AI analyses"""
+        levels = {}
+        for test, data in self.categorized.items():
+            level = self.analyzer.reference_table.severity(test, data["value"])
+            levels[test] = {"level": level, "color": SEVERITY_COLORS[level]}
+        return levels
+    
+    @cached_property
+    def health_report(self) -> Dict:
+        return {
+            "patient_info": self.patient_info,
+            "lab_results": self.categorized,
+            "health_score": self.health_score,
+            "risk_factors": self.risk_factors,
+            "recommendations": self.recommendations,
+            "overall_assessment": self.overall_assessment,
+            "generated_at": datetime.now().isoformat(),
+            "report_id": f"MED_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        }
+
 class MedicalAnalyzer:
     """Medical data analysis and categorization"""
     
     def __init__(self):
-        # Reference ranges for common lab tests
-        self.reference_ranges = {
-            "glucose": {"min": 70, "max": 100, "unit": "mg/dL", "category": "Metabolic"},
-            "hba1c": {"min": 4.0, "max": 5.6, "unit": "%", "category": "Metabolic"},
-            "cholesterol": {"min": 125, "max": 200, "unit": "mg/dL", "category": "Cardiovascular"},
-            "ldl": {"min": 0, "max": 100, "unit": "mg/dL", "category": "Cardiovascular"},
-            "hdl": {"min": 40, "max": 60, "unit": "mg/dL", "category": "Cardiovascular"},
-            "triglycerides": {"min": 0, "max": 150, "unit": "mg/dL", "category": "Cardiovascular"},
-            "creatinine": {"min": 0.6, "max": 1.2, "unit": "mg/dL", "category": "Renal"},
-            "bun": {"min": 7, "max": 20, "unit": "mg/dL", "category": "Renal"},
-            "sodium": {"min": 135, "max": 145, "unit": "mmol/L", "category": "Electrolytes"},
-            "potassium": {"min": 3.5, "max": 5.0, "unit": "mmol/L", "category": "Electrolytes"},
-            "wbc": {"min": 4.5, "max": 11.0, "unit": "10^3/uL", "category": "Hematology"},
-            "hemoglobin": {"min": 13.5, "max": 17.5, "unit": "g/dL", "category": "Hematology"},
-            "platelets": {"min": 150, "max": 450, "unit": "10^3/uL", "category": "Hematology"}
-        }
-        
-        # Condition risk thresholds
-        self.risk_thresholds = {
-            "diabetes": {"hba1c": 6.5, "glucose_fasting": 126},
-            "hypertension": {"systolic": 130, "diastolic": 80},
-            "hyperlipidemia": {"ldl": 130, "triglycerides": 200},
-            "kidney_disease": {"creatinine": 1.3, "bun": 25}
-        }
+        # Reference ranges for common lab tests, compiled once for every analyzer
+        self.reference_table: ReferenceRangeTable = reference_table
+        self.reference_ranges = reference_table.ranges
         
         # Health status colors
         self.status_colors = {
@@ -46,34 +173,32 @@ class MedicalAnalyzer:
             "good": {"color": "#3B82F6", "text": "Good"}
         }
     
-    def categorize_lab_results(self, lab_data: Dict) -> Dict:
+    def analyze(self, lab_data: Dict, patient_info: Dict = None) -> LabAnalysisContext:
+        """Shared, memoized analysis of one panel; pass it to the entry points below"""
+        return LabAnalysisContext(self, lab_data, patient_info)
+    
+    def categorize_lab_results(self, lab_data: Dict, context: Optional[LabAnalysisContext] = None) -> Dict:
         """Categorize lab results with detailed analysis"""
+        return (context or self.analyze(lab_data)).categorized
+    
+    def _categorize(self, lab_data: Dict) -> Dict:
         categorized = {}
         
         for test_name, test_value in lab_data.items():
-            if isinstance(test_value, (int, float)) and test_name in self.reference_ranges:
+            if isinstance(test_value, (int, float)) and test_name in self.reference_table:
                 ref = self.reference_ranges[test_name]
                 min_val = ref["min"]
                 max_val = ref["max"]
+                status, deviation = self.reference_table.grade(test_name, test_value)
                 
-                # Calculate deviation percentage
-                if test_value < min_val:
-                    deviation = ((min_val - test_value) / min_val) * 100
-                    status = self._get_status_below(min_val, test_value)
-                elif test_value > max_val:
-                    deviation = ((test_value - max_val) / max_val) * 100
-                    status = self._get_status_above(max_val, test_value)
-                else:
-                    deviation = 0
-                    status = "normal"
-                
+                colors = self.status_colors.get(status)
                 categorized[test_name] = {
                     "value": test_value,
                     "unit": ref["unit"],
                     "category": ref["category"],
                     "status": status,
-                    "color": self.status_colors[status]["color"] if status in self.status_colors else "#6B7280",
-                    "status_text": self.status_colors[status]["text"] if status in self.status_colors else "Unknown",
+                    "color": colors["color"] if colors else "#6B7280",
+                    "status_text": colors["text"] if colors else "Unknown",
                     "min_reference": min_val,
                     "max_reference": max_val,
                     "deviation_percent": round(deviation, 2),
@@ -82,85 +207,23 @@ class MedicalAnalyzer:
         
         return categorized
     
-    def _get_status_below(self, min_val: float, actual: float) -> str:
-        """Determine status for values below reference"""
-        deviation = ((min_val - actual) / min_val) * 100
-        if deviation > 30:
-            return "critical"
-        elif deviation > 15:
-            return "warning"
-        else:
-            return "borderline"
-    
-    def _get_status_above(self, max_val: float, actual: float) -> str:
-        """Determine status for values above reference"""
-        deviation = ((actual - max_val) / max_val) * 100
-        if deviation > 30:
-            return "critical"
-        elif deviation > 15:
-            return "warning"
-        else:
-            return "borderline"
-    
     def _get_interpretation(self, test_name: str, value: float, status: str) -> str:
         """Generate interpretation for lab result"""
-        interpretations = {
-            "glucose": {
-                "normal": "Normal fasting blood glucose level.",
-                "borderline": "Slightly elevated blood glucose. Monitor diet.",
-                "warning": "High blood glucose. May indicate prediabetes.",
-                "critical": "Very high blood glucose. Possible diabetes."
-            },
-            "hba1c": {
-                "normal": "Good long-term blood sugar control.",
-                "borderline": "Moderate blood sugar control. Lifestyle changes recommended.",
-                "warning": "Poor blood sugar control. May indicate diabetes.",
-                "critical": "Very poor blood sugar control. Diabetes likely."
-            },
-            "ldl": {
-                "normal": "Optimal LDL cholesterol level.",
-                "borderline": "Borderline high LDL cholesterol.",
-                "warning": "High LDL cholesterol. Increased heart disease risk.",
-                "critical": "Very high LDL cholesterol. High heart disease risk."
-            },
-            "hdl": {
-                "normal": "Good HDL cholesterol level.",
-                "borderline": "Borderline low HDL cholesterol.",
-                "warning": "Low HDL cholesterol. Increased heart disease risk.",
-                "critical": "Very low HDL cholesterol. High heart disease risk."
-            },
-            "creatinine": {
-                "normal": "Normal kidney function.",
-                "borderline": "Slightly elevated creatinine. Monitor kidney function.",
-                "warning": "High creatinine. Possible kidney impairment.",
-                "critical": "Very high creatinine. Kidney dysfunction likely."
-            }
-        }
-        
-        if test_name in interpretations and status in interpretations[test_name]:
-            return interpretations[test_name][status]
+        interpretation = LAB_INTERPRETATIONS.get(test_name, {}).get(status)
+        if interpretation:
+            return interpretation
         
         return f"Value is {status} compared to reference range."
     
-    def calculate_health_score(self, lab_data: Dict) -> Dict:
+    def calculate_health_score(self, lab_data: Dict, context: Optional[LabAnalysisContext] = None) -> Dict:
         """Calculate overall health score from lab results"""
+        return (context or self.analyze(lab_data)).health_score
+    
+    def _health_score(self, lab_data: Dict, categorized: Dict) -> Dict:
         if not lab_data:
             return {"score": 0, "status": "Insufficient Data"}
         
-        scores = []
-        max_score = 100
-        total_weight = 0
-        
-        # Weights for different test categories
-        weights = {
-            "Metabolic": 0.3,
-            "Cardiovascular": 0.3,
-            "Renal": 0.2,
-            "Hematology": 0.1,
-            "Electrolytes": 0.1
-        }
-        
-        categorized = self.categorize_lab_results(lab_data)
+        category_points: Dict[str, List[int]] = {}
         
         for test, data in categorized.items():
             if "category" in data and "status" in data:
@@ -168,179 +231,194 @@ class MedicalAnalyzer:
                 status = data["status"]
                 
                 # Assign points based on status
-                status_points = {
-                    "normal": 100,
-                    "good": 90,
-                    "borderline": 70,
-                    "warning": 40,
-                    "critical": 10
-                }
-                
-                if status in status_points:
-                    weight = weights.get(category, 0.1)
-                    scores.append(status_points[status] * weight)
-                    total_weight += weight
+                if status in STATUS_POINTS:
+                    category_points.setdefault(category, []).append(STATUS_POINTS[status])
+        
+        # Weighted per category, in a fixed category order, so the score does
+        # not depend on the order of the panel and matches analyze_cohort
+        score_sum = 0
+        total_weight = 0
+        for category in sorted(category_points):
+            weight = CATEGORY_WEIGHTS.get(category, 0.1)
+            score_sum += sum(category_points[category]) * weight
+            total_weight += len(category_points[category]) * weight
         
-        if scores and total_weight > 0:
-            avg_score = sum(scores) / total_weight
+        if total_weight > 0:
+            avg_score = score_sum / total_weight
         else:
             avg_score = 0
         
         # Determine overall health status
-        if avg_score >= 85:
-            health_status = "Excellent"
-            status_color = "#10B981"
-        elif avg_score >= 70:
-            health_status = "Good"
-            status_color = "#3B82F6"
-        elif avg_score >= 50:
-            health_status = "Fair"
-            status_color = "#F59E0B"
-        else:
-            health_status = "Needs Attention"
-            status_color = "#EF4444"
+        health_status, status_color = next(
+            (band_status, band_color) for threshold, band_status, band_color in SCORE_BANDS
+            if avg_score >= threshold
+        )
         
         return {
             "score": round(avg_score, 1),
             "status": health_status,
             "status_color": status_color,
+            # Mean status points of the tests in each category
+            "category_scores": {
+                category: round(sum(points) / len(points), 1)
+                for category, points in category_points.items()
+            },
             "category_breakdown": categorized,
             "calculated_at": datetime.now().isoformat()
         }
     
-    def detect_risk_factors(self, lab_data: Dict, patient_age: int = 50) -> Dict:
+    def detect_risk_factors(self, lab_data: Dict, patient_age: int = 50, context: Optional[LabAnalysisContext] = None) -> Dict:
         """Detect medical risk factors from lab data"""
-        risks = []
-        
-        # Diabetes risk
-        if "hba1c" in lab_data and lab_data["hba1c"] >= 5.7:
-            risk_level = "high" if lab_data["hba1c"] >= 6.5 else "moderate"
-            risks.append({
-                "condition": "Diabetes",
-                "risk_level": risk_level,
-                "indicators": [f"HbA1c: {lab_data['hba1c']}%"],
-                "recommendations": [
-                    "Consult endocrinologist",
-                    "Monitor blood sugar regularly",
-                    "Diet and exercise changes"
-                ]
-            })
-        
-        # Cardiovascular risk
-        cardiovascular_risk = False
-        cv_indicators = []
-        
-        if "ldl" in lab_data and lab_data["ldl"] > 130:
-            cardiovascular_risk = True
-            cv_indicators.append(f"LDL: {lab_data['ldl']} mg/dL")
-        
-        if "triglycerides" in lab_data and lab_data["triglycerides"] > 150:
-            cardiovascular_risk = True
-            cv_indicators.append(f"Triglycerides: {lab_data['triglycerides']} mg/dL")
-        
-        if "hdl" in lab_data and lab_data["hdl"] < 40:
-            cardiovascular_risk = True
-            cv_indicators.append(f"HDL: {lab_data['hdl']} mg/dL")
-        
-        if cardiovascular_risk:
-            risks.append({
-                "condition": "Cardiovascular Disease",
-                "risk_level": "moderate",
-                "indicators": cv_indicators,
-                "recommendations": [
-                    "Cardiology consultation",
-                    "Heart-healthy diet",
-                    "Regular exercise",
-                    "Cholesterol management"
-                ]
-            })
-        
-        # Kidney disease risk
-        if "creatinine" in lab_data and lab_data["creatinine"] > 1.2:
-            risks.append({
-                "condition": "Kidney Disease",
-                "risk_level": "moderate" if lab_data["creatinine"] <= 2.0 else "high",
-                "indicators": [f"Creatinine: {lab_data['creatinine']} mg/dL"],
-                "recommendations": [
-                    "Nephrology consultation",
-                    "Monitor kidney function",
-                    "Stay hydrated",
-                    "Avoid NSAIDs"
-                ]
-            })
-        
-        # Age-adjusted risk
-        if patient_age > 60:
-            for risk in risks:
-                if risk["risk_level"] == "moderate":
-                    risk["risk_level"] = "high"
-                    risk["recommendations"].append("Age increases risk - more frequent monitoring needed")
-        
-        return {
-            "detected_risks": risks,
-            "total_risks": len(risks),
-            "highest_risk": max([r["risk_level"] for r in risks], default="low"),
-            "analyzed_at": datetime.now().isoformat()
-        }
+        return (context or self.analyze(lab_data, {"age": patient_age})).risk_factors
+    
+    def _risk_factors(self, lab_data: Dict, attributes: Dict) -> Dict:
+        return risk_rules.current.evaluate_panel(lab_data, attributes)
+    
+    def analyze_cohort(self, table: Any, ages: Any = None) -> pd.DataFrame:
+        """Status, deviation, scores and risk flags for many panels at once
+        
+        ``table`` holds one row per patient and one column per test (a
+        DataFrame, or a dict of NumPy arrays / lists); missing values (NaN)
+        mean the test was not measured. Ages come from ``ages``, else an
+        ``age`` column, else default to 50 like the single-panel path.
+        Returns one row per patient, index preserved, with the same numbers
+        ``categorize_lab_results``, ``calculate_health_score`` and
+        ``detect_risk_factors`` give for that patient's panel, plus a
+        ``rule_<id>`` column per risk rule telling whether it fired.
+        """
+        frame = table if isinstance(table, pd.DataFrame) else pd.DataFrame(table)
+        if ages is None:
+            ages = frame["age"] if "age" in frame.columns else np.full(len(frame), np.nan)
+        ages = np.nan_to_num(pd.to_numeric(pd.Series(ages, index=frame.index), errors="coerce").to_numpy(dtype=float), nan=50)
+        values = frame.drop(columns=["age"], errors="ignore").apply(pd.to_numeric, errors="coerce")
+        
+        result = pd.DataFrame(index=frame.index)
+        category_sums: Dict[str, np.ndarray] = {}
+        category_counts: Dict[str, np.ndarray] = {}
+        
+        ranges = self.reference_table
+        status_codes, deviations = ranges.grade_matrix(values.reindex(columns=ranges.tests).to_numpy(dtype=float))
+        status_names = np.array(STATUSES, dtype=object)
+        status_points = np.array([STATUS_POINTS[status] for status in STATUSES])
+        
+        for test_id, test in enumerate(ranges.tests):
+            if test not in values.columns:
+                continue
+            codes = status_codes[:, test_id]
+            measured = codes != NOT_MEASURED
+            
+            result[f"{test}_status"] = np.where(measured, status_names[codes], None)
+            result[f"{test}_deviation_percent"] = _round_like_python(deviations[:, test_id], 2)
+            
+            category = ranges.categories[test_id]
+            category_sums[category] = category_sums.get(category, 0) + np.where(measured, status_points[codes], 0)
+            category_counts[category] = category_counts.get(category, 0) + measured
+        
+        score_sum = np.zeros(len(frame))
+        total_weight = np.zeros(len(frame))
+        for category in sorted(category_sums):
+            weight = CATEGORY_WEIGHTS.get(category, 0.1)
+            score_sum = score_sum + category_sums[category] * weight
+            total_weight = total_weight + category_counts[category] * weight
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_score = np.where(total_weight > 0, score_sum / total_weight, 0.0)
+        has_data = values.notna().any(axis=1).to_numpy()
+        result["health_score"] = np.where(has_data, _round_like_python(avg_score, 1), 0)
+        bands = [has_data & (avg_score >= threshold) for threshold, _, _ in SCORE_BANDS]
+        result["health_status"] = _select_labels(bands, [band[1] for band in SCORE_BANDS], "Insufficient Data")
+        result["health_status_color"] = _select_labels(bands, [band[2] for band in SCORE_BANDS])
+        for category, sums in category_sums.items():
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result[f"{category.lower()}_score"] = np.where(
+                    category_counts[category] > 0, _round_like_python(sums / category_counts[category], 1), np.nan
+                )
+        
+        rule_set = risk_rules.current
+        features = np.full((len(frame), len(rule_set.features)), np.nan)
+        for i, (kind, name) in enumerate(rule_set.features):
+            if (kind, name) == ("attribute", "age"):
+                features[:, i] = ages
+            elif name in values.columns:
+                # Other patient attributes come in as extra columns
+                features[:, i] = values[name].to_numpy(dtype=float)
+        evaluation = rule_set.evaluate_matrix(features)
+        levels = evaluation["levels"]
+        level_names = np.array((None,) + RISK_LEVELS[1:], dtype=object)
+        for c, condition in enumerate(rule_set.conditions):
+            result[f"risk_{condition['id']}"] = level_names[levels[:, c]]
+        result["total_risks"] = (levels > 0).sum(axis=1)
+        result["highest_risk"] = np.array(RISK_LEVELS, dtype=object)[levels.max(axis=1, initial=0)]
+        for i, entry_id in enumerate(rule_set.entry_ids):
+            result[f"rule_{entry_id}"] = evaluation["fired"][:, i]
+        result["patient_age"] = ages
+        return result
     
     def generate_trend_analysis(self, historical_data: List[Dict]) -> Dict:
         """Analyze trends from historical lab data"""
         if len(historical_data) < 2:
             return {"message": "Insufficient historical data for trend analysis"}
         
+        # One pass folding every record, oldest first, into per-test trend states
+        # (undated records fall back to list order, see trend_states_from_history)
+        states = trend_states_from_history((record.get("date"), record) for record in historical_data)
+        
+        return self.summarize_trends(states)
+    
+    def summarize_trends(self, states: Dict[str, Dict]) -> Dict:
+        """Trend per test from its incremental trend state (see services.lab_trends)"""
         trends = {}
         
-        # Group by test name
-        test_data = {}
-        for record in historical_data:
-            date = record.get("date", datetime.now().isoformat())
-            for test, value in record.items():
-                if isinstance(value, (int, float)):
-                    if test not in test_data:
-                        test_data[test] = []
-                    test_data[test].append({"date": date, "value": value})
+        for test, state in states.items():
+            if state["count"] < 2:
+                continue
+            
+            # Change along the least-squares line over the observed period
+            fitted = fitted_change(state)
+            percent_change = (fitted["change"] / fitted["start"]) * 100 if fitted["start"] != 0 else 0
+            first_val = state["first_value"]
+            last_val = state["last_value"]
+            
+            # Determine trend direction
+            if abs(percent_change) < 5:
+                direction = "stable"
+                trend_color = "#6B7280"
+            elif percent_change > 0:
+                direction = "increasing"
+                trend_color = "#EF4444" if test in ["glucose", "ldl", "creatinine"] else "#10B981"
+            else:
+                direction = "decreasing"
+                trend_color = "#10B981" if test in ["glucose", "ldl", "creatinine"] else "#EF4444"
+            
+            trends[test] = {
+                "direction": direction,
+                "percent_change": round(percent_change, 1),
+                "first_to_last_percent": round(((last_val - first_val) / first_val) * 100, 1) if first_val != 0 else 0,
+                "moving_average": round(state["ewma"], 2),
+                "min_value": state["min"],
+                "max_value": state["max"],
+                "first_value": first_val,
+                "last_value": last_val,
+                "first_date": state["first_date"],
+                "last_date": state["last_date"],
+                "data_points": state["count"],
+                "trend_color": trend_color,
+                "recommendation": self._get_trend_recommendation(test, direction, percent_change)
+            }
+            # Only meaningful over a real span of dates
+            if state["m2_t"] > 0 and not state.get("ordinal"):
+                trends[test]["slope_per_day"] = round(trend_slope(state), 4)
         
-        # Analyze each test trend
-        for test, data_points in test_data.items():
-            if len(data_points) >= 2:
-                # Sort by date
-                sorted_data = sorted(data_points, key=lambda x: x["date"])
-                values = [dp["value"] for dp in sorted_data]
-                dates = [dp["date"] for dp in sorted_data]
-                
-                # Calculate trend
-                if len(values) >= 2:
-                    first_val = values[0]
-                    last_val = values[-1]
-                    percent_change = ((last_val - first_val) / first_val) * 100 if first_val != 0 else 0
-                    
-                    # Determine trend direction
-                    if abs(percent_change) < 5:
-                        direction = "stable"
-                        trend_color = "#6B7280"
-                    elif percent_change > 0:
-                        direction = "increasing"
-                        trend_color = "#EF4444" if test in ["glucose", "ldl", "creatinine"] else "#10B981"
-                    else:
-                        direction = "decreasing"
-                        trend_color = "#10B981" if test in ["glucose", "ldl", "creatinine"] else "#EF4444"
-                    
-                    trends[test] = {
-                        "direction": direction,
-                        "percent_change": round(percent_change, 1),
-                        "first_value": first_val,
-                        "last_value": last_val,
-                        "first_date": dates[0],
-                        "last_date": dates[-1],
-                        "data_points": len(values),
-                        "trend_color": trend_color,
-                        "recommendation": self._get_trend_recommendation(test, direction, percent_change)
-                    }
+        if not trends:
+            return {"message": "Insufficient historical data for trend analysis"}
         
+        # Compared as parsed times, not date strings (formats and offsets may differ)
+        first = min((states[test] for test in trends), key=lambda state: state["first_t"])
+        last = max((states[test] for test in trends), key=lambda state: state["last_t"])
         return {
             "trends": trends,
             "analyzed_tests": len(trends),
-            "analysis_period": f"{sorted_data[0]['date']} to {sorted_data[-1]['date']}",
+            "analysis_period": f"{first['first_date'] or 'undated'} to {last['last_date'] or 'undated'}",
             "generated_at": datetime.now().isoformat()
         }
     
@@ -369,35 +447,9 @@ class MedicalAnalyzer:
         
         return f"Value is {direction}. Discuss with healthcare provider."
     
-    def generate_health_report(self, lab_data: Dict, patient_info: Dict = None) -> Dict:
-        """Generate comprehensive health report"""
-        
-        # Categorize results
-        categorized = self.categorize_lab_results(lab_data)
-        
-        # Calculate health score
-        health_score = self.calculate_health_score(lab_data)
-        
-        # Detect risk factors
-        patient_age = patient_info.get("age", 50) if patient_info else 50
-        risk_factors = self.detect_risk_factors(lab_data, patient_age)
-        
-        # Generate recommendations
-        recommendations = self._generate_recommendations(categorized, risk_factors)
-        
-        # Overall assessment
-        overall_assessment = self._generate_overall_assessment(health_score, risk_factors)
-        
-        return {
-            "patient_info": patient_info or {},
-            "lab_results": categorized,
-            "health_score": health_score,
-            "risk_factors": risk_factors,
-            "recommendations": recommendations,
-            "overall_assessment": overall_assessment,
-            "generated_at": datetime.now().isoformat(),
-            "report_id": f"MED_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        }
+    def generate_health_report(self, lab_data: Dict, patient_info: Dict = None, context: Optional[LabAnalysisContext] = None) -> Dict:
+        """Generate comprehensive health report (categorization, score, risks, recommendations)"""
+        return (context or self.analyze(lab_data, patient_info)).health_report
     
     def _generate_recommendations(self, categorized: Dict, risk_factors: Dict) -> List[str]:
         """Generate personalized recommendations"""
@@ -0,0 +1,233 @@
+"""
+Medical jargon glossary backed by an Aho-Corasick automaton.
+
+The automaton is compiled once from the term dictionary and finds every
+glossary term in a single pass over the text, whatever the glossary size.
+Matching is case-insensitive, treats any run of whitespace as one space and
+only accepts whole-word matches; overlapping matches resolve to the
+leftmost, longest term.
+"""
+
+import json
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Built-in medical term -> plain language dictionary
+MEDICAL_DICTIONARY = {
+    # Cardiovascular
+    "myocardial infarction": "heart attack",
+    "hypertension": "high blood pressure",
+    "arrhythmia": "irregular heartbeat",
+    "tachycardia": "fast heart rate",
+    "bradycardia": "slow heart rate",
+    "hyperlipidemia": "high cholesterol",
+    "edema": "swelling",
+    "thrombosis": "blood clot",
+
+    # Diabetes
+    "hyperglycemia": "high blood sugar",
+    "hypoglycemia": "low blood sugar",
+    "polyuria": "frequent urination",
+    "polydipsia": "excessive thirst",
+    "polyphagia": "excessive hunger",
+
+    # General
+    "prognosis": "expected outcome",
+    "etiology": "cause",
+    "pathology": "disease process",
+    "contraindication": "reason not to use",
+    "benign": "not cancerous",
+    "malignant": "cancerous",
+    "chronic": "long-lasting",
+    "acute": "sudden/severe",
+    "remission": "no symptoms period",
+    "metastasis": "cancer spread",
+}
+
+
+def _fold(text: str) -> Tuple[str, Optional[List[int]]]:
+    """Case-fold text and collapse whitespace runs to one space.
+
+    Returns the folded text and, when its offsets differ from the original,
+    a list mapping each folded position back to an original index.
+    """
+    simple = text.lower()
+    if len(simple) == len(text) and " ".join(simple.split()) == simple:
+        return simple, None
+
+    chars: List[str] = []
+    index: List[int] = []
+    previous_space = False
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if not previous_space:
+                chars.append(" ")
+                index.append(i)
+            previous_space = True
+            continue
+        previous_space = False
+        for folded in ch.lower():
+            chars.append(folded)
+            index.append(i)
+    index.append(len(text))
+    return "".join(chars), index
+
+
+class GlossaryMatch:
+    """One glossary term found in a text"""
+
+    __slots__ = ("start", "end", "text", "term", "plain")
+
+    def __init__(self, start: int, end: int, text: str, term: str, plain: str):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.term = term
+        self.plain = plain
+
+    def to_dict(self) -> Dict:
+        return {"start": self.start, "end": self.end, "text": self.text, "term": self.term, "plain": self.plain}
+
+
+class MedicalGlossary:
+    """Compiled multi-pattern matcher over a term -> plain language glossary"""
+
+    def __init__(self, terms: Dict[str, str]):
+        self._terms: List[str] = []
+        self._plain: List[str] = []
+        self._lengths: List[int] = []
+        # Trie with failure links; node 0 is the root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        for term, plain in terms.items():
+            self._add(term, plain)
+        self._build_failure_links()
+
+    @classmethod
+    def from_sources(cls, base: Dict[str, str], path: Optional[str] = None) -> "MedicalGlossary":
+        """Built-in terms extended with a JSON {term: plain} file"""
+        terms = dict(base)
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    terms.update(json.load(f))
+            except Exception as e:
+                logger.error(f"Could not load medical glossary {path}: {e}")
+        return cls(terms)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def _add(self, term: str, plain: str):
+        folded, _ = _fold(term.strip())
+        if not folded:
+            return
+        node = 0
+        for ch in folded:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        if self._output[node]:
+            # Duplicate after folding: the later definition wins
+            pattern_id = self._output[node][0]
+            self._terms[pattern_id] = term
+            self._plain[pattern_id] = plain
+            return
+        self._output[node].append(len(self._terms))
+        self._terms.append(term)
+        self._plain.append(plain)
+        self._lengths.append(len(folded))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # Inherit the matches that end at the failure state
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text: str) -> List[GlossaryMatch]:
+        """All whole-word glossary terms in text, leftmost-longest, non-overlapping"""
+        if not text or not self._terms:
+            return []
+        folded, index = _fold(text)
+        goto, fail, output, lengths = self._goto, self._fail, self._output, self._lengths
+
+        candidates: List[Tuple[int, int, int]] = []
+        node = 0
+        for i, ch in enumerate(folded):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern_id in output[node]:
+                start = i - lengths[pattern_id] + 1
+                end = i + 1
+                if start > 0 and folded[start - 1].isalnum():
+                    continue
+                if end < len(folded) and folded[end].isalnum():
+                    continue
+                candidates.append((start, end, pattern_id))
+
+        candidates.sort(key=lambda c: (c[0], c[0] - c[1]))
+        matches = []
+        covered = 0
+        for start, end, pattern_id in candidates:
+            if start < covered:
+                continue
+            covered = end
+            if index is not None:
+                start, end = index[start], index[end - 1] + 1
+            matches.append(GlossaryMatch(start, end, text[start:end], self._terms[pattern_id], self._plain[pattern_id]))
+        return matches
+
+    def annotate(self, text: str) -> Dict:
+        """Spans and plain-language replacements for every term in text"""
+        matches = self.find(text)
+        return {
+            "terms": [m.to_dict() for m in matches],
+            "simplified_text": self.simplify(text, matches),
+        }
+
+    def simplify(self, text: str, matches: Optional[Iterable[GlossaryMatch]] = None) -> str:
+        """Text with each term followed by its plain-language meaning"""
+        matches = self.find(text) if matches is None else matches
+        parts = []
+        position = 0
+        for m in matches:
+            parts.append(text[position:m.end])
+            parts.append(f" ({m.plain})")
+            position = m.end
+        parts.append(text[position:])
+        return "".join(parts)
+
+    def summarize(self, text: str) -> List[Dict]:
+        """Distinct terms in text with their meaning, count and first offset"""
+        summary: Dict[str, Dict] = {}
+        for m in self.find(text):
+            entry = summary.get(m.term)
+            if entry is None:
+                summary[m.term] = {"term": m.term, "plain": m.plain, "count": 1, "first_offset": m.start}
+            else:
+                entry["count"] += 1
+        return list(summary.values())
+
+
+# Global glossary instance
+medical_glossary = MedicalGlossary.from_sources(MEDICAL_DICTIONARY, settings.medical_glossary_path)
@@ -0,0 +1,244 @@
+"""
+Process-wide registry of shared model artifacts.
+
+Owns the tokenizer, model, generation backend, embeddings and vector store
+as lazily-initialized, reference-counted handles so every service and router
+in a worker shares exactly one copy of each.
+"""
+
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _process_rss_bytes() -> Optional[int]:
+    """Resident set size of the current process, if psutil is available"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def _artifact_memory_bytes(value: Any) -> Optional[int]:
+    """Memory footprint reported by the artifact itself, if it knows it"""
+    try:
+        if hasattr(value, "get_memory_footprint"):
+            return int(value.get_memory_footprint())
+        client = getattr(value, "client", None)
+        if client is not None and hasattr(client, "parameters"):
+            return int(sum(p.numel() * p.element_size() for p in client.parameters()))
+    except Exception:
+        pass
+    return None
+
+
+class ModelHandle:
+    """Lazily-loaded, reference-counted handle to one model artifact"""
+
+    def __init__(self, name: str, loader: Callable[[], Any], unloader: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self._loader = loader
+        self._unloader = unloader
+        self._lock = threading.RLock()
+        self.value = None
+        self.ref_count = 0
+        self.loaded_at: Optional[str] = None
+        self.load_time_seconds: Optional[float] = None
+        self.memory_bytes: Optional[int] = None
+        self.rss_delta_bytes: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.value is not None
+
+    def acquire(self) -> Any:
+        """Load the artifact on first use and take a reference to it"""
+        with self._lock:
+            if self.value is None:
+                self._load()
+            self.ref_count += 1
+            return self.value
+
+    def release(self):
+        """Drop a reference; the artifact is unloaded when none remain"""
+        with self._lock:
+            if self.ref_count == 0:
+                return
+            self.ref_count -= 1
+            if self.ref_count == 0 and self.value is not None:
+                self._unload()
+
+    def _load(self):
+        logger.info(f"Loading shared artifact: {self.name}")
+        rss_before = _process_rss_bytes()
+        start = time.perf_counter()
+        try:
+            value = self._loader()
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self.load_time_seconds = round(time.perf_counter() - start, 3)
+        rss_after = _process_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            self.rss_delta_bytes = max(rss_after - rss_before, 0)
+        self.memory_bytes = _artifact_memory_bytes(value)
+        self.loaded_at = datetime.now().isoformat()
+        self.last_error = None
+        self.value = value
+        logger.info(f"Loaded {self.name} in {self.load_time_seconds}s")
+
+    def _unload(self):
+        logger.info(f"Unloading shared artifact: {self.name}")
+        value, self.value = self.value, None
+        if self._unloader:
+            try:
+                self._unloader(value)
+            except Exception as e:
+                logger.error(f"Error unloading {self.name}: {e}")
+        self.loaded_at = None
+
+    def describe(self) -> Dict[str, Any]:
+        """Introspection data for this artifact"""
+        memory_bytes = self.memory_bytes if self.memory_bytes is not None else self.rss_delta_bytes
+        return {
+            "name": self.name,
+            "loaded": self.loaded,
+            "ref_count": self.ref_count,
+            "loaded_at": self.loaded_at,
+            "load_time_seconds": self.load_time_seconds,
+            "memory_mb": round(memory_bytes / (1024**2), 2) if memory_bytes is not None else None,
+            "rss_delta_mb": round(self.rss_delta_bytes / (1024**2), 2) if self.rss_delta_bytes is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRegistry:
+    """Registry of shared model handles, keyed by artifact name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles: Dict[str, ModelHandle] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], unloader: Optional[Callable[[Any], None]] = None) -> ModelHandle:
+        """Register a loader for an artifact; the first registration wins"""
+        with self._lock:
+            if name not in self._handles:
+                self._handles[name] = ModelHandle(name, loader, unloader)
+            return self._handles[name]
+
+    def handle(self, name: str) -> ModelHandle:
+        with self._lock:
+            if name not in self._handles:
+                raise KeyError(f"No model artifact registered under '{name}'")
+            return self._handles[name]
+
+    def acquire(self, name: str) -> Any:
+        return self.handle(name).acquire()
+
+    def release(self, name: str):
+        self.handle(name).release()
+
+    def describe(self) -> Dict[str, Any]:
+        """Report each artifact's load state, memory footprint and load time"""
+        with self._lock:
+            handles = list(self._handles.values())
+        artifacts = [h.describe() for h in handles]
+        rss = _process_rss_bytes()
+        return {
+            "artifacts": artifacts,
+            "loaded_count": sum(1 for a in artifacts if a["loaded"]),
+            "total_memory_mb": round(sum(a["memory_mb"] or 0 for a in artifacts if a["loaded"]), 2),
+            "process_rss_mb": round(rss / (1024**2), 2) if rss is not None else None,
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+# Default loaders for the Llama artifacts
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(
+        settings.hf_model_name,
+        token=settings.hf_token,
+        cache_dir=settings.hf_cache_dir,
+        trust_remote_code=True
+    )
+    # Batched generation needs a pad token and left padding
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def _load_model():
+    import torch
+    from transformers import AutoModelForCausalLM
+    has_gpu = torch.cuda.is_available()
+    # bitsandbytes 8-bit quantization needs a GPU; CPU nodes should use the
+    # llamacpp backend with GGUF weights instead
+    return AutoModelForCausalLM.from_pretrained(
+        settings.hf_model_name,
+        token=settings.hf_token,
+        cache_dir=settings.hf_cache_dir,
+        torch_dtype=torch.float16 if has_gpu else torch.float32,
+        device_map="auto" if has_gpu else None,
+        load_in_8bit=has_gpu,  # 8-bit quantization for 11B model
+        trust_remote_code=True
+    )
+
+
+def _load_draft_model():
+    import torch
+    from transformers import AutoModelForCausalLM
+    has_gpu = torch.cuda.is_available()
+    return AutoModelForCausalLM.from_pretrained(
+        settings.speculative_draft_model,
+        token=settings.hf_token,
+        cache_dir=settings.hf_cache_dir,
+        torch_dtype=torch.float16 if has_gpu else torch.float32,
+        device_map="auto" if has_gpu else None,
+        trust_remote_code=True
+    )
+
+
+def _unload_model(model):
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+
+
+def _load_generation_backend():
+    from services.generation_backends import create_backend
+    return create_backend()
+
+
+def _unload_generation_backend(backend):
+    backend.close()
+
+
+def _load_embeddings():
+    from langchain.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        cache_folder=settings.hf_cache_dir
+    )
+
+
+# Global registry instance
+model_registry = ModelRegistry()
+model_registry.register("tokenizer", _load_tokenizer)
+model_registry.register("model", _load_model, _unload_model)
+model_registry.register("draft_model", _load_draft_model, _unload_model)
+model_registry.register("generation_backend", _load_generation_backend, _unload_generation_backend)
+model_registry.register("embeddings", _load_embeddings)
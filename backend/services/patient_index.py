@@ -0,0 +1,135 @@
+"""
+Per-patient index of uploaded documents for retrieval-augmented explanations.
+
+Every processed upload is chunked and embedded into one persistent store
+(same backend as the knowledge index) with ``patient_id`` in each chunk's
+metadata; a patient's partition is read back through a metadata filter (the
+flat backend keeps each patient's rows, so only those are scored), so an
+upload only costs embedding its own chunks and never triggers a rebuild.
+The store is kept apart from the knowledge index, so general retrieval can
+never surface a patient's records.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from services.flat_vector_index import FlatVectorIndex
+from services.knowledge_index import add_unique, open_store, store_retriever
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "patient_documents"
+WRITE_LOCK_FILE = "write.lock"
+# A write lock older than this is assumed to belong to a crashed process
+STALE_WRITE_LOCK_SECONDS = 300
+
+
+class PatientDocumentIndex:
+    """Uploaded document chunks, partitioned by patient ID"""
+
+    def __init__(
+        self,
+        embeddings: Any,
+        index_dir: str = "./patient_documents_db",
+        chunk_size: int = 500,
+        chunk_overlap: int = 50,
+        backend: str = "chroma",
+        flat_dtype: str = "float16"
+    ):
+        self.embeddings = embeddings
+        self.index_dir = index_dir
+        self.backend = backend
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._lock = threading.Lock()
+        self.documents_indexed = 0
+        self.chunks_added = 0
+        self.last_error: Optional[str] = None
+        os.makedirs(index_dir, exist_ok=True)
+        self.store = open_store(
+            backend, index_dir, embeddings, flat_dtype,
+            collection_name=COLLECTION_NAME, partition_key="patient_id"
+        )
+
+    def add_document(self, patient_id: str, text: str, metadata: Optional[Dict[str, Any]] = None) -> int:
+        """Chunk, embed and append one document; returns how many chunks were new"""
+        if not text or not text.strip():
+            return 0
+        base = {
+            **{k: v for k, v in (metadata or {}).items() if isinstance(v, (str, int, float, bool))},
+            # The source scopes chunk IDs, so identical text from two patients stays separate
+            "source": f"patient/{patient_id}",
+            "patient_id": patient_id,
+        }
+        chunks = self.splitter.split_documents([Document(page_content=text, metadata=base)])
+        started = time.perf_counter()
+        try:
+            with self._write_lock():
+                added = add_unique(self.store, chunks, self.embeddings)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Failed to index document for patient {patient_id}: {e}")
+            raise
+        with self._lock:
+            self.documents_indexed += 1
+            self.chunks_added += added
+        logger.info(
+            f"Indexed {added}/{len(chunks)} chunks for patient {patient_id} "
+            f"in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return added
+
+    def as_retriever(self, patient_id: str, k: int = 2):
+        """Retriever restricted to one patient's documents"""
+        return store_retriever(self.store, self.embeddings, {"k": k, "filter": {"patient_id": patient_id}})
+
+    def revision(self) -> int:
+        """Grows with every insert; part of cache keys for patient-scoped answers"""
+        if isinstance(self.store, FlatVectorIndex):
+            self.store.refresh()
+            return len(self.store)
+        return self.store._collection.count()
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize appends across worker processes (the flat index has one writer)"""
+        if not isinstance(self.store, FlatVectorIndex):
+            yield
+            return
+        path = os.path.join(self.index_dir, WRITE_LOCK_FILE)
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_WRITE_LOCK_SECONDS:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+        os.close(fd)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "index_dir": self.index_dir,
+            "chunks": self.revision(),
+            "documents_indexed": self.documents_indexed,
+            "chunks_added": self.chunks_added,
+            "last_error": self.last_error,
+        }
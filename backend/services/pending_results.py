@@ -0,0 +1,235 @@
+"""
+Model results that finish after their HTTP response was sent.
+
+Fan-out endpoints in ``partial`` mode answer with their fast structured part
+right away and leave the AI part running as an asyncio task registered
+here; the client fetches it later by ID (``GET /api/medical/results/{id}``),
+optionally long-polling until it is ready. Entries live in the memory of
+the worker process that started them, are bounded in number and expire
+after a TTL. With a shared directory each entry's status and result are
+also written there, so a poll that lands on another worker is answered from
+the file.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Dict, Optional
+
+from config import settings
+from exceptions import DeadlineExceededError, ServiceOverloadedError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+TIMEOUT = "timeout"
+OVERLOADED = "overloaded"
+FAILED = "failed"
+
+# How often a worker re-reads another worker's pending entry while long-polling
+SHARED_POLL_SECONDS = 0.25
+
+
+class PendingResults:
+    """Bounded registry of background model calls, looked up by ID (event loop only)"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 600, shared_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_dir = shared_dir
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._swept_at = 0.0
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._stats = {
+            "submitted": 0,
+            DONE: 0,
+            TIMEOUT: 0,
+            OVERLOADED: 0,
+            FAILED: 0,
+            "expired": 0,
+            "evicted": 0,
+            "shared_reads": 0,
+        }
+
+    def submit(self, awaitable: Awaitable, kind: str, timeout: Optional[float] = None) -> str:
+        """Start awaitable as a task and return the ID to fetch its result by"""
+        self._prune()
+        result_id = uuid.uuid4().hex
+        task = asyncio.ensure_future(asyncio.wait_for(awaitable, timeout) if timeout else awaitable)
+        entry = {"result_id": result_id, "kind": kind, "task": task, "created_at": time.time(), "started": time.perf_counter()}
+        task.add_done_callback(lambda _: self._finished(entry))
+        self._entries[result_id] = entry
+        self._stats["submitted"] += 1
+        self._write_shared(result_id, self._record(entry))
+        return result_id
+
+    async def get(self, result_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Status (and result once done); waits up to ``wait`` seconds for a pending one"""
+        entry = self._entries.get(result_id)
+        if entry is None:
+            return await self._get_shared(result_id, wait)
+        if self._expired(entry):
+            return None
+        task = entry["task"]
+        if wait > 0 and not task.done():
+            # asyncio.wait never cancels the task it waits on
+            await asyncio.wait({task}, timeout=wait)
+        return self._describe(result_id, self._record(entry))
+
+    async def _get_shared(self, result_id: str, wait: float) -> Optional[Dict[str, Any]]:
+        """An entry started by another worker, polled from its file"""
+        if not self.shared_dir or not result_id.isalnum():
+            return None
+        stop_at = time.monotonic() + wait
+        record = self._read_shared(result_id)
+        while record is not None and record["status"] == PENDING and time.monotonic() < stop_at:
+            await asyncio.sleep(min(SHARED_POLL_SECONDS, max(0.0, stop_at - time.monotonic())))
+            record = self._read_shared(result_id)
+        if record is None:
+            return None
+        self._stats["shared_reads"] += 1
+        return self._describe(result_id, record)
+
+    def _finished(self, entry: Dict[str, Any]):
+        entry["elapsed_ms"] = round((time.perf_counter() - entry["started"]) * 1000, 1)
+        entry["finished_at"] = time.time()
+        status = self._status(entry["task"])
+        if status == FAILED and not entry["task"].cancelled():
+            logger.error(f"Pending {entry['kind']} result failed: {entry['task'].exception()}")
+        self._stats[status] += 1
+        self._write_shared(entry["result_id"], self._record(entry))
+
+    @staticmethod
+    def _status(task: "asyncio.Future") -> str:
+        if not task.done():
+            return PENDING
+        if task.cancelled():
+            return FAILED
+        error = task.exception()
+        if error is None:
+            return DONE
+        if isinstance(error, (asyncio.TimeoutError, DeadlineExceededError)):
+            return TIMEOUT
+        if isinstance(error, ServiceOverloadedError):
+            return OVERLOADED
+        return FAILED
+
+    def _record(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Status of an entry as plain data, as shared with other workers"""
+        task = entry["task"]
+        record = {"kind": entry["kind"], "status": self._status(task), "created_at": entry["created_at"]}
+        if record["status"] == DONE:
+            record["result"] = task.result()
+        if record["status"] != PENDING:
+            record["elapsed_ms"] = entry.get("elapsed_ms")
+            record["finished_at"] = entry.get("finished_at")
+        return record
+
+    @staticmethod
+    def _describe(result_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        described = {
+            "result_id": result_id,
+            "kind": record["kind"],
+            "status": record["status"],
+            "created_at": datetime.fromtimestamp(record["created_at"]).isoformat(),
+        }
+        if record["status"] == DONE:
+            described["result"] = record["result"]
+        if record["status"] != PENDING:
+            described["elapsed_ms"] = record.get("elapsed_ms")
+        return described
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        finished_at = entry.get("finished_at")
+        return finished_at is not None and time.time() - finished_at > self.ttl_seconds
+
+    def _prune(self):
+        """Drop expired results, then the oldest ones while over capacity"""
+        for result_id in [rid for rid, entry in self._entries.items() if self._expired(entry)]:
+            del self._entries[result_id]
+            self._remove_shared(result_id)
+            self._stats["expired"] += 1
+        while len(self._entries) >= self.max_entries:
+            result_id, entry = self._entries.popitem(last=False)
+            entry["task"].cancel()
+            self._remove_shared(result_id)
+            self._stats["evicted"] += 1
+        self._sweep_shared()
+
+    def _shared_path(self, result_id: str) -> str:
+        return os.path.join(self.shared_dir, f"{result_id}.json")
+
+    def _write_shared(self, result_id: str, record: Dict[str, Any]):
+        if not self.shared_dir or result_id not in self._entries:
+            return
+        path = self._shared_path(result_id)
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, default=str)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not share pending result {result_id}: {e}")
+
+    def _read_shared(self, result_id: str) -> Optional[Dict[str, Any]]:
+        path = self._shared_path(result_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unreadable shared pending result {path}: {e}")
+            return None
+        finished_at = record.get("finished_at")
+        if finished_at is not None and time.time() - finished_at > self.ttl_seconds:
+            self._remove_shared(result_id)
+            return None
+        return record
+
+    def _remove_shared(self, result_id: str):
+        if not self.shared_dir:
+            return
+        try:
+            os.remove(self._shared_path(result_id))
+        except OSError:
+            pass
+
+    def _sweep_shared(self):
+        """Remove files left behind by restarted workers, at most once per TTL"""
+        if not self.shared_dir or time.time() - self._swept_at < self.ttl_seconds:
+            return
+        self._swept_at = time.time()
+        cutoff = self._swept_at - self.ttl_seconds
+        for name in os.listdir(self.shared_dir):
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared_dir": self.shared_dir,
+            "entries": len(self._entries),
+            "pending": sum(1 for entry in self._entries.values() if not entry["task"].done()),
+            **self._stats,
+        }
+
+
+# Global registry instance
+pending_results = PendingResults(
+    max_entries=settings.pending_results_max_entries,
+    ttl_seconds=settings.pending_results_ttl_seconds,
+    shared_dir=os.path.join(settings.hf_cache_dir, "pending_results") if settings.pending_results_shared else None
+)
@@ -0,0 +1,143 @@
+"""
+Lab reference ranges compiled into one rule table.
+
+``constants.NORMAL_RANGES`` is compiled once into NumPy arrays indexed by
+test ID: the range bounds plus the cut points results are graded against --
+the analyzer's borderline / warning / critical status (percent deviation
+beyond the range), the coarse severity levels reported next to AI analyses
+and the markers on blood work charts. Single results are graded from
+per-test tuples (one dict lookup), cohorts with array operations over a
+patients x tests matrix; both give the same answers. A new lab test only
+needs an entry in ``NORMAL_RANGES``.
+"""
+
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+
+from constants import NORMAL_RANGES
+
+# Result statuses by status code; NOT_MEASURED marks empty cells of a status matrix
+STATUSES = ("normal", "borderline", "warning", "critical")
+NOT_MEASURED = -1
+
+# Default percent deviation beyond the range above which a result is a warning / critical
+WARNING_DEVIATION = 15
+CRITICAL_DEVIATION = 30
+
+# Coarse severity levels as factors of the (min, max) bounds, most severe first
+SEVERITY_FACTORS = {
+    "critical": (0.8, 1.3),
+    "slightly_critical": (0.9, 1.2)
+}
+SEVERITY_COLORS = {"critical": "red", "slightly_critical": "orange", "normal": "green"}
+
+# Charts mark results more than 10% outside the range
+CHART_FLAG_FACTORS = (0.9, 1.1)
+
+
+class ReferenceRangeTable:
+    """Reference ranges and grading cut points as arrays indexed by test ID"""
+
+    def __init__(self, ranges: Dict[str, Dict[str, Any]] = NORMAL_RANGES):
+        self.ranges = ranges
+        self.tests = list(ranges)
+        self.test_ids = {test: test_id for test_id, test in enumerate(self.tests)}
+        self.units = [ranges[test]["unit"] for test in self.tests]
+        self.categories = [ranges[test]["category"] for test in self.tests]
+
+        self.min = np.array([ranges[test]["min"] for test in self.tests], dtype=float)
+        self.max = np.array([ranges[test]["max"] for test in self.tests], dtype=float)
+        self.warning = np.array(
+            [ranges[test].get("warning", WARNING_DEVIATION) for test in self.tests], dtype=float
+        )
+        self.critical = np.array(
+            [ranges[test].get("critical", CRITICAL_DEVIATION) for test in self.tests], dtype=float
+        )
+        self.severity_bounds = {
+            level: (self.min * low, self.max * high) for level, (low, high) in SEVERITY_FACTORS.items()
+        }
+        self.chart_bounds = (self.min * CHART_FLAG_FACTORS[0], self.max * CHART_FLAG_FACTORS[1])
+
+        # Plain Python rows for grading single results without array indexing;
+        # bounds keep their configured type so results report them unchanged
+        self._grade_rows = {
+            test: (ranges[test]["min"], ranges[test]["max"], float(self.warning[i]), float(self.critical[i]))
+            for i, test in enumerate(self.tests)
+        }
+        self._severity_rows = {
+            test: [(level, float(low[i]), float(high[i])) for level, (low, high) in self.severity_bounds.items()]
+            for i, test in enumerate(self.tests)
+        }
+        self._chart_rows = {
+            test: (float(self.chart_bounds[0][i]), float(self.chart_bounds[1][i]))
+            for i, test in enumerate(self.tests)
+        }
+
+    def __contains__(self, test: str) -> bool:
+        return test in self.test_ids
+
+    def grade(self, test: str, value: float) -> Optional[Tuple[str, float]]:
+        """Status and percent deviation beyond the range of one result; None for an unknown test"""
+        row = self._grade_rows.get(test)
+        if row is None:
+            return None
+        min_val, max_val, warning, critical = row
+
+        if value < min_val:
+            deviation = ((min_val - value) / min_val) * 100
+        elif value > max_val:
+            deviation = ((value - max_val) / max_val) * 100
+        else:
+            return "normal", 0
+
+        if deviation > critical:
+            return "critical", deviation
+        elif deviation > warning:
+            return "warning", deviation
+        return "borderline", deviation
+
+    def grade_matrix(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Status codes and percent deviations for a patients x tests matrix in table order
+
+        NaN cells are tests that were not measured; they get NOT_MEASURED and
+        a NaN deviation.
+        """
+        values = np.asarray(values, dtype=float)
+        measured = ~np.isnan(values)
+        below = values < self.min
+        above = values > self.max
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviation = np.where(
+                below,
+                ((self.min - values) / self.min) * 100,
+                np.where(above, ((values - self.max) / self.max) * 100, 0.0)
+            )
+        deviation[~measured] = np.nan
+
+        status = np.select(
+            [deviation > self.critical, deviation > self.warning, below | above], [3, 2, 1], 0
+        ).astype(np.int8)
+        status[~measured] = NOT_MEASURED
+        return status, deviation
+
+    def severity(self, test: str, value: float) -> Optional[str]:
+        """Coarse severity level of one result; None for an unknown test"""
+        rows = self._severity_rows.get(test)
+        if rows is None:
+            return None
+        for level, low, high in rows:
+            if value < low or value > high:
+                return level
+        return "normal"
+
+    def chart_flagged(self, test: str, value: float, ref_min: float = 0, ref_max: float = 0) -> bool:
+        """Whether a chart should mark a result; unknown tests use the range given by the caller"""
+        row = self._chart_rows.get(test)
+        if row is None:
+            row = (ref_min * CHART_FLAG_FACTORS[0], ref_max * CHART_FLAG_FACTORS[1])
+        return value < row[0] or value > row[1]
+
+
+# Global table instance
+reference_table = ReferenceRangeTable()
@@ -0,0 +1,159 @@
+"""
+Exact-match cache for LLM responses.
+
+Keys are built from the normalized input, the prompt template version and
+the generation parameters. Entries live in a bounded in-memory LRU tier and,
+optionally, in an on-disk tier that survives restarts. Both tiers honour a
+TTL.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Case- and whitespace-insensitive form of free text"""
+    return " ".join((text or "").lower().split())
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) response cache with TTL expiry"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 86400, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "writes": 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(namespace: str, payload: Any, prompt_version: str, params: Dict[str, Any]) -> str:
+        """Stable digest of everything that determines a response"""
+        material = json.dumps(
+            {"ns": namespace, "input": payload, "prompt_version": prompt_version, "params": params},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            # Promote into the memory tier
+            self._stats["disk_hits"] += 1
+            self._insert(key, entry[0], entry[1])
+            return entry[1]
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, expires_at, value)
+            self._stats["writes"] += 1
+        self._write_disk(key, expires_at, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _insert(self, key: str, expires_at: float, value: Any):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unreadable response cache entry {path}: {e}")
+            return None
+        if record.get("expires_at", 0) <= now:
+            with self._lock:
+                self._stats["expired"] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record["expires_at"], record["value"]
+
+    def _write_disk(self, key: str, expires_at: float, value: Any):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, default=str)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not persist response cache entry: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_tier": self.disk_dir,
+                **self._stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "timestamp": datetime.now().isoformat()
+            }
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    disk_dir=os.path.join(settings.hf_cache_dir, "responses") if settings.response_cache_disk else None
+)
@@ -0,0 +1,381 @@
+"""
+Declarative risk rules.
+
+Risk detection is data: conditions (a reported risk and its
+recommendations), rules that flag a condition at a risk level when all of
+their criteria over lab tests and patient attributes hold, and modifiers
+that raise the level of detected risks for some patients (e.g. older ones).
+A rule set is compiled into a decision table -- one array of distinct
+criteria (feature, operator, threshold) and a rules x criteria incidence
+matrix -- and a single panel or a whole cohort is evaluated with the same
+array operations. The rule set can come from ``settings.risk_rules_path``
+(JSON shaped like RISK_RULES); each worker re-reads the file when it
+changes, so edits take effect without a restart.
+"""
+
+import os
+import json
+import time
+import string
+import hashlib
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Risk levels by rank; rank 0 doubles as "not detected"
+RISK_LEVELS = ("low", "moderate", "high", "critical")
+
+# Criterion operators as the signs of (value - threshold) they accept
+# (above, equal, below); a missing value (NaN) has no sign and never matches
+OPERATORS = {
+    ">": (True, False, False),
+    ">=": (True, True, False),
+    "<": (False, False, True),
+    "<=": (False, True, True),
+    "==": (False, True, False),
+    "!=": (True, False, True)
+}
+
+# Built-in rule set
+RISK_RULES = {
+    "conditions": [
+        {
+            "id": "diabetes",
+            "name": "Diabetes",
+            "recommendations": [
+                "Consult endocrinologist",
+                "Monitor blood sugar regularly",
+                "Diet and exercise changes"
+            ]
+        },
+        {
+            "id": "cardiovascular",
+            "name": "Cardiovascular Disease",
+            "recommendations": [
+                "Cardiology consultation",
+                "Heart-healthy diet",
+                "Regular exercise",
+                "Cholesterol management"
+            ]
+        },
+        {
+            "id": "kidney",
+            "name": "Kidney Disease",
+            "recommendations": [
+                "Nephrology consultation",
+                "Monitor kidney function",
+                "Stay hydrated",
+                "Avoid NSAIDs"
+            ]
+        }
+    ],
+    "rules": [
+        {
+            "id": "diabetes_hba1c_prediabetic",
+            "condition": "diabetes",
+            "level": "moderate",
+            "when": [{"test": "hba1c", "op": ">=", "value": 5.7}],
+            "indicator": "HbA1c: {hba1c}%"
+        },
+        {
+            "id": "diabetes_hba1c_diabetic",
+            "condition": "diabetes",
+            "level": "high",
+            "when": [{"test": "hba1c", "op": ">=", "value": 6.5}],
+            "indicator": "HbA1c: {hba1c}%"
+        },
+        {
+            "id": "cardiovascular_ldl",
+            "condition": "cardiovascular",
+            "level": "moderate",
+            "when": [{"test": "ldl", "op": ">", "value": 130}],
+            "indicator": "LDL: {ldl} mg/dL"
+        },
+        {
+            "id": "cardiovascular_triglycerides",
+            "condition": "cardiovascular",
+            "level": "moderate",
+            "when": [{"test": "triglycerides", "op": ">", "value": 150}],
+            "indicator": "Triglycerides: {triglycerides} mg/dL"
+        },
+        {
+            "id": "cardiovascular_hdl",
+            "condition": "cardiovascular",
+            "level": "moderate",
+            "when": [{"test": "hdl", "op": "<", "value": 40}],
+            "indicator": "HDL: {hdl} mg/dL"
+        },
+        {
+            "id": "kidney_creatinine",
+            "condition": "kidney",
+            "level": "moderate",
+            "when": [{"test": "creatinine", "op": ">", "value": 1.2}],
+            "indicator": "Creatinine: {creatinine} mg/dL"
+        },
+        {
+            "id": "kidney_creatinine_severe",
+            "condition": "kidney",
+            "level": "high",
+            "when": [{"test": "creatinine", "op": ">", "value": 2.0}],
+            "indicator": "Creatinine: {creatinine} mg/dL"
+        }
+    ],
+    "modifiers": [
+        {
+            "id": "age_over_60",
+            "when": [{"attribute": "age", "op": ">", "value": 60}],
+            "raise": {"moderate": "high"},
+            "recommendation": "Age increases risk - more frequent monitoring needed"
+        }
+    ]
+}
+
+
+def _as_float(value: Any) -> float:
+    """Numeric value of a test or attribute; NaN when missing or not a number"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return np.nan
+
+
+class RiskRuleSet:
+    """A rule set compiled into a decision table (immutable once built)"""
+
+    def __init__(self, spec: Dict[str, Any], source: str = "built-in"):
+        self.spec = spec
+        self.source = source
+        self.version = hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        self.loaded_at = datetime.now().isoformat()
+
+        self.conditions: List[Dict[str, Any]] = list(spec.get("conditions", []))
+        condition_ids = {condition["id"]: i for i, condition in enumerate(self.conditions)}
+        if len(condition_ids) != len(self.conditions):
+            raise ValueError("Duplicate condition ID in risk rules")
+
+        self.rules: List[Dict[str, Any]] = list(spec.get("rules", []))
+        self.modifiers: List[Dict[str, Any]] = list(spec.get("modifiers", []))
+        entries = self.rules + self.modifiers
+        self.entry_ids = [entry["id"] for entry in entries]
+        if len(set(self.entry_ids)) != len(self.entry_ids):
+            raise ValueError("Duplicate rule ID in risk rules")
+
+        # Features are the tests and patient attributes criteria refer to
+        self.features: List[Tuple[str, str]] = []
+        feature_ids: Dict[Tuple[str, str], int] = {}
+        criteria: Dict[Tuple[int, str, float], int] = {}
+        incidence: List[List[int]] = []
+
+        for entry in entries:
+            if not entry.get("when"):
+                raise ValueError(f"Risk rule {entry['id']} has no criteria")
+            criterion_ids = []
+            for criterion in entry["when"]:
+                kind = "test" if "test" in criterion else "attribute"
+                feature = (kind, criterion[kind])
+                if feature not in feature_ids:
+                    feature_ids[feature] = len(self.features)
+                    self.features.append(feature)
+                if criterion["op"] not in OPERATORS:
+                    raise ValueError(f"Risk rule {entry['id']}: unknown operator {criterion['op']}")
+                key = (feature_ids[feature], criterion["op"], float(criterion["value"]))
+                criterion_ids.append(criteria.setdefault(key, len(criteria)))
+            incidence.append(criterion_ids)
+
+        # Decision table: criteria as parallel arrays, rules as rows over them
+        self.criterion_feature = np.array([feature for feature, _, _ in criteria], dtype=np.intp)
+        self.criterion_value = np.array([value for _, _, value in criteria], dtype=float)
+        self.criterion_accepts = np.array([OPERATORS[op] for _, op, _ in criteria], dtype=bool).reshape(-1, 3).T
+        self.incidence = np.zeros((len(entries), len(criteria)), dtype=np.int32)
+        for row, criterion_ids in enumerate(incidence):
+            self.incidence[row, criterion_ids] = 1
+        self.criteria_per_entry = self.incidence.sum(axis=1)
+
+        # Level rank each rule sets for its condition (rules x conditions)
+        self.condition_rules: List[List[int]] = [[] for _ in self.conditions]
+        rule_levels = np.zeros((len(self.rules), len(self.conditions)), dtype=np.int8)
+        for i, rule in enumerate(self.rules):
+            if rule["condition"] not in condition_ids:
+                raise ValueError(f"Risk rule {rule['id']}: unknown condition {rule['condition']}")
+            c = condition_ids[rule["condition"]]
+            rule_levels[i, c] = self._rank(rule["level"], rule["id"])
+            self.condition_rules[c].append(i)
+        self.rules_at_level = [
+            (rank, (rule_levels == rank).astype(np.int32))
+            for rank in range(1, len(RISK_LEVELS)) if (rule_levels == rank).any()
+        ]
+
+        # Each modifier maps a level rank to a raised one
+        self.modifier_maps: List[np.ndarray] = []
+        for modifier in self.modifiers:
+            level_map = np.arange(len(RISK_LEVELS), dtype=np.int8)
+            for level_from, level_to in modifier.get("raise", {}).items():
+                level_map[self._rank(level_from, modifier["id"])] = self._rank(level_to, modifier["id"])
+            self.modifier_maps.append(level_map)
+
+        # Indicators may only quote the entry's own tests
+        for entry in entries:
+            fields = {name for _, name, _, _ in string.Formatter().parse(entry.get("indicator", "")) if name}
+            own_tests = {criterion["test"] for criterion in entry["when"] if "test" in criterion}
+            if not fields <= own_tests:
+                raise ValueError(f"Risk rule {entry['id']}: indicator refers to {sorted(fields - own_tests)}")
+
+    @staticmethod
+    def _rank(level: str, rule_id: str) -> int:
+        if level not in RISK_LEVELS or level == RISK_LEVELS[0]:
+            raise ValueError(f"Risk rule {rule_id}: invalid risk level {level}")
+        return RISK_LEVELS.index(level)
+
+    def evaluate_matrix(self, features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Evaluate patients x features (in ``self.features`` order, NaN = missing)
+
+        Returns ``fired`` (patients x rules-then-modifiers), ``levels``
+        (patients x conditions, rank 0 = not detected) and ``raised``
+        (patients x modifiers x conditions, where a modifier changed the level).
+        """
+        features = np.asarray(features, dtype=float)
+        differences = features[:, self.criterion_feature] - self.criterion_value
+        above, equal, below = self.criterion_accepts
+        met = ((differences > 0) & above) | ((differences == 0) & equal) | ((differences < 0) & below)
+        fired = (met.astype(np.int32) @ self.incidence.T) == self.criteria_per_entry
+
+        # Highest level any fired rule sets, per condition (ranks ascending, so higher ones win)
+        rules_fired = fired[:, :len(self.rules)].astype(np.int32)
+        levels = np.zeros((len(features), len(self.conditions)), dtype=np.int8)
+        for rank, rules_at_rank in self.rules_at_level:
+            levels[(rules_fired @ rules_at_rank) > 0] = rank
+
+        raised = np.zeros((len(features), len(self.modifiers), len(self.conditions)), dtype=bool)
+        for m, level_map in enumerate(self.modifier_maps):
+            applies = fired[:, len(self.rules) + m][:, None]
+            new_levels = np.where(applies, level_map[levels], levels)
+            raised[:, m] = new_levels != levels
+            levels = new_levels
+
+        return {"fired": fired, "levels": levels, "raised": raised}
+
+    def evaluate_panel(self, lab_data: Dict, attributes: Dict) -> Dict:
+        """Detected risks of one panel, with the rules that fired"""
+        row = [
+            _as_float((lab_data if kind == "test" else attributes).get(name))
+            for kind, name in self.features
+        ]
+        evaluation = self.evaluate_matrix(np.array([row], dtype=float))
+        fired = evaluation["fired"][0].tolist()
+        levels = evaluation["levels"][0].tolist()
+        raised = evaluation["raised"][0].tolist()
+
+        risks = []
+        for c, condition in enumerate(self.conditions):
+            if not levels[c]:
+                continue
+            rules_fired = [self.rules[i]["id"] for i in self.condition_rules[c] if fired[i]]
+            indicators = []
+            for i in self.condition_rules[c]:
+                if fired[i] and self.rules[i].get("indicator"):
+                    indicator = self.rules[i]["indicator"].format_map(lab_data)
+                    if indicator not in indicators:
+                        indicators.append(indicator)
+            recommendations = list(condition.get("recommendations", []))
+            for m, modifier in enumerate(self.modifiers):
+                if raised[m][c]:
+                    rules_fired.append(modifier["id"])
+                    if modifier.get("recommendation"):
+                        recommendations.append(modifier["recommendation"])
+            risks.append({
+                "condition": condition["name"],
+                "risk_level": RISK_LEVELS[levels[c]],
+                "indicators": indicators,
+                "recommendations": recommendations,
+                "rules_fired": rules_fired
+            })
+
+        return {
+            "detected_risks": risks,
+            "total_risks": len(risks),
+            "highest_risk": RISK_LEVELS[max(levels, default=0)],
+            "rules_fired": [entry_id for entry_id, hit in zip(self.entry_ids, fired) if hit],
+            "rule_set_version": self.version,
+            "analyzed_at": datetime.now().isoformat()
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "conditions": len(self.conditions),
+            "rules": len(self.rules),
+            "modifiers": len(self.modifiers),
+            "criteria": len(self.criterion_value),
+        }
+
+
+class RiskRules:
+    """The active rule set, swapped for a new one when its file changes"""
+
+    def __init__(self, path: Optional[str] = None, check_seconds: float = 5.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._rule_set = RiskRuleSet(RISK_RULES)
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._stats = {"reloads": 0, "failed_reloads": 0, "last_error": None}
+        if path:
+            self.reload()
+
+    @property
+    def current(self) -> RiskRuleSet:
+        """Active rule set; checks the file for changes at most every check_seconds"""
+        if self.path and time.monotonic() - self._checked_at >= self.check_seconds:
+            self._checked_at = time.monotonic()
+            if self._file_mtime() != self._mtime:
+                self.reload()
+        return self._rule_set
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self) -> bool:
+        """Compile the rule file and switch to it; keeps the active set on error"""
+        if not self.path:
+            return False
+        with self._lock:
+            mtime = self._file_mtime()
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    rule_set = RiskRuleSet(json.load(f), source=self.path)
+            except Exception as e:
+                # Not retried until the file changes again
+                self._mtime = mtime
+                self._stats["failed_reloads"] += 1
+                self._stats["last_error"] = str(e)
+                logger.error(f"Could not load risk rules {self.path}: {e}")
+                return False
+            self._rule_set = rule_set
+            self._mtime = mtime
+            self._stats["reloads"] += 1
+            self._stats["last_error"] = None
+            logger.info(f"Loaded risk rules {rule_set.version} from {self.path}")
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "check_seconds": self.check_seconds,
+            "active": self._rule_set.describe(),
+            **self._stats,
+        }
+
+
+# Global rule set instance
+risk_rules = RiskRules(settings.risk_rules_path, settings.risk_rules_check_seconds)
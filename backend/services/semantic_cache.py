@@ -0,0 +1,151 @@
+"""
+Semantic similarity cache for free-text explanation queries.
+
+Each answered query is stored with its (L2-normalized) embedding in a
+preallocated float32 matrix. A new query is answered from the cache when its
+cosine similarity to a stored query of the same route clears that route's
+threshold. Entries are keyed on the user's own words (``semantic_key``),
+never on the templated retrieval query.
+"""
+
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def semantic_key(text: str, context: str = "") -> str:
+    """Text a query is embedded as for the cache: what the user wrote, without prompt boilerplate
+
+    Template words shared by every query would dominate the similarity, so
+    e.g. hypertension and hypotension questions could clear the threshold.
+    """
+    return f"{text}\n{context}" if context else text
+
+
+class SemanticCache:
+    """Compact in-memory vector index of previous answers"""
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: int = 86400,
+        default_threshold: float = 0.92,
+        route_thresholds: Optional[Dict[str, float]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.default_threshold = default_threshold
+        self.route_thresholds = dict(route_thresholds or {})
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._route_ids: Dict[str, int] = {}
+        self._route_codes = np.full(max_entries, -1, dtype=np.int32)
+        self._values: List[Any] = [None] * max_entries
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "writes": 0}
+
+    def threshold_for(self, route: str) -> float:
+        # "explain/<variant>" uses the threshold configured for "explain"
+        return self.route_thresholds.get(route.split("/", 1)[0], self.default_threshold)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, route: str, vector) -> Optional[Tuple[Any, float]]:
+        """Return (value, similarity) of the closest live entry above threshold"""
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._matrix is None or not self._occupied.any():
+                self._stats["misses"] += 1
+                return None
+
+            expired = self._occupied & (self._expires_at <= now)
+            if expired.any():
+                self._stats["expired"] += int(expired.sum())
+                self._free(np.flatnonzero(expired))
+
+            code = self._route_ids.get(route, -1)
+            idx = np.flatnonzero(self._occupied & (self._route_codes == code))
+            if not idx.size:
+                self._stats["misses"] += 1
+                return None
+
+            scores = self._matrix[idx] @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold_for(route):
+                self._stats["misses"] += 1
+                return None
+
+            slot = int(idx[best])
+            self._last_used[slot] = now
+            self._stats["hits"] += 1
+            return self._values[slot], similarity
+
+    def add(self, route: str, vector, value: Any):
+        """Store an answer, evicting the least recently used entry if full"""
+        vec = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(~self._occupied)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._stats["evictions"] += 1
+            self._matrix[slot] = vec
+            self._route_codes[slot] = self._route_ids.setdefault(route, len(self._route_ids))
+            self._values[slot] = value
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            self._occupied[slot] = True
+            self._stats["writes"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._free(np.flatnonzero(self._occupied))
+
+    def _free(self, slots):
+        for slot in slots:
+            self._values[slot] = None
+        self._route_codes[slots] = -1
+        self._occupied[slots] = False
+        self._last_used[slots] = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": int(self._occupied.sum()),
+                "max_entries": self.max_entries,
+                "default_threshold": self.default_threshold,
+                "route_thresholds": self.route_thresholds,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                "timestamp": datetime.now().isoformat()
+            }
+
+
+# Global semantic cache instance
+semantic_cache = SemanticCache(
+    max_entries=settings.semantic_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    default_threshold=settings.semantic_cache_threshold,
+    route_thresholds=settings.semantic_cache_route_thresholds
+)
@@ -5,9 +5,17 @@ from datetime import datetime
 import json
 import logging
 
+from services.lab_trends import lab_trend_store, trend_states_from_history, trend_time, update_trend_state
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read-fold-write attempts at a lab_trends row before the update is given up
+TREND_UPDATE_ATTEMPTS = 5
+# IDs of the newest lab results folded into a lab_trends row, kept so a result
+# is never folded twice (e.g. once by a history rebuild, once by its own save)
+TREND_FOLDED_IDS = 64
+
 class SupabaseService:
     """Supabase database service for medical data"""
     
@@ -33,10 +41,12 @@ class SupabaseService:
             else:
                 logger.warning("Supabase credentials not found, using local storage")
                 self.connected = False
+                self.initialize_demo_tables()
                 
         except Exception as e:
             logger.error(f"Error initializing Supabase client: {e}")
             self.connected = False
+            self.initialize_demo_tables()
     
     def initialize_demo_tables(self):
         """Initialize demo tables if they don't exist"""
@@ -187,16 +197,138 @@ class SupabaseService:
                 
                 lab_record["id"] = f"lab_{datetime.now().timestamp()}"
                 self.demo_data["lab_results"].append(lab_record)
+                self._update_lab_trends(patient_id, lab_data, lab_record["test_date"], lab_record["id"])
                 return True
             
             # Real Supabase insert
             response = self.client.table("lab_results").insert(lab_record).execute()
-            return len(response.data) > 0
+            saved = len(response.data) > 0
+            if saved:
+                self._update_lab_trends(patient_id, lab_data, lab_record["test_date"], response.data[0]["id"])
+            return saved
             
         except Exception as e:
             logger.error(f"Error saving lab results: {e}")
             return False
     
+    def _update_lab_trends(self, patient_id: str, lab_data: Dict, test_date: str, result_id: Any):
+        """Fold a saved panel into the patient's trend states, one O(1) update per test
+
+        lab_trends rows (patient_id, test_name, state, folded_ids, version,
+        updated_at; unique on patient_id, test_name) are updated
+        optimistically: a write only lands if the row still has the version
+        that was read, else the test is read and folded again. folded_ids
+        lists the newest lab results in the state, so a result that is already
+        there is skipped. When a test has no row yet, every test of the
+        patient without one is built from the whole history first.
+        """
+        try:
+            if not self.connected:
+                lab_trend_store.add(patient_id, lab_data, test_date)
+                return
+            
+            tests = [test for test, value in lab_data.items() if isinstance(value, (int, float))]
+            for _ in range(TREND_UPDATE_ATTEMPTS):
+                if not tests:
+                    return
+                rows = self._lab_trend_rows(patient_id, tests)
+                if any(test not in rows for test in tests):
+                    self._backfill_lab_trends(patient_id)
+                    rows = self._lab_trend_rows(patient_id, tests)
+                conflicts = []
+                for test in tests:
+                    row = rows.get(test)
+                    if row is None:
+                        conflicts.append(test)
+                        continue
+                    folded = row.get("folded_ids") or []
+                    if result_id in folded:
+                        continue
+                    state = update_trend_state(row["state"], lab_data[test], test_date)
+                    folded = (folded + [result_id])[-TREND_FOLDED_IDS:]
+                    if not self._write_lab_trend(patient_id, test, state, folded, row["version"]):
+                        conflicts.append(test)
+                tests = conflicts
+            if tests:
+                logger.error(f"Gave up updating lab trends {tests} for patient {patient_id} after concurrent writes")
+            
+        except Exception as e:
+            # The lab result itself is saved; only its trend update is lost
+            logger.error(f"Error updating lab trends: {e}")
+    
+    def _lab_trend_rows(self, patient_id: str, tests: Optional[List[str]] = None) -> Dict[str, Dict]:
+        query = self.client.table("lab_trends")\
+            .select("test_name, state, folded_ids, version")\
+            .eq("patient_id", patient_id)
+        if tests is not None:
+            query = query.in_("test_name", tests)
+        return {row["test_name"]: row for row in query.execute().data}
+    
+    def _backfill_lab_trends(self, patient_id: str):
+        """Build every test of the patient that has results but no lab_trends row from its history"""
+        history = self.client.table("lab_results")\
+            .select("id, lab_data, test_date")\
+            .eq("patient_id", patient_id)\
+            .execute().data
+        history.sort(key=lambda row: trend_time(row["test_date"]))
+        states = trend_states_from_history((row["test_date"], row["lab_data"]) for row in history)
+        folded = [row["id"] for row in history][-TREND_FOLDED_IDS:]
+        existing = self._lab_trend_rows(patient_id)
+        for test, state in states.items():
+            if test not in existing:
+                self._insert_lab_trend(patient_id, test, state, folded)
+    
+    def _insert_lab_trend(self, patient_id: str, test: str, state: Dict, folded: List) -> bool:
+        """Create a test's row; False when another save created it first"""
+        try:
+            self.client.table("lab_trends").insert({
+                "patient_id": patient_id,
+                "test_name": test,
+                "state": state,
+                "folded_ids": folded,
+                "version": 1,
+                "updated_at": datetime.now().isoformat()
+            }).execute()
+            return True
+        except Exception as e:
+            logger.info(f"Lab trend {test} for patient {patient_id} was created concurrently: {e}")
+            return False
+    
+    def _write_lab_trend(self, patient_id: str, test: str, state: Dict, folded: List, version: int) -> bool:
+        """Replace a test's state if its row is still at version; False on a concurrent write"""
+        response = self.client.table("lab_trends")\
+            .update({
+                "state": state,
+                "folded_ids": folded,
+                "version": version + 1,
+                "updated_at": datetime.now().isoformat()
+            })\
+            .eq("patient_id", patient_id)\
+            .eq("test_name", test)\
+            .eq("version", version)\
+            .execute()
+        return len(response.data) > 0
+    
+    def get_lab_trends(self, patient_id: str) -> Dict[str, Dict]:
+        """Incremental trend state per test for a patient (see services.lab_trends)
+
+        Patients whose results predate trend states get them built from their
+        history on first read, and stored.
+        """
+        try:
+            if not self.connected:
+                return lab_trend_store.get(patient_id)
+            
+            rows = self._lab_trend_rows(patient_id)
+            if not rows:
+                self._backfill_lab_trends(patient_id)
+                rows = self._lab_trend_rows(patient_id)
+            return {test: row["state"] for test, row in rows.items()}
+            
+        except Exception as e:
+            logger.error(f"Error getting lab trends: {e}")
+            return {}
+    
     def get_lab_history(self, patient_id: str, limit: int = 10) -> List[Dict]:
         """Get lab result history for a patient"""
         try:
@@ -12,6 +12,8 @@ import json
 import os
 from datetime import datetime
 
+from services.reference_ranges import reference_table
+
 class VisualizationService:
     """Generate medical visualizations and charts"""
     
@@ -44,12 +46,17 @@ class VisualizationService:
         references_max = []
         colors = []
         status_texts = []
+        flagged = []
         
         for test_name, test_data in data.get("results", {}).items():
+            value = test_data.get("value", 0)
+            ref_min = test_data.get("min_reference", 0)
+            ref_max = test_data.get("max_reference", 0)
             tests.append(test_name.upper())
-            values.append(test_data.get("value", 0))
-            references_min.append(test_data.get("min_reference", 0))
-            references_max.append(test_data.get("max_reference", 0))
+            values.append(value)
+            references_min.append(ref_min)
+            references_max.append(ref_max)
+            flagged.append(reference_table.chart_flagged(test_name.lower(), value, ref_min, ref_max))
             colors.append(test_data.get("color", "#6B7280"))
             status_texts.append(test_data.get("status_text", "Unknown"))
         
@@ -110,10 +117,8 @@ class VisualizationService:
         )
         
         # Add annotations for critical values
-        for i, (test, value) in enumerate(zip(tests, values)):
-            ref_min = references_min[i]
-            ref_max = references_max[i]
-            if value < ref_min * 0.9 or value > ref_max * 1.1:
+        for test, value, is_flagged in zip(tests, values, flagged):
+            if is_flagged:
                 fig.add_annotation(
                     x=test,
                     y=value,
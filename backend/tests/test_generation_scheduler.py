@@ -0,0 +1,80 @@
+"""Dynamic batching: expired requests never reach a batch"""
+
+import threading
+import time
+
+import pytest
+
+from exceptions import DeadlineExceededError
+from services.deadlines import DEADLINE, DISCONNECT, Deadline
+from services.generation_scheduler import GenerationRequest, GenerationScheduler
+
+
+class RecordingBackend:
+    """Echoes each prompt, remembering the batches it was given"""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, batch):
+        self.gate.wait(5)
+        self.batches.append([request.prompt for request in batch])
+        return [{"text": request.prompt.upper(), "new_tokens": 3} for request in batch]
+
+
+@pytest.fixture
+def backend():
+    return RecordingBackend()
+
+
+@pytest.fixture
+def scheduler(backend):
+    scheduler = GenerationScheduler(backend, max_batch_size=4, max_wait_ms=10)
+    yield scheduler
+    scheduler.stop()
+
+
+def _expired(reason: str) -> Deadline:
+    if reason == DISCONNECT:
+        deadline = Deadline()
+        deadline.cancel(DISCONNECT)
+        return deadline
+    deadline = Deadline(timeout=0.001)
+    time.sleep(0.005)
+    return deadline
+
+
+@pytest.mark.parametrize("reason", [DEADLINE, DISCONNECT])
+def test_expired_request_is_dropped_before_batching(scheduler, backend, reason):
+    expired = GenerationRequest("expired", max_new_tokens=40, deadline=_expired(reason))
+    live = GenerationRequest("live", max_new_tokens=40)
+    futures = scheduler.submit_many([expired, live])
+
+    assert futures[1].result(timeout=5) == {"text": "LIVE", "new_tokens": 3}
+    with pytest.raises(DeadlineExceededError) as error:
+        futures[0].result(timeout=5)
+    assert error.value.reason == reason
+    assert backend.batches == [["live"]]
+
+    metrics = scheduler.get_metrics()
+    assert metrics["cancelled_before_start"] == 1
+    assert metrics["cancelled_by_reason"] == {reason: 1}
+    assert metrics["tokens_saved"] == 40
+
+
+def test_request_expiring_while_queued_is_dropped(scheduler, backend):
+    # Hold the generation thread on a first batch while the second request expires
+    backend.gate.clear()
+    first = scheduler.submit(GenerationRequest("first"))
+    time.sleep(0.05)
+    deadline = Deadline(timeout=0.02)
+    late = scheduler.submit(GenerationRequest("late", deadline=deadline))
+    time.sleep(0.05)
+    backend.gate.set()
+
+    assert first.result(timeout=5)["text"] == "FIRST"
+    with pytest.raises(DeadlineExceededError):
+        late.result(timeout=5)
+    assert backend.batches == [["first"]]
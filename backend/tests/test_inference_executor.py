@@ -0,0 +1,99 @@
+"""Admission and shedding in the inference executor"""
+
+import asyncio
+import threading
+
+import pytest
+
+from exceptions import ServiceOverloadedError
+from services.admission import BACKGROUND, INTERACTIVE, NORMAL, request_priority
+from services.inference_executor import InferenceExecutor
+
+
+async def _submit(executor: InferenceExecutor, priority: str, fn, user=None) -> asyncio.Task:
+    """Start a call in a priority class and let it reach the queue"""
+    with request_priority(priority, user):
+        task = asyncio.ensure_future(executor.run(fn))
+    await asyncio.sleep(0.01)
+    return task
+
+
+async def _occupy(executor: InferenceExecutor):
+    """Keep the only worker busy until the returned event is set"""
+    release = threading.Event()
+    task = await _submit(executor, NORMAL, release.wait)
+    return release, task
+
+
+def test_full_queue_sheds_lowest_class_newest_first():
+    async def scenario():
+        executor = InferenceExecutor(max_workers=1, max_queue_depth=2, retry_after_seconds=7)
+        release, running = await _occupy(executor)
+        older = await _submit(executor, BACKGROUND, lambda: "older")
+        newer = await _submit(executor, BACKGROUND, lambda: "newer")
+
+        # A more important call takes the newest background call's place
+        interactive = await _submit(executor, INTERACTIVE, lambda: "interactive")
+        assert newer.done() and not older.done()
+        with pytest.raises(ServiceOverloadedError) as shed:
+            newer.result()
+        assert shed.value.status_code == 503
+        assert shed.value.headers == {"Retry-After": "7"}
+
+        normal = await _submit(executor, NORMAL, lambda: "normal")
+        assert older.done()
+        with pytest.raises(ServiceOverloadedError):
+            older.result()
+
+        # Nothing less important is left to shed
+        rejected = await _submit(executor, BACKGROUND, lambda: "rejected")
+        with pytest.raises(ServiceOverloadedError) as error:
+            rejected.result()
+        assert error.value.headers == {"Retry-After": "7"}
+
+        release.set()
+        assert await interactive == "interactive"
+        assert await normal == "normal"
+        await running
+        stats = executor.get_stats()
+        assert stats["classes"][BACKGROUND]["shed"] == 2
+        assert stats["classes"][BACKGROUND]["rejected"] == 1
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_queue_share_caps_a_class():
+    async def scenario():
+        executor = InferenceExecutor(max_workers=1, max_queue_depth=4, queue_shares={BACKGROUND: 0.5})
+        release, running = await _occupy(executor)
+        accepted = [await _submit(executor, BACKGROUND, lambda: None) for _ in range(2)]
+        # Half the queue is taken: background is refused, normal still queues
+        refused = await _submit(executor, BACKGROUND, lambda: None)
+        with pytest.raises(ServiceOverloadedError):
+            refused.result()
+        normal = await _submit(executor, NORMAL, lambda: "normal")
+        assert not normal.done()
+
+        release.set()
+        await asyncio.gather(running, normal, *accepted)
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_higher_class_dispatched_first():
+    async def scenario():
+        executor = InferenceExecutor(
+            max_workers=1, max_queue_depth=8, weights={INTERACTIVE: 100, NORMAL: 1, BACKGROUND: 1}
+        )
+        release, running = await _occupy(executor)
+        order = []
+        background = await _submit(executor, BACKGROUND, lambda: order.append(BACKGROUND))
+        interactive = await _submit(executor, INTERACTIVE, lambda: order.append(INTERACTIVE))
+        release.set()
+        await asyncio.gather(running, background, interactive)
+        assert order == [INTERACTIVE, BACKGROUND]
+        executor.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+"""Incremental trend states against batch computations"""
+
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from services.lab_trends import (
+    fitted_change,
+    trend_slope,
+    trend_states_from_history,
+    trend_time,
+    update_trend_state,
+)
+
+
+def _history(seed: int, size: int):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    dates = [(start + timedelta(days=rng.uniform(0, 700))).isoformat() for _ in range(size)]
+    values = [round(rng.uniform(70, 180), 1) for _ in range(size)]
+    return dates, values
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_state_matches_batch_least_squares(seed):
+    dates, values = _history(seed, 40)
+    state = None
+    # Results arrive in any order; the fit does not depend on it
+    for date, value in zip(dates, values):
+        state = update_trend_state(state, value, date, alpha=0.3)
+
+    t = np.array([trend_time(date) for date in dates])
+    slope, intercept = np.polyfit(t, values, 1)
+    assert state["count"] == len(values)
+    assert state["mean_value"] == pytest.approx(np.mean(values))
+    assert trend_slope(state) == pytest.approx(slope, rel=1e-6)
+    assert state["min"] == min(values) and state["max"] == max(values)
+
+    first, last = int(np.argmin(t)), int(np.argmax(t))
+    assert state["first_value"] == values[first] and state["last_value"] == values[last]
+    fitted = fitted_change(state)
+    assert fitted["start"] == pytest.approx(intercept + slope * t[first], rel=1e-6)
+    assert fitted["change"] == pytest.approx(slope * (t[last] - t[first]), rel=1e-6)
+
+
+def test_history_is_folded_in_date_order():
+    dates, values = _history(7, 20)
+    panels = [(date, {"glucose": value}) for date, value in zip(dates, values)]
+    state = trend_states_from_history(reversed(panels), alpha=0.3)["glucose"]
+
+    ewma = None
+    for _, value in sorted(zip(dates, values), key=lambda pair: trend_time(pair[0])):
+        ewma = value if ewma is None else 0.3 * value + 0.7 * ewma
+    assert state["ewma"] == pytest.approx(ewma)
+
+
+def test_undated_history_is_timed_by_position():
+    states = trend_states_from_history([(None, {"glucose": 100}), (None, {"glucose": 140})])
+    assert states["glucose"]["ordinal"] is True
+    assert trend_slope(states["glucose"]) == pytest.approx(40)
+    assert fitted_change(states["glucose"]) == {"start": pytest.approx(100), "change": pytest.approx(40)}
+
+
+def test_single_date_has_no_slope():
+    state = update_trend_state(None, 100, "2024-01-01")
+    state = update_trend_state(state, 120, "2024-01-01")
+    assert trend_slope(state) == 0.0
+    assert fitted_change(state)["change"] == 20
@@ -0,0 +1,97 @@
+"""Vectorized cohort analysis against the per-panel path"""
+
+import math
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.medical_analyzer import MedicalAnalyzer
+
+CATEGORIES = ["metabolic", "cardiovascular", "renal", "electrolytes", "hematology"]
+RISK_COLUMNS = {
+    "Diabetes": "risk_diabetes",
+    "Cardiovascular Disease": "risk_cardiovascular",
+    "Kidney Disease": "risk_kidney",
+}
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return MedicalAnalyzer()
+
+
+def _panels(analyzer: MedicalAnalyzer, size: int, seed: int = 3):
+    """Random panels with values on and around the reference limits"""
+    rng = random.Random(seed)
+    tests = list(analyzer.reference_ranges)
+    panels, ages = [], []
+    for i in range(size):
+        panel = {}
+        for test in rng.sample(tests, 0 if i % 50 == 0 else rng.randint(1, len(tests))):
+            low, high = analyzer.reference_ranges[test]["min"], analyzer.reference_ranges[test]["max"]
+            span = high - low
+            panel[test] = rng.choice([
+                round(rng.uniform(max(low - span * 0.5, 0.01), high + span), rng.choice([0, 1, 2])),
+                low, high, low * 0.85, high * 1.15, high * 1.3, 5.7, 6.5, 130, 2.0
+            ])
+        panels.append(panel)
+        ages.append(rng.choice([30, 60, 61, 80]))
+    return tests, panels, ages
+
+
+def _missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def test_cohort_matches_per_panel(analyzer):
+    tests, panels, ages = _panels(analyzer, 400)
+    # Column order differs from the reference table on purpose
+    table = pd.DataFrame([{test: panel.get(test, np.nan) for test in reversed(tests)} for panel in panels])
+    table["age"] = ages
+    result = analyzer.analyze_cohort(table)
+    assert list(result.index) == list(table.index)
+
+    for (_, row), panel, age in zip(result.iterrows(), panels, ages):
+        categorized = analyzer.categorize_lab_results(panel)
+        for test in tests:
+            if test in categorized:
+                assert row[f"{test}_status"] == categorized[test]["status"]
+                assert row[f"{test}_deviation_percent"] == categorized[test]["deviation_percent"]
+            else:
+                assert _missing(row[f"{test}_status"]) and _missing(row[f"{test}_deviation_percent"])
+
+        score = analyzer.calculate_health_score(panel)
+        assert row["health_score"] == score["score"]
+        assert row["health_status"] == score["status"]
+        assert (None if _missing(row["health_status_color"]) else row["health_status_color"]) == score.get("status_color")
+        category_scores = {name.lower(): value for name, value in score.get("category_scores", {}).items()}
+        for category in CATEGORIES:
+            if category in category_scores:
+                assert row[f"{category}_score"] == category_scores[category]
+            else:
+                assert _missing(row[f"{category}_score"])
+
+        risks = analyzer.detect_risk_factors(panel, age)
+        levels = {risk["condition"]: risk["risk_level"] for risk in risks["detected_risks"]}
+        for condition, column in RISK_COLUMNS.items():
+            assert (None if _missing(row[column]) else row[column]) == levels.get(condition)
+        assert row["total_risks"] == risks["total_risks"]
+        assert row["highest_risk"] == risks["highest_risk"]
+
+
+def test_cohort_accepts_arrays(analyzer):
+    tests, panels, ages = _panels(analyzer, 50, seed=11)
+    table = pd.DataFrame([{test: panel.get(test, np.nan) for test in tests} for panel in panels])
+    from_frame = analyzer.analyze_cohort(table, ages=ages)
+    from_arrays = analyzer.analyze_cohort({test: table[test].to_numpy() for test in tests}, ages=np.array(ages))
+    pd.testing.assert_frame_equal(from_arrays, from_frame[from_arrays.columns])
+
+
+def test_undated_trend_has_no_slope(analyzer):
+    trends = analyzer.generate_trend_analysis([{"glucose": 100}, {"glucose": 140}])
+    glucose = trends["trends"]["glucose"]
+    assert "slope_per_day" not in glucose
+    assert glucose["percent_change"] == 40.0
+    assert trends["analysis_period"] == "undated to undated"
@@ -0,0 +1,81 @@
+"""
+Near-miss queries must not be answered from each other's semantic cache entries.
+
+The cache compares ``semantic_key`` embeddings. Templated retrieval queries
+share most of their words, so pairs that differ in the one word that
+matters come out nearly identical.
+"""
+
+import re
+import zlib
+
+import numpy as np
+import pytest
+
+from services.semantic_cache import SemanticCache, semantic_key
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+THRESHOLDS = {"explain": 0.92, "symptoms": 0.95}
+
+# (route, text, other text, context)
+NEAR_MISSES = [
+    ("explain", "hypertension", "hypotension", "What does this mean for me?"),
+    ("explain", "hyperglycemia", "hypoglycemia", "What does this mean for me?"),
+    ("explain", "HbA1c of 6.1%", "HbA1c of 9.1%", "Is this a problem?"),
+    ("symptoms", "fever, cough, headache", "fever, cough, chest pain", ""),
+    ("symptoms", "fatigue, thirst, frequent urination", "fatigue, thirst, weight gain", ""),
+]
+
+
+def templated(text: str, context: str) -> str:
+    """The retrieval query built around the text (LlamaMedicalService._rag_query)"""
+    query = f"Explain in simple terms for a patient: {text}"
+    return query + f" Context: {context}" if context else query
+
+
+def bag_of_words(text: str, dim: int = 1024) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[zlib.crc32(token.encode()) % dim] += 1
+    return vector
+
+
+def cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def cache_text(route: str, text: str, context: str) -> str:
+    # The symptoms route wraps the list in fixed wording and passes the list as cache_text
+    return text if route == "symptoms" else semantic_key(text, context)
+
+
+def test_semantic_key_is_the_users_text():
+    assert semantic_key("hypertension") == "hypertension"
+    assert semantic_key("hypertension", "What does this mean?") == "hypertension\nWhat does this mean?"
+
+
+@pytest.mark.parametrize("route, text, other, context", NEAR_MISSES)
+def test_near_misses_miss_the_cache(route, text, other, context):
+    cache = SemanticCache(max_entries=8, route_thresholds=THRESHOLDS)
+    cache.add(route, bag_of_words(cache_text(route, text, context)), {"explanation": text})
+    assert cache.lookup(route, bag_of_words(cache_text(route, other, context))) is None
+    # The same question is still a hit
+    assert cache.lookup(route, bag_of_words(cache_text(route, text, context))) is not None
+
+
+@pytest.mark.parametrize("route, text, other, context", [pair for pair in NEAR_MISSES if pair[0] == "explain"])
+def test_templated_queries_would_have_matched(route, text, other, context):
+    assert cosine(bag_of_words(templated(text, context)), bag_of_words(templated(other, context))) >= THRESHOLDS[route]
+    assert cosine(bag_of_words(semantic_key(text, context)), bag_of_words(semantic_key(other, context))) < THRESHOLDS[route]
+
+
+@pytest.mark.parametrize("route, text, other, context", NEAR_MISSES)
+def test_near_misses_with_embedding_model(route, text, other, context):
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    try:
+        model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL_NAME)
+    except Exception as e:
+        pytest.skip(f"Embedding model unavailable: {e}")
+    a, b = model.encode([cache_text(route, text, context), cache_text(route, other, context)])
+    assert cosine(a, b) < THRESHOLDS[route]